@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Multiple backend support.
+
+When more than one backend is configured, the backend hosting each LUN is
+recorded in a local index, so that looking a LUN up only needs to query a
+single storage system. If a LUN is not found where the index says it is, all
+the backends are queried in parallel.
+"""
+
+import os
+import logging
+import threading
+import contextlib
+
+from extstorage_dataontap.client import utils
+
+LOG = logging.getLogger(__name__)
+
+# File hosting the LUN name to backend index
+INDEX_FILE = '/var/lib/extstorage-dataontap/backends.json'
+# Lock file protecting the index
+LOCK_FILE = '/var/lib/extstorage-dataontap/backends.lock'
+
+
+def backend_file(path, backend):
+    """Returns the per backend version of a state file path"""
+    root, ext = os.path.splitext(path)
+    return "%s-%s%s" % (root, backend, ext)
+
+
+@contextlib.contextmanager
+def using_backend(provider, name):
+    """Perform the operations of the block on a backend. The default backend
+    is selected again afterwards, even if the block raised."""
+    provider._select_backend(name)
+    try:
+        yield provider.backend
+    finally:
+        provider._select_backend(provider.default_backend)
+
+
+def iter_backends(provider, names=None):
+    """Yields the backends of a provider (or only the named ones), each one
+    selected while the caller handles it"""
+    for backend in provider.backends:
+        if names and backend['NAME'] not in names:
+            continue
+        with using_backend(provider, backend['NAME']):
+            yield backend
+
+
+def run_parallel(func, items):
+    """Call func for every item in a separate thread. Returns a dictionary
+    mapping the items to the results or to the exceptions raised."""
+    results = {}
+
+    def run(item):
+        try:
+            results[item] = func(item)
+        except Exception as e:
+            results[item] = e
+
+    threads = [threading.Thread(target=run, args=(item,)) for item in items]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+class BackendIndex(object):
+    """Maps LUN names to the backends hosting them"""
+
+    def get(self, name):
+        """Returns the backend recorded for a LUN or None"""
+        return utils.load_state(INDEX_FILE, {}).get(name)
+
+    def _update(self, name, backend):
+        """Record the backend of a LUN. A backend of None removes the LUN
+        from the index."""
+        def modify(index):
+            if index.get(name) == backend:
+                return False
+            if backend is None:
+                del index[name]
+            else:
+                index[name] = backend
+            return True
+
+        utils.modify_state(INDEX_FILE, LOCK_FILE, modify, {})
+
+    def set(self, name, backend):
+        """Record the backend of a LUN"""
+        LOG.debug("Recording LUN %s on backend %s", name, backend)
+        self._update(name, backend)
+
+    def delete(self, name):
+        """Remove a LUN from the index"""
+        LOG.debug("Removing LUN %s from the backend index", name)
+        self._update(name, None)
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
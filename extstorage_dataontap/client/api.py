@@ -22,11 +22,18 @@ NetApp API for Data ONTAP and OnCommand DFM.
 Contains classes required to issue API calls to Data ONTAP and OnCommand DFM.
 """
 
+import re
 import copy
+import time
+import errno
+import random
+import socket
+import threading
 
 from lxml import etree
 import logging
 import six
+from six.moves import queue
 from six.moves import urllib
 
 from extstorage_dataontap import exception
@@ -36,6 +43,162 @@ LOG = logging.getLogger(__name__)
 
 ESIS_CLONE_NOT_LICENSED = '14956'
 
+# Matches the names of the APIs that only read information and can be safely
+# sent more than once (e.g. lun-get-iter, system-get-ontapi-version)
+READ_API_REGEXP = re.compile(r'(^|-)(get|list)(-|$)')
+
+
+def is_read_api(api_name):
+    """Check if an API only reads information"""
+    return READ_API_REGEXP.search(api_name) is not None
+
+
+# API errors that mean that the call has not been executed because the server
+# is busy or throttling the clients. Numeric codes are zAPI error numbers,
+# the rest are HTTP status codes.
+EBUSY = '16'
+EAGAIN = '11'
+EANOTHER_OP_ACTIVE = '17131'
+RETRYABLE_ERROR_CODES = (EBUSY, EAGAIN, EANOTHER_OP_ACTIVE, '429', '503')
+# HTTP status codes of gateways that may have forwarded the call to the server
+# before failing. Only calls that read information are retried on them.
+READ_RETRYABLE_ERROR_CODES = ('502', '504')
+
+# Socket errors that are expected to go away
+RETRYABLE_ERRNOS = (errno.ECONNREFUSED, errno.ECONNRESET, errno.ECONNABORTED,
+                    errno.ETIMEDOUT, errno.EHOSTUNREACH, errno.ENETUNREACH,
+                    errno.EPIPE)
+
+# Time to wait before the first retry in seconds
+RETRY_INTERVAL = 0.5
+# Upper bound of the time to wait between two retries in seconds
+RETRY_MAX_INTERVAL = 8.0
+# Fraction of the retry interval that is randomized
+RETRY_JITTER = 0.25
+
+
+def _is_transient(reason):
+    """Check if the reason a connection failed is expected to go away.
+    Name resolution and certificate errors are not."""
+    if isinstance(reason, socket.timeout):
+        return True
+    return getattr(reason, 'errno', None) in RETRYABLE_ERRNOS
+
+
+def is_retryable(error, read):
+    """Check if a failed call may be retried. Calls that reached the server
+    without getting a response are only retried if they only read
+    information."""
+    if isinstance(error, NaApiDeadlineError):
+        return False
+    if isinstance(error, NaApiConnectionError):
+        return error.transient
+    if isinstance(error, NaApiResponseError):
+        return read
+    code = six.text_type(error.code)
+    if code in READ_RETRYABLE_ERROR_CODES:
+        return read
+    return code in RETRYABLE_ERROR_CODES
+
+
+def is_server_error(error):
+    """Check if an error has been returned by the server in a zAPI response,
+    as opposed to a connection, timeout, HTTP or throttling error"""
+    return type(error) is NaApiError and \
+        isinstance(error.code, six.string_types) and error.code.isdigit() \
+        and error.code not in RETRYABLE_ERROR_CODES
+
+
+def call_with_retries(call, name, read, retries, deadline):
+    """Returns the result of call(). Calls that fail with a retryable error
+    are retried up to retries times with jittered exponential backoff, as long
+    as the deadline allows it."""
+    interval = RETRY_INTERVAL
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except NaApiError as e:
+            if attempt == retries or not is_retryable(e, read):
+                raise
+            delta = interval * RETRY_JITTER
+            sleep = interval + random.uniform(-delta, delta)
+            if deadline is not None and time.time() + sleep >= deadline:
+                raise
+            LOG.warning("Call %s failed: %s. Retrying in %.2f seconds",
+                        name, e, sleep)
+            time.sleep(sleep)
+            interval = min(interval * 2, RETRY_MAX_INTERVAL)
+
+
+def invoke_addresses(invoke, name, read, addresses, selector=None,
+                     hedge_percentile=None):
+    """Returns the result of invoke(address) for the first of the management
+    addresses that responds. Calls that could not be sent fail over to the
+    next address and so do reads that got no response. With a LifSelector
+    and a hedge percentile, reads are hedged."""
+    if read and hedge_percentile and selector is not None and \
+            len(addresses) > 1:
+        delay = selector.hedge_delay(addresses[0], hedge_percentile)
+        if delay is not None:
+            return _invoke_hedged(invoke, name, addresses, delay)
+
+    for i, address in enumerate(addresses):
+        try:
+            return invoke(address)
+        except NaApiConnectionError:
+            # The request has not reached the server
+            if i == len(addresses) - 1:
+                raise
+        except NaApiResponseError:
+            # The server may have executed a modifying call
+            if not read or i == len(addresses) - 1:
+                raise
+        LOG.warning("Retrying %s on %s", name, addresses[i + 1])
+
+
+def _invoke_hedged(invoke, name, addresses, delay):
+    """Invoke a read API on the best address. If it does not respond within
+    delay seconds, send the call to the next address too and return the first
+    response."""
+    results = queue.Queue()
+    candidates = list(addresses)
+
+    def run(address):
+        try:
+            results.put((invoke(address), None))
+        except Exception as e:
+            results.put((None, e))
+
+    def start():
+        t = threading.Thread(target=run, args=(candidates.pop(0),))
+        t.daemon = True
+        t.start()
+
+    start()
+    pending = 1
+    timeout = delay
+    error = None
+    while pending:
+        try:
+            result, error = results.get(timeout=timeout)
+        except queue.Empty:
+            # Hedge only once. The socket timeout bounds the wait.
+            timeout = None
+            if candidates:
+                LOG.debug("%s is slower than %.3f seconds. Hedging it to %s",
+                          name, delay, candidates[0])
+                start()
+                pending += 1
+            continue
+        pending -= 1
+        if error is None:
+            return result
+        if isinstance(error, (NaApiConnectionError, NaApiResponseError)) \
+                and candidates:
+            start()
+            pending += 1
+    raise error
+
 
 class NaServer(object):
     """Encapsulates server connection logic."""
@@ -54,7 +217,16 @@ class NaServer(object):
                  transport_type=TRANSPORT_TYPE_HTTP,
                  style=STYLE_LOGIN_PASSWORD, verify_cert=True, username=None,
                  password=None, port=None):
-        self._host = host
+        # The host may be a list of management addresses
+        if isinstance(host, six.string_types):
+            host = [host]
+        self._hosts = list(host)
+        self._host = self._hosts[0]
+        self._lifs = None
+        self._hedge_percentile = None
+        self._deadline = None
+        self._retries = 0
+        self._limiter = None
         self.set_server_type(server_type)
         self.set_transport_type(transport_type)
         self.set_style(style)
@@ -71,7 +243,7 @@ class NaServer(object):
             import ssl
             ssl._create_default_https_context = ssl._create_unverified_context
 
-        LOG.debug('Using NetApp controller: %s', self._host)
+        LOG.debug('Using NetApp controller: %s', ", ".join(self._hosts))
 
     def get_transport_type(self):
         """Get the transport type protocol."""
@@ -178,6 +350,49 @@ class NaServer(object):
             return self._timeout
         return None
 
+    def set_deadline(self, deadline):
+        """Sets the time (as returned by time.time()) after which no more
+        calls are made. The socket timeout of each call is reduced so that
+        it does not go past the deadline. None means no deadline."""
+        self._deadline = deadline
+
+    def set_retries(self, retries):
+        """Sets the number of times a call that failed with a retryable
+        error is retried"""
+        self._retries = int(retries)
+
+    def _call_timeout(self):
+        """Returns the socket timeout of the next call or None"""
+        timeout = self.get_timeout()
+        if self._deadline is None:
+            return timeout
+        remaining = self._deadline - time.time()
+        if remaining <= 0:
+            raise NaApiDeadlineError(message='Time budget exhausted')
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def set_lif_selector(self, selector):
+        """Choose the management address of each call with a LifSelector"""
+        self._lifs = selector
+        self._refresh_conn = True
+
+    def set_hedge_percentile(self, percentile):
+        """Resend read calls to a second address if they take longer than
+        the given percentile of the recent latencies. None disables hedging.
+        """
+        self._hedge_percentile = percentile
+
+    def set_rate_limiter(self, limiter):
+        """Throttle the calls with a node-wide RateLimiter"""
+        self._limiter = limiter
+
+    def _get_addresses(self):
+        """Returns the management addresses in the order they should be
+        tried"""
+        if self._lifs is None:
+            return [self._host]
+        return self._lifs.order()
+
     def get_vfiler(self):
         """Get the vfiler to use in tunneling."""
         return self._vfiler
@@ -209,25 +424,53 @@ class NaServer(object):
         if not na_element or not isinstance(na_element, NaElement):
             raise ValueError('NaElement must be supplied to invoke API')
 
-        request, request_element = self._create_request(na_element,
-                                                        enable_tunneling)
-
         if not hasattr(self, '_opener') or not self._opener \
                 or self._refresh_conn:
             self._build_opener()
+
+        return invoke_addresses(
+            lambda address: self._invoke_address(address, na_element,
+                                                 enable_tunneling),
+            na_element.get_name(), is_read_api(na_element.get_name()),
+            self._get_addresses(), self._lifs, self._hedge_percentile)
+
+    def _invoke_address(self, address, na_element, enable_tunneling):
+        """Invoke the API on a specific management address"""
+        # Every request sent takes a token, including the hedged ones
+        if self._limiter is not None:
+            read = is_read_api(na_element.get_name())
+            self._limiter.acquire('read' if read else 'write',
+                                  self._deadline)
+
+        request, request_element = self._create_request(
+            na_element, enable_tunneling, address)
+
+        timeout = self._call_timeout()
+        start = time.time()
         try:
-            if hasattr(self, '_timeout'):
-                response = self._opener.open(request, timeout=self._timeout)
+            if timeout is not None:
+                response = self._opener.open(request, timeout=timeout)
             else:
                 response = self._opener.open(request)
+            response_xml = response.read()
         except urllib.error.HTTPError as e:
             raise NaApiError(e.code, e.msg)
         except urllib.error.URLError as e:
-            raise NaApiError(message=e.reason)
-        except Exception:
-            raise NaApiError('Unexpected error')
-
-        response_xml = response.read()
+            if self._lifs is not None:
+                self._lifs.record_failure(address)
+            raise NaApiConnectionError(message=e.reason,
+                                       transient=_is_transient(e.reason))
+        except (socket.timeout, socket.error) as e:
+            if self._lifs is not None:
+                self._lifs.record_failure(address)
+            raise NaApiResponseError(message=str(e) or 'timed out')
+        except Exception as e:
+            LOG.debug("Unexpected error calling %s", na_element.get_name(),
+                      exc_info=True)
+            raise NaApiError('Unexpected error', str(e))
+
+        if self._lifs is not None:
+            self._lifs.record(address, time.time() - start)
         response_element = self._get_result(response_xml)
 
         return response_element
@@ -239,7 +482,17 @@ class NaServer(object):
         This helps to use same connection instance to enable or disable
         tunneling. The vserver or vfiler should be set before this call
         otherwise tunneling remains disabled.
+
+        Calls that fail with a retryable error are retried with jittered
+        exponential backoff, as long as the deadline allows it.
         """
+        return call_with_retries(
+            lambda: self._invoke_successfully(na_element, enable_tunneling),
+            na_element.get_name(), is_read_api(na_element.get_name()),
+            self._retries, self._deadline)
+
+    def _invoke_successfully(self, na_element, enable_tunneling):
+        """Invokes API once and checks execution status as success."""
         result = self.invoke_elem(na_element, enable_tunneling)
         if result.has_attr('status') and result.get_attr('status') == 'passed':
             return result
@@ -254,7 +507,8 @@ class NaServer(object):
                 or 'Execution status is failed due to unknown reason'
         raise NaApiError(code, msg)
 
-    def _create_request(self, na_element, enable_tunneling=False):
+    def _create_request(self, na_element, enable_tunneling=False,
+                        host=None):
         """Creates request in the desired format."""
         netapp_elem = NaElement('netapp')
         netapp_elem.add_attr('xmlns', self._ns)
@@ -265,7 +519,7 @@ class NaServer(object):
         netapp_elem.add_child_elem(na_element)
         request_d = netapp_elem.to_string()
         request = urllib.request.Request(
-            self._get_url(), data=request_d,
+            self._get_url(host), data=request_d,
             headers={'Content-Type': 'text/xml', 'charset': 'utf-8'})
         return request, netapp_elem
 
@@ -302,8 +556,12 @@ class NaServer(object):
         processed_response = self._parse_response(response)
         return processed_response.get_child_by_name('results')
 
-    def _get_url(self):
-        return '%s://%s:%s/%s' % (self._protocol, self._host, self._port,
+    def _get_url(self, host=None):
+        host = host or self._host
+        # IPv6 addresses have to be enclosed in brackets
+        if ':' in host:
+            host = '[%s]' % host
+        return '%s://%s:%s/%s' % (self._protocol, host, self._port,
                                   self._url)
 
     def _build_opener(self):
@@ -316,8 +574,8 @@ class NaServer(object):
 
     def _create_basic_auth_handler(self):
         password_man = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-        password_man.add_password(None, self._get_url(), self._username,
-                                  self._password)
+        urls = [self._get_url(a) for a in self._get_addresses()]
+        password_man.add_password(None, urls, self._username, self._password)
         auth_handler = urllib.request.HTTPBasicAuthHandler(password_man)
         return auth_handler
 
@@ -541,6 +799,22 @@ class NaApiError(Exception):
         return 'NetApp API failed. Reason - %s:%s' % (self.code, self.message)
 
 
+class NaApiConnectionError(NaApiError):
+    """The API call could not be sent to the server."""
+
+    def __init__(self, code='unknown', message='unknown', transient=True):
+        super(NaApiConnectionError, self).__init__(code, message)
+        self.transient = transient
+
+
+class NaApiResponseError(NaApiError):
+    """The API call was sent but no response was received."""
+
+
+class NaApiDeadlineError(NaApiError):
+    """The time budget for API calls has been exhausted."""
+
+
 NaErrors = {'API_NOT_FOUND': NaApiError('13005', 'Unable to find API'),
             'INSUFFICIENT_PRIVS': NaApiError('13003',
                                              'Insufficient privileges')}
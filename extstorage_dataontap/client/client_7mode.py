@@ -16,7 +16,6 @@
 
 import copy
 import math
-import time
 
 import logging
 import six
@@ -25,10 +24,14 @@ from extstorage_dataontap import exception
 from extstorage_dataontap.i18n import _, _LW
 from extstorage_dataontap.client import api as netapp_api
 from extstorage_dataontap.client import client_base
+from extstorage_dataontap.client import poller
 
 
 LOG = logging.getLogger(__name__)
 
+# Maximum time to wait for a clone operation to finish in seconds
+CLONE_TIMEOUT = 3600
+
 
 class Client(client_base.Client):
 
@@ -133,6 +136,23 @@ class Client(client_base.Client):
             lun_list.extend(luns)
         return lun_list
 
+    def iter_lun_pages(self, attributes=None, query=None):
+        """Yields the LUNs one volume at a time. lun-list-info can neither
+        limit the returned attributes nor filter the LUNs, so attributes and
+        query are ignored."""
+        if not self.volume_list:
+            yield self._get_vol_luns(None)
+            return
+        for vol in self.volume_list:
+            try:
+                luns = self._get_vol_luns(vol)
+            except netapp_api.NaApiError:
+                LOG.warning(_LW("Error finding LUNs for volume %s."
+                                " Verify volume exists."), vol)
+                continue
+            if luns:
+                yield luns
+
     def _get_vol_luns(self, vol_name):
         """Gets the LUNs for a volume."""
         api = netapp_api.NaElement('lun-list-info')
@@ -142,6 +162,23 @@ class Client(client_base.Client):
         luns = result.get_child_by_name('luns')
         return luns.get_children()
 
+    def get_igroup_alua(self, igroup_name):
+        """Returns whether ALUA is enabled on an igroup or None if the
+        igroup does not exist."""
+        igroup_list_info = netapp_api.NaElement.create_node_with_children(
+            'igroup-list-info', **{'initiator-group-name': igroup_name})
+        try:
+            result = self.connection.invoke_successfully(igroup_list_info,
+                                                         True)
+        except netapp_api.NaApiError:
+            return None
+        igroups = result.get_child_by_name('initiator-groups')
+        if igroups:
+            for igroup_info in igroups.get_children():
+                return igroup_info.get_child_content(
+                    'initiator-group-alua-enabled') == 'true'
+        return None
+
     def get_igroup_by_initiators(self, initiator_list):
         """Get igroups exactly matching a set of initiators."""
         igroup_list = []
@@ -180,7 +217,7 @@ class Client(client_base.Client):
 
     def clone_lun(self, path, clone_path, name, new_name,
                   space_reserved='true', src_block=0,
-                  dest_block=0, block_count=0):
+                  dest_block=0, block_count=0, source_snapshot=None):
         # zAPI can only handle 2^24 blocks per range
         bc_limit = 2 ** 24  # 8GB
         # zAPI can only handle 32 block ranges per call
@@ -200,6 +237,8 @@ class Client(client_base.Client):
                 'clone-start', **{'source-path': path,
                                   'destination-path': clone_path,
                                   'no-snap': 'true'})
+            if source_snapshot is not None:
+                clone_start.add_new_child('snapshot-name', source_snapshot)
             if block_count > 0:
                 block_ranges = netapp_api.NaElement("block-ranges")
                 # zAPI can only handle 2^24 block ranges
@@ -230,45 +269,85 @@ class Client(client_base.Client):
             cl_id_info = clone_id_el.get_child_by_name('clone-id-info')
             vol_uuid = cl_id_info.get_child_content('volume-uuid')
             clone_id = cl_id_info.get_child_content('clone-op-id')
+            # The block ranges are cloned one call at a time
             if vol_uuid:
-                self._check_clone_status(clone_id, vol_uuid, name, new_name)
+                self._check_clone_status([(clone_id, vol_uuid)], name,
+                                         new_name)
 
-    def _check_clone_status(self, clone_id, vol_uuid, name, new_name):
-        """Checks for the job till completed."""
+    def _get_clone_statuses(self, clone_ops):
+        """Fetch the state of many clone operations with a single
+        clone-list-status call. The result is suitable for use by the
+        AsyncPoller."""
         clone_status = netapp_api.NaElement('clone-list-status')
         cl_id = netapp_api.NaElement('clone-id')
         clone_status.add_child_elem(cl_id)
-        cl_id.add_node_with_children('clone-id-info',
-                                     **{'clone-op-id': clone_id,
-                                        'volume-uuid': vol_uuid})
-        running = True
-        clone_ops_info = None
-        while running:
-            result = self.connection.invoke_successfully(clone_status, True)
-            status = result.get_child_by_name('status')
-            ops_info = status.get_children()
-            if ops_info:
-                for info in ops_info:
-                    if info.get_child_content('clone-state') == 'running':
-                        time.sleep(1)
-                        break
-                    else:
-                        running = False
-                        clone_ops_info = info
-                        break
-        else:
-            if clone_ops_info:
-                fmt = {'name': name, 'new_name': new_name}
-                if clone_ops_info.get_child_content('clone-state')\
-                        == 'completed':
-                    LOG.debug("Clone operation with src %(name)s"
-                              " and dest %(new_name)s completed", fmt)
-                else:
-                    LOG.debug("Clone operation with src %(name)s"
-                              " and dest %(new_name)s failed", fmt)
-                    raise netapp_api.NaApiError(
-                        clone_ops_info.get_child_content('error'),
-                        clone_ops_info.get_child_content('reason'))
+        for clone_id, vol_uuid in clone_ops:
+            cl_id.add_node_with_children('clone-id-info',
+                                         **{'clone-op-id': clone_id,
+                                            'volume-uuid': vol_uuid})
+        result = self.connection.invoke_successfully(clone_status, True)
+        status = result.get_child_by_name('status') or \
+            netapp_api.NaElement('none')
+
+        statuses = {}
+        for info in status.get_children():
+            op = clone_ops[0] if len(clone_ops) == 1 else None
+            id_el = info.get_child_by_name('clone-id')
+            id_info = id_el.get_child_by_name('clone-id-info') if id_el \
+                else None
+            if id_info:
+                op = (id_info.get_child_content('clone-op-id'),
+                      id_info.get_child_content('volume-uuid'))
+            if op is None:
+                continue
+
+            state = info.get_child_content('clone-state')
+            if state == 'completed':
+                statuses[op] = (poller.COMPLETED, info)
+            elif state == 'failed':
+                statuses[op] = (poller.FAILED, netapp_api.NaApiError(
+                    info.get_child_content('error'),
+                    info.get_child_content('reason')))
+            else:
+                statuses[op] = (poller.RUNNING, info)
+
+        # The filer does not know about the missing operations
+        for op in clone_ops:
+            if op not in statuses:
+                statuses[op] = (poller.FAILED, netapp_api.NaApiError(
+                    'UnknownCloneId',
+                    'No clone operation for clone id %s found on the filer'
+                    % op[0]))
+        return statuses
+
+    def _wait_for_clone_ops(self, clone_ops, timeout=CLONE_TIMEOUT):
+        """Waits for a set of clone operations to finish and raises the error
+        of the first failed one, if any."""
+        clone_poller = poller.AsyncPoller(self._get_clone_statuses,
+                                          timeout=timeout)
+        for op in clone_ops:
+            clone_poller.add(op)
+        results = clone_poller.wait()
+
+        for op in clone_ops:
+            state, info = results[op]
+            if state == poller.FAILED:
+                raise info
+            elif state == poller.TIMEOUT:
+                raise netapp_api.NaApiError(
+                    'ETIMEDOUT', 'Clone operation %s timed out' % op[0])
+
+    def _check_clone_status(self, clone_ops, name, new_name):
+        """Checks for the clone operations till completed."""
+        fmt = {'name': name, 'new_name': new_name}
+        try:
+            self._wait_for_clone_ops(clone_ops)
+        except netapp_api.NaApiError:
+            LOG.debug("Clone operation with src %(name)s"
+                      " and dest %(new_name)s failed", fmt)
+            raise
+        LOG.debug("Clone operation with src %(name)s"
+                  " and dest %(new_name)s completed", fmt)
 
     def get_lun_by_args(self, **args):
         """Retrieves LUNs with specified args."""
@@ -293,6 +372,27 @@ class Client(client_base.Client):
             **{'path': path})
         return self.connection.invoke_successfully(lun_map_list, True)
 
+    def get_lun_maps(self, paths=None):
+        """Gets the LUN maps of a list of LUN paths, or of all the LUNs.
+        7-mode reports the LUNs through all the nodes."""
+        if paths is None:
+            paths = [lun.get_child_content('path')
+                     for lun in self.get_lun_list()]
+        map_list = []
+        for path in paths:
+            result = self.get_lun_map(path)
+            igroups = result.get_child_by_name('initiator-groups') or \
+                netapp_api.NaElement('none')
+            for info in igroups.get_children():
+                map_list.append({
+                    'path': path,
+                    'initiator-group': info.get_child_content(
+                        'initiator-group-name'),
+                    'lun-id': info.get_child_content('lun-id'),
+                    'reporting-nodes': [],
+                })
+        return map_list
+
     def set_space_reserve(self, path, enable):
         """Sets the space reserve info."""
         space_res = netapp_api.NaElement.create_node_with_children(
@@ -336,33 +436,7 @@ class Client(client_base.Client):
 
     def _wait_for_clone_finish(self, clone_op_id, vol_uuid):
         """Waits till a clone operation is complete or errored out."""
-        clone_ls_st = netapp_api.NaElement('clone-list-status')
-        clone_id = netapp_api.NaElement('clone-id')
-        clone_ls_st.add_child_elem(clone_id)
-        clone_id.add_node_with_children('clone-id-info',
-                                        **{'clone-op-id': clone_op_id,
-                                           'volume-uuid': vol_uuid})
-        task_running = True
-        while task_running:
-            result = self.connection.invoke_successfully(clone_ls_st,
-                                                         enable_tunneling=True)
-            status = result.get_child_by_name('status')
-            ops_info = status.get_children()
-            if ops_info:
-                state = ops_info[0].get_child_content('clone-state')
-                if state == 'completed':
-                    task_running = False
-                elif state == 'failed':
-                    code = ops_info[0].get_child_content('error')
-                    reason = ops_info[0].get_child_content('reason')
-                    raise netapp_api.NaApiError(code, reason)
-                else:
-                    time.sleep(1)
-            else:
-                raise netapp_api.NaApiError(
-                    'UnknownCloneId',
-                    'No clone operation for clone id %s found on the filer'
-                    % (clone_id))
+        self._wait_for_clone_ops([(clone_op_id, vol_uuid)])
 
     def _clear_clone(self, clone_id):
         """Clear the clone information.
@@ -373,16 +447,14 @@ class Client(client_base.Client):
         clone_clear = netapp_api.NaElement.create_node_with_children(
             'clone-clear',
             **{'clone-id': clone_id})
-        retry = 3
-        while retry:
-            try:
-                self.connection.invoke_successfully(clone_clear,
-                                                    enable_tunneling=True)
-                break
-            except netapp_api.NaApiError:
-                # Filer might be rebooting
-                time.sleep(5)
-            retry = retry - 1
+        # Filer might be rebooting
+        try:
+            poller.retry(lambda: self.connection.invoke_successfully(
+                clone_clear, enable_tunneling=True),
+                netapp_api.NaApiError, retries=3, initial_interval=1)
+        except netapp_api.NaApiError as e:
+            LOG.warning(_LW("Unable to clear clone %(id)s: %(ex)s"),
+                        {'id': clone_id, 'ex': e})
 
     def get_file_usage(self, path):
         """Gets the file unique bytes."""
@@ -416,4 +488,31 @@ class Client(client_base.Client):
 
         return total_bytes, available_bytes
 
+    def get_flexvol_capacities(self):
+        """Gets total capacity and free capacity, in bytes, of all flexvols."""
+
+        result = self.send_request('volume-list-info', {'verbose': 'false'})
+
+        flexvol_info_list = result.get_child_by_name(
+            'volumes') or netapp_api.NaElement('none')
+
+        capacities = {}
+        for flexvol_info in flexvol_info_list.get_children():
+            if flexvol_info.get_child_content('state') != 'online':
+                continue
+            capacities[flexvol_info.get_child_content('name')] = (
+                float(flexvol_info.get_child_content('size-total')),
+                float(flexvol_info.get_child_content('size-available')))
+        return capacities
+
+    def get_snapshot_names(self, volume):
+        """Returns the names of the Snapshot copies of a volume."""
+        api_args = {'target-name': volume, 'target-type': 'volume',
+                    'terse': 'true'}
+        result = self.send_request('snapshot-list-info', api_args)
+        snapshots = result.get_child_by_name(
+            'snapshots') or netapp_api.NaElement('none')
+        return [snapshot_info.get_child_content('name')
+                for snapshot_info in snapshots.get_children()]
+
 # vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -25,6 +25,8 @@ import six
 
 from extstorage_dataontap.i18n import _LE, _LW, _LI
 from extstorage_dataontap.client import api as netapp_api
+from extstorage_dataontap.client import lifs
+from extstorage_dataontap.client import ratelimit
 from extstorage_dataontap.client import utils
 
 
@@ -41,6 +43,28 @@ class Client(object):
             username=kwargs['username'],
             password=kwargs['password'],
             verify_cert=kwargs['verify_cert'])
+        if kwargs.get('timeout'):
+            self.connection.set_timeout(kwargs['timeout'])
+        self.connection.set_deadline(kwargs.get('deadline'))
+        self.connection.set_retries(kwargs.get('retries', 0))
+        if any((kwargs.get('rate_limits') or {}).values()):
+            self.connection.set_rate_limiter(ratelimit.RateLimiter(
+                kwargs['rate_limits'], kwargs['rate_limit_burst'],
+                state_file=kwargs['rate_limit_file'],
+                lock_file=kwargs['rate_limit_lock_file'],
+                metrics_file=kwargs.get('rate_limit_metrics_file')))
+
+        # With several management addresses, each call goes to the fastest
+        # one. Names are only resolved to addresses if the certificate is not
+        # verified, since certificates are issued for names.
+        if not isinstance(kwargs['hostname'], six.string_types):
+            self.connection.set_lif_selector(lifs.LifSelector(
+                kwargs['hostname'], self.connection.get_port(),
+                cache_file=kwargs.get('lif_cache_file'),
+                ttl=kwargs.get('lif_cache_ttl', 300),
+                resolve_names=not kwargs['verify_cert']))
+            self.connection.set_hedge_percentile(
+                kwargs.get('hedge_percentile'))
 
     def _init_features(self):
         """Set up the repository of available Data ONTAP features."""
@@ -157,6 +181,30 @@ class Client(object):
                         {'code': code, 'message': message})
             raise
 
+    def get_lun_attribute(self, path, name):
+        """Gets the value of a named attribute of a LUN or None if the
+        attribute is not set."""
+        lun_get_attr = netapp_api.NaElement.create_node_with_children(
+            'lun-get-attribute', **{'path': path, 'name': name})
+        try:
+            result = self.connection.invoke_successfully(lun_get_attr, True)
+        except netapp_api.NaApiError as e:
+            # The filer fails the call if the attribute is not set. Errors
+            # that did not come from the filer say nothing about it.
+            if not netapp_api.is_server_error(e):
+                raise
+            LOG.debug("Attribute %(name)s of LUN %(path)s not found: %(ex)s",
+                      {'name': name, 'path': path, 'ex': e})
+            return None
+        return result.get_child_content('value')
+
+    def set_lun_attribute(self, path, name, value):
+        """Sets a named attribute of a LUN."""
+        lun_set_attr = netapp_api.NaElement.create_node_with_children(
+            'lun-set-attribute',
+            **{'path': path, 'name': name, 'value': six.text_type(value)})
+        self.connection.invoke_successfully(lun_set_attr, True)
+
     def create_igroup(self, igroup, igroup_type='iscsi', os_type='default'):
         """Creates igroup with specified args."""
         igroup_create = netapp_api.NaElement.create_node_with_children(
@@ -231,6 +279,43 @@ class Client(object):
         lun_move.add_new_child("new-path", new_path)
         self.connection.invoke_successfully(lun_move, True)
 
+    def create_snapshot(self, volume, snapshot_name):
+        """Creates a Snapshot copy of a volume."""
+        api_args = {'volume': volume, 'snapshot': snapshot_name}
+        self.send_request('snapshot-create', api_args)
+
+    def create_cg_snapshot(self, volumes, snapshot_name):
+        """Creates a Snapshot copy of many volumes at the same point in time.
+        The write I/O to the volumes is fenced between cg-start and
+        cg-commit. If the commit fails, the operation is aborted right away
+        instead of leaving the volumes fenced till the cg timeout expires."""
+        api_args = {
+            'snapshot': snapshot_name,
+            'timeout': 'relaxed',
+            'volumes': [{'volume-name': volume} for volume in volumes],
+        }
+        result = self.send_request('cg-start', api_args)
+        cg_id = result.get_child_content('cg-id')
+        try:
+            self.send_request('cg-commit', {'cg-id': cg_id})
+        except netapp_api.NaApiError:
+            exc_info = sys.exc_info()
+            try:
+                self.send_request('cg-abort', {'cg-id': cg_id})
+            except netapp_api.NaApiError as e:
+                LOG.warning(_LW("Error aborting consistency group %(cg)s: "
+                                "%(ex)s"), {'cg': cg_id, 'ex': e})
+            six.reraise(*exc_info)
+
+    def delete_snapshot(self, volume, snapshot_name):
+        """Deletes a Snapshot copy of a volume."""
+        api_args = {'volume': volume, 'snapshot': snapshot_name}
+        self.send_request('snapshot-delete', api_args)
+
+    def get_snapshot_names(self, volume):
+        """Returns the names of the Snapshot copies of a volume."""
+        raise NotImplementedError()
+
     def get_iscsi_target_details(self):
         """Gets the iSCSI target portal details."""
         raise NotImplementedError()
@@ -271,6 +356,46 @@ class Client(object):
         """Retrieves LUNs with specified args."""
         raise NotImplementedError()
 
+    def get_flexvol_capacities(self):
+        """Gets total capacity and free capacity, in bytes, of all flexvols.
+
+        Returns a dictionary mapping each flexvol name to a (total, available)
+        tuple.
+        """
+        raise NotImplementedError()
+
+    def get_perf_counters(self, object_name, instances, counters):
+        """Gets the raw values of performance counters for a set of instances
+        of a performance object.
+
+        Returns a dictionary mapping each instance name to a dictionary of
+        counter names and values.
+        """
+        api_args = {
+            'objectname': object_name,
+            'instances': [{'instance': i} for i in instances],
+            'counters': [{'counter': c} for c in counters],
+        }
+        result = self.send_request('perf-object-get-instances', api_args,
+                                   enable_tunneling=False)
+
+        instances_list = result.get_child_by_name(
+            'instances') or netapp_api.NaElement('none')
+
+        values = {}
+        for instance_data in instances_list.get_children():
+            name = instance_data.get_child_content('name')
+            counters_list = instance_data.get_child_by_name(
+                'counters') or netapp_api.NaElement('none')
+            values[name] = {}
+            for counter_data in counters_list.get_children():
+                try:
+                    values[name][counter_data.get_child_content('name')] = \
+                        float(counter_data.get_child_content('value'))
+                except (TypeError, ValueError):
+                    continue
+        return values
+
     def provide_ems(self, requester, netapp_backend, app_version,
                     server_type="cluster"):
         """Provide ems with volume stats for the requester.
@@ -25,12 +25,24 @@ from extstorage_dataontap import exception
 from extstorage_dataontap.i18n import _, _LW
 from extstorage_dataontap.client import api as netapp_api
 from extstorage_dataontap.client import client_base
+from extstorage_dataontap.client import poller
 from extstorage_dataontap.client import utils
 
 
 LOG = logging.getLogger(__name__)
 DELETED_PREFIX = 'deleted_cinder_'
 
+# Job states as reported by job-get-iter
+JOB_SUCCESS_STATES = ('success',)
+JOB_FAILURE_STATES = ('failure', 'error', 'quit', 'dead')
+
+# LUN move states as reported by lun-move-get-iter
+LUN_MOVE_SUCCESS_STATES = ('complete',)
+LUN_MOVE_FAILURE_STATES = ('paused_error',)
+
+# Number of LUNs fetched per lun-get-iter call when streaming the LUNs
+LUN_PAGE_SIZE = 500
+
 
 class Client(client_base.Client):
 
@@ -117,28 +129,34 @@ class Client(client_base.Client):
 
         Gets the LUNs from cluster with vserver.
         """
-
         luns = []
+        for page in self.iter_lun_pages():
+            luns.extend(page)
+        return luns
+
+    def iter_lun_pages(self, attributes=None, query=None):
+        """Yields the LUNs of the vserver one page at a time. The next page
+        is only fetched once the current one has been consumed, so that the
+        LUNs can be processed while they are being paginated. If attributes
+        is given, only these lun-info attributes are fetched. If query is
+        given, only the LUNs whose lun-info attributes match it are listed."""
+        query = {'lun-info': dict(query or {}, vserver=self.vserver)}
+        desired_attributes = None
+        if attributes:
+            desired_attributes = {'lun-info': dict.fromkeys(attributes)}
         tag = None
         while True:
-            api = netapp_api.NaElement('lun-get-iter')
-            api.add_new_child('max-records', '100')
-            if tag:
-                api.add_new_child('tag', tag, True)
-            lun_info = netapp_api.NaElement('lun-info')
-            lun_info.add_new_child('vserver', self.vserver)
-            query = netapp_api.NaElement('query')
-            query.add_child_elem(lun_info)
-            api.add_child_elem(query)
+            api = netapp_api.create_api_request(
+                'lun-get-iter', query, desired_attributes, is_iter=True,
+                record_step=LUN_PAGE_SIZE, tag=tag)
             result = self.connection.invoke_successfully(api, True)
             if result.get_child_by_name('num-records') and\
                     int(result.get_child_content('num-records')) >= 1:
                 attr_list = result.get_child_by_name('attributes-list')
-                luns.extend(attr_list.get_children())
+                yield attr_list.get_children()
             tag = result.get_child_content('next-tag')
             if tag is None:
                 break
-        return luns
 
     def get_lun_map(self, path):
         """Gets the LUN map by LUN path."""
@@ -169,6 +187,67 @@ class Client(client_base.Client):
                 break
         return map_list
 
+    def get_lun_maps(self, paths=None):
+        """Gets all the LUN maps of the vserver, or only the maps of a list
+        of LUN paths, along with the nodes they are reported through."""
+        query = {
+            'lun-map-info': {
+                'vserver': self.vserver,
+            }
+        }
+        if paths is not None:
+            if not paths:
+                return []
+            query['lun-map-info']['path'] = '|'.join(paths)
+        desired_attributes = {
+            'lun-map-info': {
+                'path': None,
+                'initiator-group': None,
+                'lun-id': None,
+                'reporting-nodes': None,
+            }
+        }
+        result = netapp_api.invoke_api(
+            self.connection, api_name='lun-map-get-iter', query=query,
+            des_result=desired_attributes, is_iter=True, tunnel=self.vserver)
+
+        map_list = []
+        for res in result:
+            attr_list = res.get_child_by_name(
+                'attributes-list') or netapp_api.NaElement('none')
+            for lun_map in attr_list.get_children():
+                nodes = lun_map.get_child_by_name(
+                    'reporting-nodes') or netapp_api.NaElement('none')
+                map_list.append({
+                    'path': lun_map.get_child_content('path'),
+                    'initiator-group': lun_map.get_child_content(
+                        'initiator-group'),
+                    'lun-id': lun_map.get_child_content('lun-id'),
+                    'reporting-nodes': [n.get_content() for n in
+                                        nodes.get_children()],
+                })
+        return map_list
+
+    def add_lun_map_reporting_nodes(self, path, igroup_name, volume):
+        """Adds the nodes of the HA pair hosting a volume to the reporting
+        nodes of a LUN map."""
+        api_args = {
+            'path': path,
+            'igroup': igroup_name,
+            'destination-volume': volume,
+        }
+        self.send_request('lun-map-add-reporting-nodes', api_args)
+
+    def remove_lun_map_remote_reporting_nodes(self, path, igroup_name):
+        """Restricts the reporting nodes of a LUN map to the node owning the
+        LUN and its HA partner."""
+        api_args = {
+            'path': path,
+            'igroup': igroup_name,
+            'remote-nodes': 'true',
+        }
+        self.send_request('lun-map-remove-reporting-nodes', api_args)
+
     def _get_igroup_by_initiator_query(self, initiator, tag):
         igroup_get_iter = netapp_api.NaElement('igroup-get-iter')
         igroup_get_iter.add_new_child('max-records', '100')
@@ -199,6 +278,29 @@ class Client(client_base.Client):
 
         return igroup_get_iter
 
+    def get_igroup_alua(self, igroup_name):
+        """Returns whether ALUA is enabled on an igroup or None if the
+        igroup does not exist."""
+        api_args = {
+            'query': {
+                'initiator-group-info': {
+                    'initiator-group-name': igroup_name,
+                }
+            },
+            'desired-attributes': {
+                'initiator-group-info': {
+                    'initiator-group-alua-enabled': None,
+                }
+            },
+        }
+        result = self.send_request('igroup-get-iter', api_args)
+        attr_list = result.get_child_by_name(
+            'attributes-list') or netapp_api.NaElement('none')
+        for igroup_info in attr_list.get_children():
+            return igroup_info.get_child_content(
+                'initiator-group-alua-enabled') == 'true'
+        return None
+
     def get_igroup_by_initiators(self, initiator_list):
         """Get igroups exactly matching a set of initiators."""
         tag = None
@@ -248,7 +350,7 @@ class Client(client_base.Client):
 
     def clone_lun(self, volume, name, new_name, space_reserved='true',
                   qos_policy_group_name=None, src_block=0, dest_block=0,
-                  block_count=0):
+                  block_count=0, source_snapshot=None):
         # zAPI can only handle 2^24 blocks per range
         bc_limit = 2 ** 24  # 8GB
         # zAPI can only handle 32 block ranges per call
@@ -272,6 +374,8 @@ class Client(client_base.Client):
             if qos_policy_group_name is not None:
                 clone_create.add_new_child('qos-policy-group-name',
                                            qos_policy_group_name)
+            if source_snapshot is not None:
+                clone_create.add_new_child('snapshot-name', source_snapshot)
             if block_count > 0:
                 block_ranges = netapp_api.NaElement("block-ranges")
                 segments = int(math.ceil(block_count / float(bc_limit)))
@@ -297,6 +401,164 @@ class Client(client_base.Client):
                 clone_create.add_child_elem(block_ranges)
             self.connection.invoke_successfully(clone_create, True)
 
+    def _get_job_statuses(self, job_ids):
+        """Fetch the state of many jobs with a single job-get-iter call. The
+        result is suitable for use by the AsyncPoller."""
+        api_args = {
+            'query': {
+                'job-info': {
+                    'job-id': '|'.join(job_ids),
+                }
+            },
+            'desired-attributes': {
+                'job-info': {
+                    'job-id': None,
+                    'job-state': None,
+                    'job-completion': None,
+                }
+            },
+            'max-records': len(job_ids),
+        }
+        result = self.send_request('job-get-iter', api_args, False)
+        attr_list = result.get_child_by_name(
+            'attributes-list') or netapp_api.NaElement('none')
+
+        statuses = {}
+        for job_info in attr_list.get_children():
+            job_id = job_info.get_child_content('job-id')
+            state = job_info.get_child_content('job-state')
+            if state in JOB_SUCCESS_STATES:
+                statuses[job_id] = (poller.COMPLETED, job_info)
+            elif state in JOB_FAILURE_STATES:
+                statuses[job_id] = (poller.FAILED, netapp_api.NaApiError(
+                    state, job_info.get_child_content('job-completion')))
+            else:
+                statuses[job_id] = (poller.RUNNING, job_info)
+        return statuses
+
+    def wait_for_jobs(self, job_ids, timeout=None):
+        """Waits for a set of cluster jobs to finish and raises the error of
+        the first failed one, if any."""
+        job_poller = poller.AsyncPoller(self._get_job_statuses,
+                                        timeout=timeout)
+        for job_id in job_ids:
+            job_poller.add(job_id)
+        results = job_poller.wait()
+
+        for job_id in job_ids:
+            state, info = results[job_id]
+            if state == poller.FAILED:
+                raise info
+            elif state == poller.TIMEOUT:
+                raise netapp_api.NaApiError(
+                    'ETIMEDOUT', 'Job %s timed out' % job_id)
+
+    def _wait_for_async_result(self, result, timeout=None):
+        """Waits for the job of an asynchronous (-async) API call."""
+        status = result.get_child_content('result-status')
+        if status == 'failed':
+            raise netapp_api.NaApiError(
+                result.get_child_content('result-error-code'),
+                result.get_child_content('result-error-message'))
+        job_id = result.get_child_content('result-jobid')
+        if status == 'in_progress' and job_id:
+            self.wait_for_jobs([job_id], timeout)
+
+    def start_lun_move(self, path, new_path):
+        """Starts a non-disruptive move of a LUN to a different volume."""
+        seg = path.split("/")
+        new_seg = new_path.split("/")
+        LOG.debug("Starting move of LUN %(name)s from volume %(volume)s to "
+                  "volume %(new_volume)s.",
+                  {'name': seg[-1], 'volume': seg[2],
+                   'new_volume': new_seg[2]})
+        api_args = {
+            'paths': {
+                'lun-path-pair': {
+                    'source-path': path,
+                    'destination-path': new_path,
+                }
+            }
+        }
+        self.send_request('lun-move-start', api_args)
+
+    def _get_lun_move_statuses(self, paths):
+        """Fetch the state of many LUN moves with a single lun-move-get-iter
+        call. The moves are identified by the destination path of the LUNs.
+        The result is suitable for use by the AsyncPoller."""
+        api_args = {
+            'query': {
+                'lun-move-info': {
+                    'path': '|'.join(paths),
+                }
+            },
+            'desired-attributes': {
+                'lun-move-info': {
+                    'path': None,
+                    'job-status': None,
+                    'progress-percent': None,
+                    'last-failure-reason': None,
+                }
+            },
+            'max-records': len(paths),
+        }
+        result = self.send_request('lun-move-get-iter', api_args)
+        attr_list = result.get_child_by_name(
+            'attributes-list') or netapp_api.NaElement('none')
+
+        # Finished moves are eventually removed from the list, so a missing
+        # entry means that the move has completed.
+        statuses = dict.fromkeys(paths, (poller.COMPLETED, None))
+        for move_info in attr_list.get_children():
+            path = move_info.get_child_content('path')
+            state = move_info.get_child_content('job-status')
+            if state in LUN_MOVE_SUCCESS_STATES:
+                statuses[path] = (poller.COMPLETED, move_info)
+            elif state in LUN_MOVE_FAILURE_STATES:
+                statuses[path] = (poller.FAILED, netapp_api.NaApiError(
+                    state, move_info.get_child_content('last-failure-reason')))
+            else:
+                LOG.debug("LUN move to %s is %s%% complete", path,
+                          move_info.get_child_content('progress-percent'))
+                statuses[path] = (poller.RUNNING, move_info)
+        return statuses
+
+    def wait_for_lun_moves(self, paths, timeout=None):
+        """Waits for a set of LUN moves to finish. Returns a dictionary
+        mapping the destination path of each move to a tuple of the form
+        (state, info)."""
+        move_poller = poller.AsyncPoller(self._get_lun_move_statuses,
+                                         timeout=timeout)
+        for path in paths:
+            move_poller.add(path)
+        return move_poller.wait()
+
+    def create_volume_clone(self, name, parent_volume, parent_snapshot=None,
+                            space_reserve=None, timeout=None):
+        """Creates a FlexClone volume and waits for it to be ready."""
+        api_args = {
+            'volume': name,
+            'parent-volume': parent_volume,
+        }
+        if parent_snapshot:
+            api_args['parent-snapshot'] = parent_snapshot
+        if space_reserve:
+            api_args['space-reserve'] = space_reserve
+        result = self.send_request('volume-clone-create-async', api_args)
+        self._wait_for_async_result(result, timeout)
+
+    def destroy_lun(self, path, force=True, is_clone=False):
+        """Destroys the LUN at the path.
+
+        If is_clone is set, the LUN is deleted using the fast clone deletion
+        engine if it is supported. The LUN must not be mapped then.
+        """
+        if is_clone and self.features.FAST_CLONE_DELETE:
+            self.delete_file(path)
+            LOG.debug("Destroyed LUN clone %s", path.split("/")[-1])
+            return
+        super(Client, self).destroy_lun(path, force)
+
     def get_lun_by_args(self, **args):
         """Retrieves LUN with specified args."""
         lun_iter = netapp_api.NaElement('lun-get-iter')
@@ -334,17 +596,53 @@ class Client(client_base.Client):
         spec = qos_policy_group_info.get('spec')
         if spec is not None:
             self.qos_policy_group_create(spec['policy_name'],
-                                         spec['max_throughput'])
+                                         spec['max_throughput'],
+                                         spec.get('min_throughput'))
+
+    def qos_policy_group_exists(self, qos_policy_group_name):
+        """Checks if a QOS policy group exists."""
+        api_args = {
+            'query': {
+                'qos-policy-group-info': {
+                    'policy-group': qos_policy_group_name,
+                },
+            },
+            'desired-attributes': {
+                'qos-policy-group-info': {
+                    'policy-group': None,
+                },
+            },
+        }
+        result = self.send_request('qos-policy-group-get-iter', api_args,
+                                   False)
+        num_records = result.get_child_content('num-records')
+        return bool(num_records and int(num_records) >= 1)
 
-    def qos_policy_group_create(self, qos_policy_group_name, max_throughput):
+    def qos_policy_group_create(self, qos_policy_group_name, max_throughput,
+                                min_throughput=None):
         """Creates a QOS policy group."""
         api_args = {
             'policy-group': qos_policy_group_name,
-            'max-throughput': max_throughput,
             'vserver': self.vserver,
         }
+        if max_throughput:
+            api_args['max-throughput'] = max_throughput
+        if min_throughput:
+            api_args['min-throughput'] = min_throughput
         return self.send_request('qos-policy-group-create', api_args, False)
 
+    def qos_policy_group_modify(self, qos_policy_group_name, max_throughput,
+                                min_throughput=None):
+        """Modifies a QOS policy group."""
+        api_args = {
+            'policy-group': qos_policy_group_name,
+        }
+        if max_throughput:
+            api_args['max-throughput'] = max_throughput
+        if min_throughput:
+            api_args['min-throughput'] = min_throughput
+        return self.send_request('qos-policy-group-modify', api_args, False)
+
     def qos_policy_group_delete(self, qos_policy_group_name):
         """Attempts to delete a QOS policy group."""
         api_args = {
@@ -623,6 +921,109 @@ class Client(client_base.Client):
 
         return size_total, size_available
 
+    def get_flexvol_capacities(self):
+        """Gets total capacity and free capacity, in bytes, of all flexvols."""
+
+        query = {
+            'volume-attributes': {
+                'volume-id-attributes': {
+                    'owning-vserver-name': self.vserver,
+                },
+                'volume-state-attributes': {
+                    'state': 'online',
+                },
+            }
+        }
+        desired_attributes = {
+            'volume-attributes': {
+                'volume-id-attributes': {
+                    'name': None,
+                },
+                'volume-space-attributes': {
+                    'size-available': None,
+                    'size-total': None,
+                },
+            }
+        }
+        result = netapp_api.invoke_api(
+            self.connection, api_name='volume-get-iter', query=query,
+            des_result=desired_attributes, is_iter=True, tunnel=self.vserver)
+
+        capacities = {}
+        for res in result:
+            attributes_list = res.get_child_by_name(
+                'attributes-list') or netapp_api.NaElement('none')
+            for volume_attributes in attributes_list.get_children():
+                volume_id_attributes = volume_attributes.get_child_by_name(
+                    'volume-id-attributes')
+                volume_space_attributes = volume_attributes.get_child_by_name(
+                    'volume-space-attributes')
+                capacities[volume_id_attributes.get_child_content('name')] = (
+                    float(volume_space_attributes.get_child_content(
+                        'size-total')),
+                    float(volume_space_attributes.get_child_content(
+                        'size-available')))
+        return capacities
+
+    def get_snapshot_names(self, volume):
+        """Returns the names of the Snapshot copies of a volume."""
+        query = {
+            'snapshot-info': {
+                'volume': volume,
+                'vserver': self.vserver,
+            }
+        }
+        desired_attributes = {
+            'snapshot-info': {
+                'name': None,
+            }
+        }
+        result = netapp_api.invoke_api(
+            self.connection, api_name='snapshot-get-iter', query=query,
+            des_result=desired_attributes, is_iter=True, tunnel=self.vserver)
+
+        names = []
+        for res in result:
+            attributes_list = res.get_child_by_name(
+                'attributes-list') or netapp_api.NaElement('none')
+            for snapshot_info in attributes_list.get_children():
+                names.append(snapshot_info.get_child_content('name'))
+        return names
+
+    def get_flexvol_aggregates(self):
+        """Gets the name of the aggregate hosting each flexvol."""
+
+        query = {
+            'volume-attributes': {
+                'volume-id-attributes': {
+                    'owning-vserver-name': self.vserver,
+                },
+            }
+        }
+        desired_attributes = {
+            'volume-attributes': {
+                'volume-id-attributes': {
+                    'name': None,
+                    'containing-aggregate-name': None,
+                },
+            }
+        }
+        result = netapp_api.invoke_api(
+            self.connection, api_name='volume-get-iter', query=query,
+            des_result=desired_attributes, is_iter=True, tunnel=self.vserver)
+
+        aggregates = {}
+        for res in result:
+            attributes_list = res.get_child_by_name(
+                'attributes-list') or netapp_api.NaElement('none')
+            for volume_attributes in attributes_list.get_children():
+                volume_id_attributes = volume_attributes.get_child_by_name(
+                    'volume-id-attributes')
+                aggregates[volume_id_attributes.get_child_content('name')] = \
+                    volume_id_attributes.get_child_content(
+                        'containing-aggregate-name')
+        return aggregates
+
     def delete_file(self, path_to_file):
         """Delete file at path."""
 
@@ -0,0 +1,1036 @@
+# Copyright (c) 2016 GRNET S.A.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Client for the ONTAP REST API.
+
+This client offers the same interface as the zAPI clustered Data ONTAP client,
+so that the provider can use either of them. The requests only fetch the
+fields that are needed, collections are read in large pages that are consumed
+one record at a time, and LUNs are modified or deleted with a single
+query-based request instead of being looked up first. Keep-alive connections
+to the storage system are pooled and shared among threads.
+
+LUNs are returned as RestLun objects that answer get_child_content() with the
+zAPI attribute names, so they can be used wherever zAPI lun-info elements are
+expected. Errors are raised as NaApiError. The errors the callers check for
+(e.g. duplicate entries) are reported with the equivalent zAPI error code.
+"""
+
+import base64
+import json
+import time
+import socket
+import logging
+import threading
+
+import six
+from six.moves import http_client
+from six.moves.urllib.parse import urlencode
+
+from extstorage_dataontap.client import api as netapp_api
+from extstorage_dataontap.client import lifs
+from extstorage_dataontap.client import ratelimit
+from extstorage_dataontap.client import poller
+
+LOG = logging.getLogger(__name__)
+DELETED_PREFIX = 'deleted_cinder_'
+
+# Number of idle connections kept open per storage system
+POOL_SIZE = 4
+# Socket timeout in seconds
+TIMEOUT = 60
+# Number of records requested per page
+MAX_RECORDS = 1000
+# Maximum number of LUN paths in a single query
+MAX_QUERY_PATHS = 50
+# Time in seconds the storage system may take to finish a job before
+# returning a response to a modifying request
+RETURN_TIMEOUT = 30
+
+# zAPI error codes reported for the equivalent HTTP status codes
+EOBJECTNOTFOUND = '15661'
+EDUPLICATEENTRY = '13130'
+HTTP_ERROR_CODES = {
+    http_client.NOT_FOUND: EOBJECTNOTFOUND,
+    http_client.CONFLICT: EDUPLICATEENTRY,
+}
+
+# Job states
+JOB_SUCCESS_STATES = ('success',)
+JOB_FAILURE_STATES = ('failure',)
+
+# LUN movement states
+LUN_MOVE_SUCCESS_STATES = ('success',)
+LUN_MOVE_FAILURE_STATES = ('failed', 'paused_error')
+
+# Maps the zAPI lun-info attributes to the REST LUN fields
+LUN_FIELDS = {
+    'path': 'name',
+    'size': 'space.size',
+    'comment': 'comment',
+    'vserver': 'svm.name',
+    'volume': 'location.volume.name',
+    'qtree': 'location.qtree.name',
+    'multiprotocol-type': 'os_type',
+    'is-space-reservation-enabled': 'space.guarantee.requested',
+    'uuid': 'uuid',
+    'qos-policy-group': 'qos_policy.name',
+    'online': 'enabled',
+    'mapped': 'status.mapped',
+}
+
+
+def _get_field(record, field):
+    """Returns the value of a dotted field of a record or None"""
+    for key in field.split('.'):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record
+
+
+def _to_zapi(value):
+    """Convert a REST value to its zAPI string representation"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return six.text_type(value)
+
+
+def _throughput_fields(spec, kind):
+    """Convert a zAPI throughput specification (e.g. "100iops,10MB/s") to
+    the fields of a REST QoS policy"""
+    fields = {}
+    for limit in (spec or '').split(','):
+        limit = limit.strip().lower()
+        if limit.endswith('iops'):
+            fields['%s_throughput_iops' % kind] = int(limit[:-4])
+        elif limit.endswith('mb/s'):
+            fields['%s_throughput_mbps' % kind] = int(limit[:-4])
+    return fields
+
+
+class RestLun(object):
+    """A LUN record of the REST API that looks like a zAPI lun-info"""
+
+    def __init__(self, record):
+        self.record = record
+
+    def get_child_content(self, name):
+        """Returns the value of a zAPI lun-info attribute"""
+        field = LUN_FIELDS.get(name)
+        if field is None:
+            return None
+        return _to_zapi(_get_field(self.record, field))
+
+    def __repr__(self):
+        return "<RestLun %s>" % self.record.get('name')
+
+
+class ConnectionPool(object):
+    """A pool of keep-alive HTTP(S) connections to a storage system"""
+
+    def __init__(self, host, port, transport_type, verify_cert,
+                 size=POOL_SIZE, timeout=TIMEOUT):
+        self.host = host
+        self.port = port
+        self.transport_type = transport_type
+        self.size = size
+        self.timeout = timeout
+        self._context = None
+        if transport_type == 'https' and not verify_cert:
+            import ssl
+            self._context = ssl._create_unverified_context()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new connection"""
+        if self.transport_type == 'https':
+            kwargs = {'timeout': self.timeout}
+            if self._context is not None:
+                kwargs['context'] = self._context
+            return http_client.HTTPSConnection(self.host, self.port, **kwargs)
+        return http_client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+
+    def get(self):
+        """Returns an idle connection and whether it has been used before"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def put(self, conn):
+        """Return a connection to the pool"""
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Client(object):
+
+    def __init__(self, **kwargs):
+        port = kwargs.get('port')
+        transport_type = kwargs['transport_type']
+        if not port:
+            port = 443 if transport_type == 'https' else 80
+
+        # With several management addresses, each request goes to the
+        # fastest one, exactly like the zAPI calls
+        host = kwargs['hostname']
+        self.lifs = None
+        self.hedge_percentile = None
+        if not isinstance(host, six.string_types):
+            self.lifs = lifs.LifSelector(
+                host, port, cache_file=kwargs.get('lif_cache_file'),
+                ttl=kwargs.get('lif_cache_ttl', 300),
+                resolve_names=not kwargs['verify_cert'])
+            self.hedge_percentile = kwargs.get('hedge_percentile')
+        self.host = host
+        self.port = port
+        self.transport_type = transport_type
+        self.verify_cert = kwargs['verify_cert']
+        self.timeout = kwargs.get('timeout') or TIMEOUT
+        self.retries = kwargs.get('retries', 0)
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        credentials = '%s:%s' % (kwargs['username'], kwargs['password'])
+        self._auth = 'Basic %s' % base64.b64encode(
+            credentials.encode('utf-8')).decode('ascii')
+        self.vserver = kwargs.get('vserver', None)
+        self.deadline = kwargs.get('deadline')
+        self.limiter = None
+        if any((kwargs.get('rate_limits') or {}).values()):
+            self.limiter = ratelimit.RateLimiter(
+                kwargs['rate_limits'], kwargs['rate_limit_burst'],
+                state_file=kwargs['rate_limit_file'],
+                lock_file=kwargs['rate_limit_lock_file'],
+                metrics_file=kwargs.get('rate_limit_metrics_file'))
+        LOG.debug('Using NetApp controller: %s (REST)', self.host)
+
+    def _call_timeout(self):
+        """Returns the socket timeout of the next request, making sure it
+        does not go past the deadline"""
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise netapp_api.NaApiDeadlineError(
+                message='Time budget exhausted')
+        return min(self.timeout, remaining)
+
+    def _get_addresses(self):
+        """Returns the management addresses in the order they should be
+        tried"""
+        if self.lifs is None:
+            return [self.host]
+        return self.lifs.order()
+
+    def _get_pool(self, address):
+        """Returns the connection pool of a management address"""
+        with self._pools_lock:
+            pool = self._pools.get(address)
+            if pool is None:
+                pool = self._pools[address] = ConnectionPool(
+                    address, self.port, self.transport_type,
+                    self.verify_cert, timeout=self.timeout)
+            return pool
+
+    def close(self):
+        """Close the idle connections to all the management addresses"""
+        with self._pools_lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+    def _request(self, method, path, query=None, body=None):
+        """Send a request and return the decoded response. The request is
+        failed over to the other management addresses, hedged and retried
+        like the zAPI calls."""
+        url = '/api' + path
+        if query:
+            url += '?' + urlencode(sorted(query.items()))
+        headers = {'Authorization': self._auth,
+                   'Accept': 'application/json'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        name = '%s %s' % (method, path.split('?')[0])
+        read = method == 'GET'
+
+        def invoke():
+            return netapp_api.invoke_addresses(
+                lambda address: self._request_address(
+                    address, method, url, body, headers),
+                name, read, self._get_addresses(), self.lifs,
+                self.hedge_percentile)
+
+        return netapp_api.call_with_retries(invoke, name, read, self.retries,
+                                            self.deadline)
+
+    def _request_address(self, address, method, url, body, headers):
+        """Send a request to a specific management address and return the
+        decoded response. Connections that have been closed by the storage
+        system while idle are replaced transparently, as long as the request
+        is a read or it could not be sent at all."""
+        # Every request sent takes a token, including the hedged ones
+        if self.limiter is not None:
+            self.limiter.acquire(
+                ratelimit.READ if method == 'GET' else ratelimit.WRITE,
+                self.deadline)
+
+        pool = self._get_pool(address)
+        while True:
+            timeout = self._call_timeout()
+            conn, reused = pool.get()
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            start = time.time()
+            sent = False
+            try:
+                conn.request(method, url, body, headers)
+                sent = True
+                response = conn.getresponse()
+                data = response.read()
+            except (socket.error, http_client.HTTPException) as e:
+                conn.close()
+                # A modifying request may have been carried out even if its
+                # response was lost, so it is only sent again if it never
+                # left. Timeouts are not caused by stale connections.
+                if reused and (not sent or (method == 'GET' and not
+                                            isinstance(e, socket.timeout))):
+                    LOG.debug("Pooled connection failed: %s. Reconnecting",
+                              e)
+                    continue
+                if self.lifs is not None:
+                    self.lifs.record_failure(address)
+                if not sent:
+                    raise netapp_api.NaApiConnectionError(
+                        message=str(e),
+                        transient=netapp_api._is_transient(e))
+                raise netapp_api.NaApiResponseError(
+                    message=str(e) or 'timed out')
+            break
+        if self.lifs is not None:
+            self.lifs.record(address, time.time() - start)
+
+        if response.getheader('connection', '').lower() == 'close':
+            conn.close()
+        else:
+            pool.put(conn)
+
+        try:
+            result = json.loads(data.decode('utf-8')) if data else {}
+        except ValueError:
+            result = {}
+        if response.status >= 400:
+            error = result.get('error', {})
+            code = HTTP_ERROR_CODES.get(response.status,
+                                        error.get('code', response.status))
+            # Throttling and gateway errors keep their status code, so that
+            # they are retried like the zAPI calls
+            if six.text_type(response.status) in \
+                    netapp_api.RETRYABLE_ERROR_CODES + \
+                    netapp_api.READ_RETRYABLE_ERROR_CODES:
+                code = response.status
+            raise netapp_api.NaApiError(
+                code, error.get('message', response.reason))
+        return result
+
+    def _iter_pages(self, path, query=None, fields=None):
+        """Yields the records of a collection one page at a time, fetching
+        the next page only when the current one has been consumed"""
+        query = dict(query or {})
+        query['max_records'] = MAX_RECORDS
+        if fields:
+            query['fields'] = ','.join(fields)
+        result = self._request('GET', path, query)
+        while True:
+            yield result.get('records', [])
+            next_href = _get_field(result, '_links.next.href')
+            if not next_href:
+                break
+            # The link is relative to the server and includes the query
+            result = self._request('GET', next_href[len('/api'):])
+
+    def _iter_records(self, path, query=None, fields=None):
+        """Yields the records of a collection one by one"""
+        for page in self._iter_pages(path, query, fields):
+            for record in page:
+                yield record
+
+    def _svm_query(self, **query):
+        """Returns a query restricted to the vserver of the client"""
+        if self.vserver:
+            query['svm.name'] = self.vserver
+        return query
+
+    def _modify(self, method, path, query=None, body=None, timeout=None):
+        """Send a modifying request and wait for the job it may start"""
+        query = dict(query or {})
+        query['return_timeout'] = RETURN_TIMEOUT
+        result = self._request(method, path, query, body)
+        job_uuid = _get_field(result, 'job.uuid')
+        if job_uuid:
+            self.wait_for_jobs([job_uuid], timeout)
+        return result
+
+    def _get_job_statuses(self, job_uuids):
+        """Fetch the state of many jobs with a single request. The result is
+        suitable for use by the AsyncPoller."""
+        query = {'uuid': '|'.join(job_uuids)}
+        statuses = {}
+        for job in self._iter_records('/cluster/jobs', query,
+                                      ('uuid', 'state', 'code', 'message')):
+            state = job.get('state')
+            if state in JOB_SUCCESS_STATES:
+                statuses[job['uuid']] = (poller.COMPLETED, job)
+            elif state in JOB_FAILURE_STATES:
+                statuses[job['uuid']] = (poller.FAILED, netapp_api.NaApiError(
+                    job.get('code'), job.get('message')))
+            else:
+                statuses[job['uuid']] = (poller.RUNNING, job)
+        return statuses
+
+    def wait_for_jobs(self, job_uuids, timeout=None):
+        """Waits for a set of jobs to finish. Raises NaApiError if any of
+        them failed or did not finish in time."""
+        job_poller = poller.AsyncPoller(self._get_job_statuses,
+                                        timeout=timeout)
+        for job_uuid in job_uuids:
+            job_poller.add(job_uuid)
+        for job_uuid, (state, info) in job_poller.wait().items():
+            if state == poller.FAILED:
+                raise info
+            if state == poller.TIMEOUT:
+                raise netapp_api.NaApiError(
+                    'timeout', 'Job %s did not finish in time' % job_uuid)
+
+    def check_is_naelement(self, elem):
+        """Checks if object is a LUN returned by this client."""
+        if not isinstance(elem, RestLun):
+            raise ValueError('Expects RestLun')
+
+    def _get_lun_uuid(self, path):
+        """Returns the UUID of a LUN"""
+        for lun in self._iter_records('/storage/luns',
+                                      self._svm_query(name=path), ('uuid',)):
+            return lun['uuid']
+        raise netapp_api.NaApiError(EOBJECTNOTFOUND,
+                                    'LUN %s not found' % path)
+
+    def _get_igroup_uuid(self, igroup_name):
+        """Returns the UUID of an igroup"""
+        for igroup in self._iter_records('/protocols/san/igroups',
+                                         self._svm_query(name=igroup_name),
+                                         ('uuid',)):
+            return igroup['uuid']
+        raise netapp_api.NaApiError(EOBJECTNOTFOUND,
+                                    'igroup %s not found' % igroup_name)
+
+    def create_lun(self, volume_name, lun_name, size, metadata,
+                   qos_policy_group_name=None):
+        """Issues API request for creating LUN on volume."""
+        path = '/vol/%s/%s' % (volume_name, lun_name)
+        body = {
+            'svm': {'name': self.vserver},
+            'name': path,
+            'os_type': metadata['OsType'],
+            'space': {
+                'size': int(size),
+                'guarantee': {
+                    'requested': metadata['SpaceReserved'] == 'true',
+                },
+            },
+        }
+        if qos_policy_group_name:
+            body['qos_policy'] = {'name': qos_policy_group_name}
+        try:
+            self._modify('POST', '/storage/luns', body=body)
+        except netapp_api.NaApiError as ex:
+            LOG.error("Error provisioning volume %(lun_name)s on "
+                      "%(volume_name)s. Details: %(ex)s",
+                      {'lun_name': lun_name, 'volume_name': volume_name,
+                       'ex': ex})
+            raise
+
+    def destroy_lun(self, path, force=True, is_clone=False):
+        """Destroys the LUN at the path."""
+        query = self._svm_query(name=path)
+        if force:
+            query['allow_delete_while_mapped'] = 'true'
+        self._modify('DELETE', '/storage/luns', query)
+        LOG.debug("Destroyed LUN %s", path.split("/")[-1])
+
+    def clone_lun(self, volume, name, new_name, space_reserved='true',
+                  qos_policy_group_name=None, src_block=0, dest_block=0,
+                  block_count=0, source_snapshot=None):
+        """Clones a LUN of a volume, or the copy of the LUN in a Snapshot
+        copy of the volume. If block_count is given, only that many blocks
+        are cloned into the existing new LUN, starting at the given source
+        and destination blocks."""
+        if block_count:
+            self._clone_lun_blocks(volume, name, new_name, src_block,
+                                   dest_block, block_count, source_snapshot)
+            if qos_policy_group_name is not None:
+                self.set_lun_qos_policy_group(
+                    '/vol/%s/%s' % (volume, new_name), qos_policy_group_name)
+            return
+        source = '/vol/%s/%s' % (volume, name)
+        if source_snapshot is not None:
+            source = '/vol/%s/.snapshot/%s/%s' % (volume, source_snapshot,
+                                                  name)
+        body = {
+            'svm': {'name': self.vserver},
+            'name': '/vol/%s/%s' % (volume, new_name),
+            'clone': {'source': {'name': source}},
+            'space': {'guarantee': {'requested': space_reserved == 'true'}},
+        }
+        if qos_policy_group_name is not None:
+            body['qos_policy'] = {'name': qos_policy_group_name}
+        self._modify('POST', '/storage/luns', body=body)
+
+    def _clone_lun_blocks(self, volume, name, new_name, src_block, dest_block,
+                          block_count, source_snapshot=None):
+        """Clones a range of blocks of a LUN into another LUN of the same
+        volume with a sub-file clone"""
+        # A single range can only handle 2^24 blocks
+        bc_limit = 2 ** 24  # 8GB
+        ranges = []
+        while block_count > 0:
+            count = min(block_count, bc_limit)
+            ranges.append('%d:%d:%d' % (src_block, dest_block, count))
+            src_block += count
+            dest_block += count
+            block_count -= count
+        source_path = name
+        if source_snapshot is not None:
+            source_path = '.snapshot/%s/%s' % (source_snapshot, name)
+        self._modify('POST', '/storage/file/clone',
+                     body={'volume': {'name': volume},
+                           'source_path': source_path,
+                           'destination_path': new_name,
+                           'range': ranges})
+
+    def _get_volume_uuid(self, volume):
+        """Returns the UUID of a volume"""
+        for vol in self._iter_records('/storage/volumes',
+                                      self._svm_query(name=volume),
+                                      ('uuid',)):
+            return vol['uuid']
+        raise netapp_api.NaApiError(EOBJECTNOTFOUND,
+                                    'Volume %s not found' % volume)
+
+    def create_snapshot(self, volume, snapshot_name):
+        """Creates a Snapshot copy of a volume."""
+        self._modify('POST', '/storage/volumes/%s/snapshots' %
+                     self._get_volume_uuid(volume),
+                     body={'name': snapshot_name})
+
+    def get_snapshot_names(self, volume):
+        """Returns the names of the Snapshot copies of a volume."""
+        return [snapshot['name'] for snapshot in self._iter_records(
+            '/storage/volumes/%s/snapshots' % self._get_volume_uuid(volume),
+            fields=('name',))]
+
+    def delete_snapshot(self, volume, snapshot_name):
+        """Deletes a Snapshot copy of a volume."""
+        volume_uuid = self._get_volume_uuid(volume)
+        for snapshot in self._iter_records(
+                '/storage/volumes/%s/snapshots' % volume_uuid,
+                {'name': snapshot_name}, ('uuid',)):
+            self._modify('DELETE', '/storage/volumes/%s/snapshots/%s' %
+                         (volume_uuid, snapshot['uuid']))
+            return
+        raise netapp_api.NaApiError(
+            EOBJECTNOTFOUND, 'Snapshot copy %s not found' % snapshot_name)
+
+    def create_cg_snapshot(self, volumes, snapshot_name):
+        """Creates a Snapshot copy of many volumes at the same point in time.
+        REST only takes such Snapshot copies of consistency groups, so a
+        consistency group of the volumes is created for the Snapshot copy and
+        deleted right after it. Deleting a consistency group leaves its
+        volumes and their Snapshot copies in place."""
+        body = {
+            'svm': {'name': self.vserver},
+            'name': snapshot_name,
+            'volumes': [{'name': volume,
+                         'provisioning_options': {'action': 'add'}}
+                        for volume in volumes],
+        }
+        self._modify('POST', '/application/consistency-groups', body=body)
+        for cg in self._iter_records('/application/consistency-groups',
+                                     self._svm_query(name=snapshot_name),
+                                     ('uuid',)):
+            cg_uuid = cg['uuid']
+            break
+        else:
+            raise netapp_api.NaApiError(
+                EOBJECTNOTFOUND,
+                'Consistency group %s not found' % snapshot_name)
+        try:
+            self._modify('POST', '/application/consistency-groups/%s/'
+                         'snapshots' % cg_uuid,
+                         body={'name': snapshot_name,
+                               'consistency_type': 'crash'})
+        finally:
+            self._modify('DELETE', '/application/consistency-groups/%s' %
+                         cg_uuid)
+
+    def _patch_lun(self, path, body):
+        """Modify a LUN with a query-based PATCH"""
+        result = self._modify('PATCH', '/storage/luns',
+                              self._svm_query(name=path), body)
+        if result.get('num_records') == 0:
+            raise netapp_api.NaApiError(EOBJECTNOTFOUND,
+                                        'LUN %s not found' % path)
+        return result
+
+    def do_direct_resize(self, path, new_size_bytes, force=True):
+        """Resize the LUN."""
+        LOG.info("Resizing LUN %s directly to new size.", path.split("/")[-1])
+        self._patch_lun(path, {'space': {'size': int(new_size_bytes)}})
+
+    def move_lun(self, path, new_path):
+        """Moves the LUN at path to new path."""
+        LOG.debug("Moving LUN %(name)s to %(new_name)s.",
+                  {'name': path.split("/")[-1],
+                   'new_name': new_path.split("/")[-1]})
+        self._patch_lun(path, {'name': new_path})
+
+    def set_lun_comment(self, path, comment):
+        """Set comment on LUN"""
+        try:
+            self._patch_lun(path, {'comment': six.text_type(comment)})
+        except netapp_api.NaApiError as e:
+            LOG.warning('Error adding a comment on LUN. Code :%(code)s, '
+                        'Message: %(message)s',
+                        {'code': e.code, 'message': e.message})
+            raise
+
+    def set_lun_qos_policy_group(self, path, qos_policy_group):
+        """Sets qos_policy_group on a LUN."""
+        self._patch_lun(path, {'qos_policy': {'name': qos_policy_group}})
+
+    def get_lun_attribute(self, path, name):
+        """Gets the value of a named attribute of a LUN or None if the
+        attribute is not set."""
+        try:
+            result = self._request(
+                'GET', '/storage/luns/%s/attributes/%s' %
+                (self._get_lun_uuid(path), name))
+        except netapp_api.NaApiError as e:
+            if e.code != EOBJECTNOTFOUND:
+                raise
+            LOG.debug("Attribute %(name)s of LUN %(path)s not found: %(ex)s",
+                      {'name': name, 'path': path, 'ex': e})
+            return None
+        return result.get('value')
+
+    def set_lun_attribute(self, path, name, value):
+        """Sets a named attribute of a LUN."""
+        lun_uuid = self._get_lun_uuid(path)
+        value = six.text_type(value)
+        try:
+            self._request('PATCH', '/storage/luns/%s/attributes/%s' %
+                          (lun_uuid, name), body={'value': value})
+        except netapp_api.NaApiError as e:
+            if e.code != EOBJECTNOTFOUND:
+                raise
+            self._request('POST', '/storage/luns/%s/attributes' % lun_uuid,
+                          body={'name': name, 'value': value})
+
+    def _iter_luns(self, query):
+        """Yields the LUNs matching a query"""
+        fields = sorted(set(LUN_FIELDS.values()))
+        for record in self._iter_records('/storage/luns',
+                                         self._svm_query(**query), fields):
+            yield RestLun(record)
+
+    def get_lun_list(self):
+        """Gets the list of LUNs of the vserver."""
+        return list(self._iter_luns({}))
+
+    def _lun_query(self, args):
+        """Returns the query matching a set of zAPI lun-info args"""
+        query = {}
+        for name, value in args.items():
+            if name not in LUN_FIELDS:
+                raise ValueError("Unsupported LUN attribute: %s" % name)
+            query[LUN_FIELDS[name]] = _to_zapi(value)
+        return query
+
+    def iter_lun_pages(self, attributes=None, query=None):
+        """Yields the LUNs of the vserver one page at a time. The next page
+        is only fetched once the current one has been consumed. If
+        attributes is given, only these zAPI lun-info attributes are
+        fetched. If query is given, only the LUNs whose zAPI lun-info
+        attributes match it are listed."""
+        if attributes:
+            for name in attributes:
+                if name not in LUN_FIELDS:
+                    raise ValueError("Unsupported LUN attribute: %s" % name)
+            fields = sorted(set(LUN_FIELDS[a] for a in attributes))
+        else:
+            fields = sorted(set(LUN_FIELDS.values()))
+        for page in self._iter_pages(
+                '/storage/luns',
+                self._svm_query(**self._lun_query(query or {})), fields):
+            yield [RestLun(record) for record in page]
+
+    def get_lun_by_args(self, **args):
+        """Retrieves LUNs with specified zAPI lun-info args."""
+        return list(self._iter_luns(self._lun_query(args)))
+
+    def map_lun(self, path, igroup_name, lun_id=None):
+        """Maps LUN to the initiator and returns LUN id assigned."""
+        body = {
+            'svm': {'name': self.vserver},
+            'lun': {'name': path},
+            'igroup': {'name': igroup_name},
+        }
+        if lun_id:
+            body['logical_unit_number'] = int(lun_id)
+        try:
+            result = self._request('POST', '/protocols/san/lun-maps',
+                                   {'return_records': 'true'}, body)
+        except netapp_api.NaApiError as e:
+            LOG.warning('Error mapping LUN. Code :%(code)s, Message: '
+                        '%(message)s', {'code': e.code, 'message': e.message})
+            raise
+        for record in result.get('records', []):
+            return _to_zapi(record.get('logical_unit_number'))
+        return None
+
+    def unmap_lun(self, path, igroup_name):
+        """Unmaps a LUN from given initiator. Unmapping a LUN that is not
+        mapped is not an error."""
+        self._modify('DELETE', '/protocols/san/lun-maps',
+                     self._svm_query(**{'lun.name': path,
+                                        'igroup.name': igroup_name}))
+
+    def get_lun_map(self, path):
+        """Gets the LUN map by LUN path."""
+        fields = ('igroup.name', 'logical_unit_number', 'svm.name')
+        return [{'initiator-group': _get_field(m, 'igroup.name'),
+                 'lun-id': _to_zapi(m.get('logical_unit_number')),
+                 'vserver': _get_field(m, 'svm.name')}
+                for m in self._iter_records(
+                    '/protocols/san/lun-maps',
+                    self._svm_query(**{'lun.name': path}), fields)]
+
+    def get_lun_maps(self, paths=None):
+        """Gets all the LUN maps of the vserver, or only the maps of a list
+        of LUN paths, along with the nodes they are reported through."""
+        if paths is None:
+            queries = [self._svm_query()]
+        else:
+            # Keep the URLs short
+            paths = list(paths)
+            queries = [self._svm_query(**{'lun.name': '|'.join(
+                paths[i:i + MAX_QUERY_PATHS])})
+                for i in range(0, len(paths), MAX_QUERY_PATHS)]
+        fields = ('lun.name', 'igroup.name', 'logical_unit_number',
+                  'reporting_nodes.name')
+        return [{'path': _get_field(m, 'lun.name'),
+                 'initiator-group': _get_field(m, 'igroup.name'),
+                 'lun-id': _to_zapi(m.get('logical_unit_number')),
+                 'reporting-nodes': [n.get('name') for n in
+                                     m.get('reporting_nodes', [])]}
+                for query in queries
+                for m in self._iter_records('/protocols/san/lun-maps',
+                                            query, fields)]
+
+    def _get_volume_node(self, volume):
+        """Returns the home node of the aggregate hosting a volume"""
+        for vol in self._iter_records('/storage/volumes',
+                                      self._svm_query(name=volume),
+                                      ('aggregates.uuid',)):
+            for aggr in vol.get('aggregates', []):
+                result = self._request(
+                    'GET', '/storage/aggregates/%s' % aggr['uuid'],
+                    {'fields': 'home_node.name'})
+                return _get_field(result, 'home_node.name')
+        raise netapp_api.NaApiError(EOBJECTNOTFOUND,
+                                    'Volume %s not found' % volume)
+
+    def add_lun_map_reporting_nodes(self, path, igroup_name, volume):
+        """Adds the nodes of the HA pair hosting a volume to the reporting
+        nodes of a LUN map."""
+        # The HA partner of the node is added as well
+        self._modify('POST', '/protocols/san/lun-maps/%s/%s/reporting-nodes' %
+                     (self._get_lun_uuid(path),
+                      self._get_igroup_uuid(igroup_name)),
+                     body={'name': self._get_volume_node(volume)})
+
+    def remove_lun_map_remote_reporting_nodes(self, path, igroup_name):
+        """Restricts the reporting nodes of a LUN map to the node owning the
+        LUN and its HA partner."""
+        lun = self._request('GET', '/storage/luns/%s' %
+                            self._get_lun_uuid(path),
+                            {'fields': 'uuid,location.volume.name'})
+        node = self._get_volume_node(_get_field(lun, 'location.volume.name'))
+        local = set([node])
+        for info in self._iter_records('/cluster/nodes', {'name': node},
+                                       ('ha.partners.name',)):
+            local.update(p['name'] for p in
+                         _get_field(info, 'ha.partners') or [])
+
+        nodes_path = '/protocols/san/lun-maps/%s/%s/reporting-nodes' % (
+            lun['uuid'], self._get_igroup_uuid(igroup_name))
+        for reporting in list(self._iter_records(nodes_path, None,
+                                                 ('name', 'uuid'))):
+            if reporting['name'] in local:
+                continue
+            try:
+                self._modify('DELETE', '%s/%s' % (nodes_path,
+                                                  reporting['uuid']))
+            except netapp_api.NaApiError as e:
+                # Removing a node removes its HA partner too
+                if e.code != EOBJECTNOTFOUND:
+                    raise
+
+    def start_lun_move(self, path, new_path):
+        """Starts a non-disruptive move of a LUN to a different volume."""
+        seg = path.split("/")
+        new_seg = new_path.split("/")
+        LOG.debug("Starting move of LUN %(name)s from volume %(volume)s to "
+                  "volume %(new_volume)s.",
+                  {'name': seg[-1], 'volume': seg[2],
+                   'new_volume': new_seg[2]})
+        self._patch_lun(path, {'name': new_path})
+
+    def _get_lun_move_statuses(self, paths):
+        """Fetch the state of many LUN moves with a single request. The moves
+        are identified by the destination path of the LUNs. The result is
+        suitable for use by the AsyncPoller."""
+        fields = ('name', 'movement.progress.state',
+                  'movement.progress.percent_complete',
+                  'movement.progress.failure.message')
+        statuses = dict.fromkeys(paths, (poller.COMPLETED, None))
+        for lun in self._iter_records(
+                '/storage/luns', self._svm_query(name='|'.join(paths)),
+                fields):
+            path = lun['name']
+            progress = _get_field(lun, 'movement.progress') or {}
+            state = progress.get('state')
+            if state is None or state in LUN_MOVE_SUCCESS_STATES:
+                statuses[path] = (poller.COMPLETED, lun)
+            elif state in LUN_MOVE_FAILURE_STATES:
+                statuses[path] = (poller.FAILED, netapp_api.NaApiError(
+                    state, _get_field(progress, 'failure.message')))
+            else:
+                LOG.debug("LUN move to %s is %s%% complete", path,
+                          progress.get('percent_complete'))
+                statuses[path] = (poller.RUNNING, lun)
+        return statuses
+
+    def wait_for_lun_moves(self, paths, timeout=None):
+        """Waits for a set of LUN moves to finish. Returns a dictionary
+        mapping the destination path of each move to a tuple of the form
+        (state, info)."""
+        move_poller = poller.AsyncPoller(self._get_lun_move_statuses,
+                                         timeout=timeout)
+        for path in paths:
+            move_poller.add(path)
+        return move_poller.wait()
+
+    def get_igroup_alua(self, igroup_name):
+        """Returns whether ALUA is enabled on an igroup or None if the
+        igroup does not exist."""
+        for _igroup in self._iter_records('/protocols/san/igroups',
+                                          self._svm_query(name=igroup_name),
+                                          ('name',)):
+            # ALUA is always enabled on clustered Data ONTAP igroups
+            return True
+        return None
+
+    def get_iscsi_service_details(self):
+        """Returns iscsi iqn."""
+        for service in self._iter_records('/protocols/san/iscsi/services',
+                                          self._svm_query(),
+                                          ('target.name',)):
+            return _get_field(service, 'target.name')
+        LOG.debug('No iSCSI service found for vserver %s', self.vserver)
+        return None
+
+    def get_iscsi_target_details(self):
+        """Gets the iSCSI target portal details."""
+        fields = ('ip.address', 'enabled')
+        return [{'address': _get_field(lif, 'ip.address'),
+                 'port': '3260',
+                 'tpgroup-tag': None,
+                 'interface-enabled': _to_zapi(lif.get('enabled'))}
+                for lif in self._iter_records(
+                    '/network/ip/interfaces',
+                    self._svm_query(services='data_iscsi'), fields)]
+
+    def get_operational_network_interface_addresses(self):
+        """Gets the IP addresses of operational LIFs on the vserver."""
+        return [_get_field(lif, 'ip.address') for lif in self._iter_records(
+            '/network/ip/interfaces', self._svm_query(state='up'),
+            ('ip.address',))]
+
+    def get_fc_target_wwpns(self):
+        """Gets the FC target details."""
+        return [lif['wwpn'].lower() for lif in self._iter_records(
+            '/network/fc/interfaces', self._svm_query(enabled='true'),
+            ('wwpn',))]
+
+    def get_flexvol_capacities(self):
+        """Gets total capacity and free capacity, in bytes, of all flexvols."""
+        return dict((vol['name'], (float(_get_field(vol, 'space.size')),
+                                   float(_get_field(vol, 'space.available'))))
+                    for vol in self._iter_records(
+                        '/storage/volumes', self._svm_query(state='online'),
+                        ('name', 'space.size', 'space.available')))
+
+    def get_flexvol_aggregates(self):
+        """Gets the name of the aggregate hosting each flexvol."""
+        return dict((vol['name'],
+                     (vol.get('aggregates') or [{}])[0].get('name'))
+                    for vol in self._iter_records(
+                        '/storage/volumes', self._svm_query(),
+                        ('name', 'aggregates.name')))
+
+    def get_perf_counters(self, object_name, instances, counters):
+        """Gets the raw values of performance counters for a set of instances
+        of a performance object from the counter tables (ONTAP 9.11 or
+        newer). The instances are matched by their name property.
+
+        Returns a dictionary mapping each instance name to a dictionary of
+        counter names and values.
+        """
+        instances = set(instances)
+        query = {'counters.name': '|'.join(counters)}
+        values = {}
+        for row in self._iter_records(
+                '/cluster/counter/tables/%s/rows' % object_name, query,
+                ('properties', 'counters')):
+            properties = dict((p['name'], p.get('value'))
+                              for p in row.get('properties', []))
+            name = properties.get('name')
+            if name not in instances:
+                continue
+            values[name] = {}
+            for counter in row.get('counters', []):
+                if counter.get('name') not in counters:
+                    continue
+                try:
+                    values[name][counter['name']] = float(counter['value'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+        return values
+
+    def provision_qos_policy_group(self, qos_policy_group_info):
+        """Create QOS policy group on the backend if appropriate."""
+        if qos_policy_group_info is None:
+            return
+
+        # Legacy QOS uses externally provisioned QOS policy group,
+        # so we don't need to create one on the backend.
+        legacy = qos_policy_group_info.get('legacy')
+        if legacy is not None:
+            return
+
+        spec = qos_policy_group_info.get('spec')
+        if spec is not None:
+            self.qos_policy_group_create(spec['policy_name'],
+                                         spec['max_throughput'],
+                                         spec.get('min_throughput'))
+
+    def qos_policy_group_exists(self, qos_policy_group_name):
+        """Checks if a QOS policy group exists."""
+        for _policy in self._iter_records(
+                '/storage/qos/policies',
+                self._svm_query(name=qos_policy_group_name), ('name',)):
+            return True
+        return False
+
+    def _qos_fixed(self, max_throughput, min_throughput):
+        """Returns the fixed limits of a QoS policy"""
+        fixed = _throughput_fields(max_throughput, 'max')
+        fixed.update(_throughput_fields(min_throughput, 'min'))
+        return fixed
+
+    def qos_policy_group_create(self, qos_policy_group_name, max_throughput,
+                                min_throughput=None):
+        """Creates a QOS policy group."""
+        body = {
+            'svm': {'name': self.vserver},
+            'name': qos_policy_group_name,
+            'fixed': self._qos_fixed(max_throughput, min_throughput),
+        }
+        return self._modify('POST', '/storage/qos/policies', body=body)
+
+    def qos_policy_group_modify(self, qos_policy_group_name, max_throughput,
+                                min_throughput=None):
+        """Modifies a QOS policy group."""
+        body = {'fixed': self._qos_fixed(max_throughput, min_throughput)}
+        return self._modify('PATCH', '/storage/qos/policies',
+                            self._svm_query(name=qos_policy_group_name), body)
+
+    def qos_policy_group_delete(self, qos_policy_group_name):
+        """Attempts to delete a QOS policy group."""
+        return self._modify('DELETE', '/storage/qos/policies',
+                            self._svm_query(name=qos_policy_group_name))
+
+    def qos_policy_group_rename(self, qos_policy_group_name, new_name):
+        """Renames a QOS policy group."""
+        return self._modify('PATCH', '/storage/qos/policies',
+                            self._svm_query(name=qos_policy_group_name),
+                            {'name': new_name})
+
+    def mark_qos_policy_group_for_deletion(self, qos_policy_group_info):
+        """Do (soft) delete of backing QOS policy group for a LUN."""
+        if qos_policy_group_info is None:
+            return
+
+        # The policy group may still be in use right after the LUN has been
+        # deleted, so it is renamed and deleted later on a best effort basis.
+        spec = qos_policy_group_info.get('spec')
+        if spec is not None:
+            current_name = spec['policy_name']
+            new_name = DELETED_PREFIX + current_name
+            try:
+                self.qos_policy_group_rename(current_name, new_name)
+            except netapp_api.NaApiError as ex:
+                LOG.warning('Rename failure in cleanup of QOS policy group '
+                            '%(name)s: %(ex)s',
+                            {'name': current_name, 'ex': ex})
+
+        self.remove_unused_qos_policy_groups()
+
+    def remove_unused_qos_policy_groups(self):
+        """Deletes all QOS policy groups that are marked for deletion."""
+        query = self._svm_query(name='%s*' % DELETED_PREFIX)
+        query['continue_on_failure'] = 'true'
+        try:
+            self._modify('DELETE', '/storage/qos/policies', query)
+        except netapp_api.NaApiError as ex:
+            LOG.debug('Could not delete QOS policy groups. Details: %s', ex)
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,168 @@
+# Copyright (c) 2016 GRNET S.A.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Selection of the management LIF to send API calls to.
+
+The management addresses of a storage system are resolved once and cached
+along with the recent latencies of the calls sent to each address. Every call
+goes to the address with the lowest recent latency. Addresses that recently
+failed are only used after all the others. Since every provider invocation is
+a short-lived process, the state is kept in a file so that the history
+survives across invocations.
+"""
+
+import json
+import time
+import socket
+import logging
+import threading
+
+from extstorage_dataontap.client import utils
+
+LOG = logging.getLogger(__name__)
+
+# File hosting the resolved addresses and their latencies
+CACHE_FILE = '/var/lib/extstorage-dataontap/lifs.json'
+# Number of latency samples kept per address
+SAMPLES = 50
+# Minimum number of samples needed to compute a latency percentile
+MIN_SAMPLES = 5
+# Time in seconds an address is avoided after a failure
+FAILURE_PENALTY = 60
+# Minimum time in seconds between two writes of the state file
+SAVE_INTERVAL = 1.0
+
+
+def resolve(hosts, port):
+    """Returns the unique addresses the hosts resolve to. Hosts that can't be
+    resolved are returned as they are."""
+    addresses = []
+    for host in hosts:
+        try:
+            infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            LOG.warning("Unable to resolve %s: %s", host, e)
+            infos = [(None, None, None, None, (host,))]
+        for info in infos:
+            if info[4][0] not in addresses:
+                addresses.append(info[4][0])
+    return addresses
+
+
+def percentile(samples, pct):
+    """Returns the pct percentile of a list of samples"""
+    samples = sorted(samples)
+    index = int(round(pct / 100.0 * (len(samples) - 1)))
+    return samples[index]
+
+
+class LifSelector(object):
+    """Orders the management addresses of a storage system by their recent
+    latency"""
+
+    def __init__(self, hosts, port, cache_file=None, ttl=300,
+                 resolve_names=True):
+        self.hosts = list(hosts)
+        self.port = port
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.resolve_names = resolve_names
+        self._lock = threading.Lock()
+        self._saved = 0
+        self._state = self._load()
+
+    def _load(self):
+        """Load the cached state if it refers to the same hosts. The hosts
+        are resolved again when the cached addresses expire, but the latency
+        history is kept."""
+        previous = {}
+        if self.cache_file is not None:
+            try:
+                with open(self.cache_file) as f:
+                    state = json.load(f)
+                if state['hosts'] == self.hosts:
+                    if time.time() - state['timestamp'] <= self.ttl:
+                        return state
+                    previous = state
+            except (IOError, ValueError, KeyError):
+                pass
+
+        if self.resolve_names:
+            addresses = resolve(self.hosts, self.port)
+        else:
+            addresses = list(self.hosts)
+        LOG.debug("Management addresses: %s", ", ".join(addresses))
+        state = {'timestamp': time.time(), 'hosts': self.hosts,
+                 'addresses': addresses,
+                 'latency': previous.get('latency', {}),
+                 'failed': previous.get('failed', {})}
+        self._save(state, force=True)
+        return state
+
+    def _save(self, state, force=False):
+        """Atomically replace the state file. Concurrent processes may
+        overwrite each other's samples, which is fine for a heuristic."""
+        if self.cache_file is None:
+            return
+        now = time.time()
+        if not force and now - self._saved < SAVE_INTERVAL:
+            return
+        try:
+            utils.save_state(self.cache_file, state)
+            self._saved = now
+        except (IOError, OSError) as e:
+            LOG.debug("Unable to save the management address state: %s", e)
+
+    def _latency(self, address):
+        """Returns the average of the recent latencies of an address. Unknown
+        addresses are tried first so that they get measured."""
+        samples = self._state['latency'].get(address)
+        if not samples:
+            return 0.0
+        return sum(samples) / len(samples)
+
+    def order(self):
+        """Returns the addresses ordered by preference"""
+        now = time.time()
+        with self._lock:
+            failed = self._state['failed']
+            return sorted(self._state['addresses'], key=lambda a: (
+                now - failed.get(a, 0) < FAILURE_PENALTY, self._latency(a)))
+
+    def record(self, address, latency):
+        """Record the latency of a successful call"""
+        with self._lock:
+            samples = self._state['latency'].setdefault(address, [])
+            samples.append(latency)
+            del samples[:-SAMPLES]
+            self._state['failed'].pop(address, None)
+            self._save(self._state)
+
+    def record_failure(self, address):
+        """Record that an address failed to respond"""
+        LOG.warning("Management address %s failed", address)
+        with self._lock:
+            self._state['failed'][address] = time.time()
+            self._save(self._state, force=True)
+
+    def hedge_delay(self, address, pct):
+        """Returns the time after which a call to an address should be hedged
+        or None if there are not enough samples"""
+        with self._lock:
+            samples = self._state['latency'].get(address, [])
+            if len(samples) < MIN_SAMPLES:
+                return None
+            return percentile(samples, pct)
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
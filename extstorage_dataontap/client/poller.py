@@ -0,0 +1,146 @@
+# Copyright (c) 2016 GRNET S.A.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Poller for asynchronous Data ONTAP operations.
+
+Clone, move and job based APIs return an operation ID that has to be polled
+until the filer reports the operation as finished. Instead of spinning in a
+fixed sleep loop for each operation, the poller keeps track of all the
+outstanding operations and checks them with a single status call per round,
+backing off exponentially (with jitter) between the rounds.
+"""
+
+import logging
+import random
+import time
+
+LOG = logging.getLogger(__name__)
+
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+# Time to wait before the first status check in seconds
+INITIAL_INTERVAL = 0.1
+# Upper bound of the time to wait between two status checks in seconds
+MAX_INTERVAL = 5.0
+# Multiplier applied to the interval after each round
+BACKOFF = 2.0
+# Fraction of the interval that is randomized
+JITTER = 0.25
+
+
+class AsyncPoller(object):
+    """Polls a set of outstanding asynchronous operations
+
+    The check function is called with the list of the pending operation IDs
+    and should return a dictionary mapping each ID to a tuple of the form
+    (state, info), where state is one of RUNNING, COMPLETED and FAILED and info
+    is whatever the caller needs to get back (e.g. the status element or the
+    error). Operations missing from the returned dictionary are considered to
+    be still running.
+    """
+
+    def __init__(self, check, timeout=None, initial_interval=INITIAL_INTERVAL,
+                 max_interval=MAX_INTERVAL, backoff=BACKOFF, jitter=JITTER):
+        self._check = check
+        self._timeout = timeout
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._jitter = jitter
+        self._pending = {}
+        self._results = {}
+
+    def add(self, op_id, timeout=None):
+        """Start tracking an operation. If a timeout is not specified, the
+        default timeout of the poller is used."""
+        timeout = timeout if timeout is not None else self._timeout
+        deadline = time.time() + timeout if timeout is not None else None
+        self._pending[op_id] = deadline
+
+    def pending(self):
+        """Returns the IDs of the operations that have not finished yet"""
+        return list(self._pending.keys())
+
+    def _sleep_time(self, interval):
+        """Randomize the interval and make sure we don't sleep past the
+        nearest deadline"""
+        delta = interval * self._jitter
+        sleep = interval + random.uniform(-delta, delta)
+
+        deadlines = [d for d in self._pending.values() if d is not None]
+        if deadlines:
+            sleep = min(sleep, max(min(deadlines) - time.time(), 0))
+        return max(sleep, 0)
+
+    def poll(self):
+        """Check all the pending operations once. Returns the operations that
+        finished in this round as a dictionary of op_id: (state, info)."""
+        if not self._pending:
+            return {}
+
+        finished = {}
+        statuses = self._check(self.pending())
+        now = time.time()
+        for op_id, deadline in list(self._pending.items()):
+            state, info = statuses.get(op_id, (RUNNING, None))
+            if state == RUNNING and deadline is not None and now >= deadline:
+                LOG.warning("Operation %s did not finish in time", op_id)
+                state = TIMEOUT
+            if state != RUNNING:
+                del self._pending[op_id]
+                finished[op_id] = (state, info)
+
+        self._results.update(finished)
+        return finished
+
+    def wait(self):
+        """Wait for all the pending operations to finish or time out. Returns
+        a dictionary of op_id: (state, info) for all the tracked operations."""
+        interval = self._initial_interval
+        time.sleep(self._sleep_time(interval))
+        while True:
+            self.poll()
+            if not self._pending:
+                break
+            interval = min(interval * self._backoff, self._max_interval)
+            sleep = self._sleep_time(interval)
+            LOG.debug("%d operation(s) still running. Checking again in "
+                      "%.2f seconds", len(self._pending), sleep)
+            time.sleep(sleep)
+
+        return self._results
+
+
+def retry(func, exceptions, retries, initial_interval=INITIAL_INTERVAL,
+          max_interval=MAX_INTERVAL, backoff=BACKOFF, jitter=JITTER):
+    """Call func retrying on the specified exceptions using the same backoff
+    policy the poller uses. The last exception is reraised if all the retries
+    fail."""
+    interval = initial_interval
+    for i in range(retries):
+        try:
+            return func()
+        except exceptions as e:
+            if i == retries - 1:
+                raise
+            delta = interval * jitter
+            sleep = interval + random.uniform(-delta, delta)
+            LOG.debug("Call failed: %s. Retrying in %.2f seconds", e, sleep)
+            time.sleep(sleep)
+            interval = min(interval * backoff, max_interval)
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,122 @@
+# Copyright (c) 2016 GRNET S.A.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Node-wide rate limiting of the API calls sent to a storage system.
+
+All the provider processes of a node share a token bucket per kind of call
+(read or write) that lives in a lock protected file. A caller that finds the
+bucket empty reserves the next token and sleeps until it becomes available,
+so the callers are served in the order they arrived without holding the lock
+while waiting. The number of calls and the time spent waiting are kept in the
+same file and may also be exported in the Prometheus text format.
+"""
+
+import time
+import logging
+
+from extstorage_dataontap.client import api as netapp_api
+from extstorage_dataontap.client import utils
+
+LOG = logging.getLogger(__name__)
+
+# File hosting the state of the buckets
+STATE_FILE = '/var/lib/extstorage-dataontap/ratelimit.json'
+# Lock file protecting the state
+LOCK_FILE = '/var/lib/extstorage-dataontap/ratelimit.lock'
+
+READ = 'read'
+WRITE = 'write'
+
+# Counters kept for each kind of call
+COUNTERS = (
+    ('calls', 'dataontap_api_calls_total',
+     "API calls sent to the storage system"),
+    ('throttled', 'dataontap_api_throttled_calls_total',
+     "API calls delayed by the rate limiter"),
+    ('wait_seconds', 'dataontap_api_rate_limit_wait_seconds_total',
+     "Time spent waiting for the rate limiter"),
+)
+
+
+class RateLimiter(object):
+    """A token bucket rate limiter shared by all the processes of a node"""
+
+    def __init__(self, rates, burst, state_file=STATE_FILE,
+                 lock_file=LOCK_FILE, metrics_file=None):
+        self.rates = rates
+        self.burst = burst
+        self.state_file = state_file
+        self.lock_file = lock_file
+        self.metrics_file = metrics_file
+
+    def _load(self):
+        """Load the state"""
+        return utils.load_state(self.state_file, {})
+
+    def _save(self, state):
+        """Atomically replace the state"""
+        utils.save_state(self.state_file, state)
+
+    def _write_metrics(self, metrics):
+        """Atomically write the counters to the metrics file"""
+        lines = []
+        for key, name, description in COUNTERS:
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s counter" % name)
+            for kind in sorted(metrics):
+                lines.append('%s{kind="%s"} %s' % (name, kind,
+                                                   metrics[kind][key]))
+        utils.write_file(self.metrics_file, "\n".join(lines) + "\n")
+
+    def acquire(self, kind, deadline=None):
+        """Take a token from the bucket of a kind of calls, waiting for it if
+        necessary. Returns the time waited in seconds. Raises
+        NaApiDeadlineError if the token would only become available after
+        the deadline."""
+        rate = self.rates.get(kind)
+        with utils.file_lock(self.lock_file):
+            state = self._load()
+            now = time.time()
+
+            wait = 0.0
+            if rate:
+                bucket = state.setdefault(kind, {'tokens': self.burst,
+                                                 'timestamp': now})
+                tokens = min(self.burst, bucket['tokens'] +
+                             (now - bucket['timestamp']) * rate)
+                # The tokens go negative when callers are waiting for tokens
+                # they have reserved
+                wait = max(0.0, (1 - tokens) / rate)
+                if deadline is not None and now + wait >= deadline:
+                    raise netapp_api.NaApiDeadlineError(
+                        message='Time budget exhausted while rate limited')
+                bucket['tokens'] = tokens - 1
+                bucket['timestamp'] = now
+
+            metrics = state.setdefault('metrics', {}).setdefault(
+                kind, dict.fromkeys([c[0] for c in COUNTERS], 0))
+            metrics['calls'] += 1
+            if wait > 0:
+                metrics['throttled'] += 1
+                metrics['wait_seconds'] += wait
+            self._save(state)
+            if self.metrics_file:
+                self._write_metrics(state['metrics'])
+
+        if wait > 0:
+            LOG.debug("Rate limiting %s call for %.3f seconds", kind, wait)
+            time.sleep(wait)
+        return wait
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
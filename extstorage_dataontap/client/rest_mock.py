@@ -0,0 +1,648 @@
+# Copyright (c) 2016 GRNET S.A.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+In-memory mock of the subset of the ONTAP REST API used by the REST client.
+
+It is meant for exercising the REST client and the provider without a
+storage system. Run it with:
+
+    python -m extstorage_dataontap.client.rest_mock [PORT]
+
+and point HOSTNAME and PORT to it, with TRANSPORT_TYPE set to "http". Any
+credentials are accepted. The mock serves a single vserver ("vs0") with a
+couple of volumes and an igroup ("ganeti"). All the changes happen
+synchronously and are lost when the server stops.
+"""
+
+import sys
+import copy
+import json
+import uuid
+import fnmatch
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import urlsplit, parse_qsl, urlencode
+
+VSERVER = 'vs0'
+NODES = ('node-01', 'node-02')
+
+# Query parameters that are not field filters
+CONTROL_PARAMETERS = ('fields', 'max_records', 'return_records',
+                      'return_timeout', 'allow_delete_while_mapped',
+                      'continue_on_failure', 'offset')
+
+
+def _get_field(record, field):
+    """Returns the value of a dotted field of a record or None"""
+    for key in field.split('.'):
+        if isinstance(record, list):
+            record = [r.get(key) for r in record if isinstance(r, dict)]
+            continue
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record
+
+
+def _matches(value, pattern):
+    """Match a field value against a query pattern. A pattern may hold
+    alternatives separated by '|' and '*' wildcards."""
+    values = value if isinstance(value, list) else [value]
+    for value in values:
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        value = '' if value is None else str(value)
+        for alternative in pattern.split('|'):
+            if fnmatch.fnmatchcase(value, alternative):
+                return True
+    return False
+
+
+def _merge(record, changes):
+    """Recursively merge a PATCH body into a record"""
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(record.get(key), dict):
+            _merge(record[key], value)
+        else:
+            record[key] = copy.deepcopy(value)
+
+
+class Error(Exception):
+    """An error response"""
+
+    def __init__(self, status, message, code='1'):
+        super(Error, self).__init__(message)
+        self.status = status
+        self.message = message
+        self.code = code
+
+
+class MockOntap(object):
+    """The state of the mock storage system"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.volumes = []
+        self.aggregates = []
+        for i, node in enumerate(NODES):
+            aggr = {'uuid': str(uuid.uuid4()), 'name': 'aggr%d' % i,
+                    'home_node': {'name': node}}
+            self.aggregates.append(aggr)
+            self.volumes.append({
+                'uuid': str(uuid.uuid4()), 'name': 'ganeti%d' % i,
+                'state': 'online', 'svm': {'name': VSERVER},
+                'aggregates': [{'uuid': aggr['uuid'], 'name': aggr['name']}],
+                'space': {'size': 1024 ** 4, 'available': 1024 ** 4}})
+        self.nodes = [{'uuid': str(uuid.uuid4()), 'name': node,
+                       'ha': {'partners': [{'name': partner}
+                                           for partner in NODES
+                                           if partner != node]}}
+                      for node in NODES]
+        self.igroups = [{'uuid': str(uuid.uuid4()), 'name': 'ganeti',
+                         'svm': {'name': VSERVER}}]
+        self.luns = []
+        self.lun_maps = []
+        # Copies of the LUNs of the volumes keyed by (volume, snapshot)
+        self.snapshots = {}
+        self.consistency_groups = []
+        self.attributes = {}
+        self.qos_policies = []
+        self.iscsi_services = [{'svm': {'name': VSERVER},
+                                'target': {'name': 'iqn.1992-08.com.netapp:'
+                                           'sn.mock:vs.1'}}]
+        self.ip_interfaces = [
+            {'uuid': str(uuid.uuid4()), 'name': 'iscsi%d' % i,
+             'svm': {'name': VSERVER}, 'ip': {'address': '192.0.2.%d' % i},
+             'enabled': True, 'state': 'up', 'services': ['data_iscsi']}
+            for i in (1, 2)]
+        self.fc_interfaces = [
+            {'uuid': str(uuid.uuid4()), 'name': 'fc%d' % i,
+             'svm': {'name': VSERVER}, 'enabled': True,
+             'wwpn': '20:0%d:00:a0:98:00:00:01' % i}
+            for i in (1, 2)]
+
+    def collection(self, name):
+        """Returns the records of a collection"""
+        return {
+            'storage/luns': self.luns,
+            'storage/volumes': self.volumes,
+            'storage/aggregates': self.aggregates,
+            'application/consistency-groups': self.consistency_groups,
+            'storage/qos/policies': self.qos_policies,
+            'protocols/san/lun-maps': self.lun_maps,
+            'protocols/san/igroups': self.igroups,
+            'protocols/san/iscsi/services': self.iscsi_services,
+            'network/ip/interfaces': self.ip_interfaces,
+            'network/fc/interfaces': self.fc_interfaces,
+            'cluster/nodes': self.nodes,
+            'cluster/jobs': [],
+        }.get(name)
+
+    def _find(self, records, key, value):
+        """Returns the record with a given field value"""
+        for record in records:
+            if _get_field(record, key) == value:
+                return record
+        raise Error(404, "entry doesn't exist", '4')
+
+    def _volume_of(self, path):
+        """Returns the volume record of a LUN path"""
+        return self._find(self.volumes, 'name', path.split('/')[2])
+
+    def _update_usage(self):
+        """Recompute the available space of the volumes"""
+        for volume in self.volumes:
+            used = sum(lun['space']['size'] for lun in self.luns
+                       if lun['location']['volume']['name'] ==
+                       volume['name'] and
+                       lun['space']['guarantee']['requested'])
+            volume['space']['available'] = volume['space']['size'] - used
+
+    def _lun_record(self, path, size, os_type, reserved, comment=''):
+        """Create a LUN record"""
+        if any(lun['name'] == path for lun in self.luns):
+            raise Error(409, 'LUN %s already exists' % path, '5374863')
+        volume = self._volume_of(path)
+        return {
+            'uuid': str(uuid.uuid4()), 'name': path,
+            'svm': {'name': VSERVER},
+            'location': {'volume': {'name': volume['name']},
+                         'qtree': {'name': ''}},
+            'os_type': os_type, 'comment': comment, 'enabled': True,
+            'space': {'size': int(size),
+                      'guarantee': {'requested': bool(reserved)}},
+            'status': {'mapped': False},
+            'qos_policy': {},
+        }
+
+    def create_lun(self, body):
+        """POST /storage/luns"""
+        source = _get_field(body, 'clone.source.name')
+        reserved = _get_field(body, 'space.guarantee.requested')
+        if source:
+            if '/.snapshot/' in source:
+                # /vol/<volume>/.snapshot/<snapshot>/<name>
+                parts = source.split('/')
+                if (parts[2], parts[4]) not in self.snapshots:
+                    raise Error(404, "snapshot doesn't exist", '4')
+                src = self._find(self.snapshots[(parts[2], parts[4])],
+                                 'name', '/vol/%s/%s' % (parts[2], parts[5]))
+            else:
+                src = self._find(self.luns, 'name', source)
+            lun = self._lun_record(body['name'], src['space']['size'],
+                                   src['os_type'],
+                                   src['space']['guarantee']['requested']
+                                   if reserved is None else reserved,
+                                   src['comment'])
+            for (lun_uuid, name), value in list(self.attributes.items()):
+                if lun_uuid == src['uuid']:
+                    self.attributes[(lun['uuid'], name)] = value
+        else:
+            lun = self._lun_record(body['name'], _get_field(body,
+                                                            'space.size'),
+                                   body.get('os_type', 'linux'), reserved)
+        if 'qos_policy' in body:
+            lun['qos_policy'] = dict(body['qos_policy'])
+        self.luns.append(lun)
+        self._update_usage()
+        return [lun]
+
+    def clone_file(self, body):
+        """POST /storage/file/clone"""
+        volume = body['volume']['name']
+        source = body['source_path']
+        if source.startswith('.snapshot/'):
+            _, snapshot, source = source.split('/')
+            if (volume, snapshot) not in self.snapshots:
+                raise Error(404, "snapshot doesn't exist", '4')
+            luns = self.snapshots[(volume, snapshot)]
+        else:
+            luns = self.luns
+        src = self._find(luns, 'name', '/vol/%s/%s' % (volume, source))
+        dest = self._find(self.luns, 'name', '/vol/%s/%s' %
+                          (volume, body['destination_path']))
+        block_size = 4096
+        for block_range in body.get('range', []):
+            src_block, dest_block, count = \
+                [int(n) for n in block_range.split(':')]
+            if (src_block + count) * block_size > src['space']['size'] or \
+                    (dest_block + count) * block_size > \
+                    dest['space']['size']:
+                raise Error(400, 'Block range %s is out of bounds' %
+                            block_range, '13115')
+
+    def create_snapshot(self, volume_uuid, body):
+        """POST /storage/volumes/<uuid>/snapshots"""
+        volume = self._find(self.volumes, 'uuid', volume_uuid)
+        key = (volume['name'], body['name'])
+        if key in self.snapshots:
+            raise Error(409, 'Snapshot %s already exists' % body['name'],
+                        '1638401')
+        self.snapshots[key] = [copy.deepcopy(lun) for lun in self.luns
+                               if lun['location']['volume']['name'] ==
+                               volume['name']]
+
+    def _snapshot_uuid(self, volume, name):
+        """Returns the UUID of a Snapshot copy"""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL,
+                              str('%s/%s' % (volume, name))))
+
+    def volume_snapshots(self, volume_uuid):
+        """GET /storage/volumes/<uuid>/snapshots"""
+        volume = self._find(self.volumes, 'uuid', volume_uuid)
+        return [{'uuid': self._snapshot_uuid(vol, name), 'name': name}
+                for vol, name in sorted(self.snapshots)
+                if vol == volume['name']]
+
+    def delete_snapshot(self, volume_uuid, snapshot_uuid):
+        """DELETE /storage/volumes/<uuid>/snapshots/<uuid>"""
+        volume = self._find(self.volumes, 'uuid', volume_uuid)
+        for key in list(self.snapshots):
+            if key[0] == volume['name'] and \
+                    self._snapshot_uuid(*key) == snapshot_uuid:
+                del self.snapshots[key]
+                return
+        raise Error(404, "entry doesn't exist", '4')
+
+    def create_consistency_group(self, body):
+        """POST /application/consistency-groups"""
+        volumes = []
+        for volume in body['volumes']:
+            volume = self._find(self.volumes, 'name', volume['name'])
+            if any(volume['name'] == v['name'] for cg in
+                   self.consistency_groups for v in cg['volumes']):
+                raise Error(409, 'Volume %s is already in a consistency '
+                            'group' % volume['name'], '53411842')
+            volumes.append({'uuid': volume['uuid'], 'name': volume['name']})
+        cg = {'uuid': str(uuid.uuid4()), 'name': body['name'],
+              'svm': {'name': VSERVER}, 'volumes': volumes}
+        self.consistency_groups.append(cg)
+        return [cg]
+
+    def create_cg_snapshot(self, cg_uuid, body):
+        """POST /application/consistency-groups/<uuid>/snapshots"""
+        cg = self._find(self.consistency_groups, 'uuid', cg_uuid)
+        for volume in cg['volumes']:
+            self.create_snapshot(volume['uuid'], body)
+
+    def modify_lun(self, lun, body):
+        """PATCH /storage/luns"""
+        new_name = body.get('name')
+        if new_name and new_name != lun['name']:
+            if any(other['name'] == new_name for other in self.luns):
+                raise Error(409, 'LUN %s already exists' % new_name,
+                            '5374863')
+            volume = self._volume_of(new_name)
+            for lun_map in self.lun_maps:
+                if lun_map['lun']['name'] == lun['name']:
+                    lun_map['lun']['name'] = new_name
+            lun['location']['volume']['name'] = volume['name']
+        _merge(lun, body)
+        self._update_usage()
+
+    def delete_lun(self, lun, query):
+        """DELETE /storage/luns"""
+        if lun['status']['mapped'] and \
+                query.get('allow_delete_while_mapped') != 'true':
+            raise Error(400, 'LUN %s is mapped' % lun['name'], '5374785')
+        self.luns.remove(lun)
+        self.lun_maps[:] = [m for m in self.lun_maps
+                            if m['lun']['name'] != lun['name']]
+        for key in [k for k in self.attributes if k[0] == lun['uuid']]:
+            del self.attributes[key]
+        self._update_usage()
+
+    def create_lun_map(self, body):
+        """POST /protocols/san/lun-maps"""
+        lun = self._find(self.luns, 'name', _get_field(body, 'lun.name'))
+        igroup = self._find(self.igroups, 'name',
+                            _get_field(body, 'igroup.name'))
+        used = set(m['logical_unit_number'] for m in self.lun_maps
+                   if m['igroup']['name'] == igroup['name'])
+        if any(m['lun']['name'] == lun['name'] for m in self.lun_maps
+               if m['igroup']['name'] == igroup['name']):
+            raise Error(409, 'LUN already mapped to this group', '5374922')
+        lun_id = body.get('logical_unit_number')
+        if lun_id is None:
+            lun_id = min(set(range(len(used) + 1)) - used)
+        elif lun_id in used:
+            raise Error(409, 'LUN ID %d is in use' % lun_id, '5374906')
+        # New maps are reported through every node of the cluster
+        lun_map = {'svm': {'name': VSERVER},
+                   'lun': {'name': lun['name'], 'uuid': lun['uuid']},
+                   'igroup': {'name': igroup['name'],
+                              'uuid': igroup['uuid']},
+                   'logical_unit_number': lun_id,
+                   'reporting_nodes': list(self.nodes)}
+        self.lun_maps.append(lun_map)
+        lun['status']['mapped'] = True
+        return [lun_map]
+
+    def delete_lun_map(self, lun_map):
+        """DELETE /protocols/san/lun-maps"""
+        self.lun_maps.remove(lun_map)
+        lun = self._find(self.luns, 'name', lun_map['lun']['name'])
+        lun['status']['mapped'] = any(m['lun']['name'] == lun['name']
+                                      for m in self.lun_maps)
+
+    def create_qos_policy(self, body):
+        """POST /storage/qos/policies"""
+        if any(p['name'] == body['name'] for p in self.qos_policies):
+            raise Error(409, 'Policy group %s already exists' % body['name'],
+                        '8454147')
+        policy = {'uuid': str(uuid.uuid4()), 'name': body['name'],
+                  'svm': {'name': VSERVER},
+                  'fixed': dict(body.get('fixed', {}))}
+        self.qos_policies.append(policy)
+        return [policy]
+
+    def delete_qos_policy(self, policy):
+        """DELETE /storage/qos/policies"""
+        if any(_get_field(lun, 'qos_policy.name') == policy['name']
+               for lun in self.luns):
+            raise Error(400, 'Policy group %s is in use' % policy['name'],
+                        '8454154')
+        self.qos_policies.remove(policy)
+
+    def attribute(self, lun_uuid, name):
+        """GET /storage/luns/{uuid}/attributes/{name}"""
+        self._find(self.luns, 'uuid', lun_uuid)
+        try:
+            return {'name': name,
+                    'value': self.attributes[(lun_uuid, name)]}
+        except KeyError:
+            raise Error(404, "entry doesn't exist", '4')
+
+    def set_attribute(self, lun_uuid, name, value, create):
+        """POST or PATCH /storage/luns/{uuid}/attributes"""
+        self._find(self.luns, 'uuid', lun_uuid)
+        if create == ((lun_uuid, name) in self.attributes):
+            raise Error(409 if create else 404, 'Attribute %s' % name, '4')
+        self.attributes[(lun_uuid, name)] = value
+
+    def reporting_nodes(self, lun_uuid, igroup_uuid):
+        """Returns the reporting nodes of a LUN map"""
+        for lun_map in self.lun_maps:
+            if lun_map['lun']['uuid'] == lun_uuid and \
+                    lun_map['igroup']['uuid'] == igroup_uuid:
+                return lun_map['reporting_nodes']
+        raise Error(404, "entry doesn't exist", '4')
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the mock REST API"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, fmt,
+                                                              *args)
+
+    def _reply(self, status, result=None):
+        data = json.dumps(result or {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        parts = url.path.strip('/').split('/')
+        if parts[0] != 'api':
+            return self._reply(404, {'error': {'message': 'Not found',
+                                               'code': '4'}})
+        try:
+            body = self._body() if method in ('POST', 'PATCH') else {}
+            with self.server.ontap.lock:
+                status, result = self._handle(method, parts[1:], query, body)
+        except Error as e:
+            status, result = e.status, {'error': {'message': e.message,
+                                                  'code': e.code}}
+        self._reply(status, result)
+
+    def _select(self, records, query):
+        """Returns the records matching the filters of a query"""
+        filters = [(k, v) for k, v in query.items()
+                   if k not in CONTROL_PARAMETERS]
+        return [r for r in records
+                if all(_matches(_get_field(r, k), v) for k, v in filters)]
+
+    def _page(self, path, records, query):
+        """Returns a page of a collection"""
+        offset = int(query.get('offset', 0))
+        max_records = int(query.get('max_records', 20))
+        page = records[offset:offset + max_records]
+        result = {'records': page, 'num_records': len(page)}
+        if offset + max_records < len(records):
+            next_query = dict(query, offset=offset + max_records)
+            result['_links'] = {'next': {'href': '/api/%s?%s' % (
+                path, urlencode(sorted(next_query.items())))}}
+        return result
+
+    def _handle(self, method, parts, query, body):
+        ontap = self.server.ontap
+        path = '/'.join(parts)
+
+        if path == 'cluster':
+            return 200, {'name': 'mock', 'version': {
+                'full': 'NetApp Release 9.11.1', 'generation': 9,
+                'major': 11, 'minor': 1}}
+
+        # LUN attributes
+        if len(parts) >= 4 and parts[:2] == ['storage', 'luns'] and \
+                parts[3] == 'attributes':
+            lun_uuid = parts[2]
+            if len(parts) == 5:
+                if method == 'GET':
+                    return 200, ontap.attribute(lun_uuid, parts[4])
+                if method == 'PATCH':
+                    ontap.set_attribute(lun_uuid, parts[4], body['value'],
+                                        False)
+                    return 200, {}
+                if method == 'DELETE':
+                    ontap.attribute(lun_uuid, parts[4])
+                    del ontap.attributes[(lun_uuid, parts[4])]
+                    return 200, {}
+            elif method == 'POST':
+                ontap.set_attribute(lun_uuid, body['name'], body['value'],
+                                    True)
+                return 201, {}
+
+        # Reporting nodes of LUN maps
+        if len(parts) >= 6 and parts[:3] == ['protocols', 'san', 'lun-maps'] \
+                and parts[5] == 'reporting-nodes':
+            nodes = ontap.reporting_nodes(parts[3], parts[4])
+            if method == 'GET':
+                return 200, self._page(path, self._select(nodes, query),
+                                       query)
+            if method == 'POST':
+                node = ontap._find(ontap.nodes, 'name', body['name'])
+                for name in [node['name']] + \
+                        [p['name'] for p in node['ha']['partners']]:
+                    if not any(n['name'] == name for n in nodes):
+                        nodes.append(ontap._find(ontap.nodes, 'name', name))
+                return 201, {}
+            if method == 'DELETE' and len(parts) == 7:
+                node = ontap._find(nodes, 'uuid', parts[6])
+                partners = [p['name'] for p in node['ha']['partners']]
+                nodes[:] = [n for n in nodes if n['name'] != node['name'] and
+                            n['name'] not in partners]
+                return 200, {}
+
+        # Snapshot copies of volumes
+        if len(parts) == 4 and parts[:2] == ['storage', 'volumes'] and \
+                parts[3] == 'snapshots':
+            if method == 'POST':
+                ontap.create_snapshot(parts[2], body)
+                return 201, {}
+            if method == 'GET':
+                return 200, self._page(path, self._select(
+                    ontap.volume_snapshots(parts[2]), query), query)
+        if len(parts) == 5 and parts[:2] == ['storage', 'volumes'] and \
+                parts[3] == 'snapshots' and method == 'DELETE':
+            ontap.delete_snapshot(parts[2], parts[4])
+            return 200, {}
+
+        # Sub-file clones
+        if path == 'storage/file/clone' and method == 'POST':
+            ontap.clone_file(body)
+            return 201, {}
+
+        # Snapshot copies of consistency groups
+        if len(parts) == 4 and parts[:2] == ['application',
+                                             'consistency-groups'] and \
+                parts[3] == 'snapshots' and method == 'POST':
+            ontap.create_cg_snapshot(parts[2], body)
+            return 201, {}
+
+        records = ontap.collection(path)
+        if records is None and len(parts) > 1:
+            # A single record identified by its UUID
+            records = ontap.collection('/'.join(parts[:-1]))
+            if records is not None:
+                record = ontap._find(records, 'uuid', parts[-1])
+                if method == 'GET':
+                    return 200, record
+                if method == 'PATCH' and path.startswith('storage/luns'):
+                    ontap.modify_lun(record, body)
+                    return 200, {}
+                if method == 'DELETE' and \
+                        path.startswith('application/consistency-groups'):
+                    records.remove(record)
+                    return 200, {}
+        if records is None:
+            raise Error(404, 'API not found', '3')
+
+        if method == 'GET':
+            return 200, self._page(path, self._select(records, query), query)
+
+        if method == 'POST':
+            if path == 'storage/luns':
+                created = ontap.create_lun(body)
+            elif path == 'protocols/san/lun-maps':
+                created = ontap.create_lun_map(body)
+            elif path == 'storage/qos/policies':
+                created = ontap.create_qos_policy(body)
+            elif path == 'application/consistency-groups':
+                created = ontap.create_consistency_group(body)
+            else:
+                raise Error(405, 'Method not allowed', '6')
+            result = {'num_records': len(created)}
+            if query.get('return_records') == 'true':
+                result['records'] = created
+            return 201, result
+
+        # Query-based PATCH and DELETE
+        selected = self._select(records, query)
+        errors = []
+        for record in selected:
+            try:
+                if method == 'PATCH':
+                    if path == 'storage/luns':
+                        ontap.modify_lun(record, body)
+                    else:
+                        _merge(record, body)
+                elif path == 'storage/luns':
+                    ontap.delete_lun(record, query)
+                elif path == 'protocols/san/lun-maps':
+                    ontap.delete_lun_map(record)
+                elif path == 'storage/qos/policies':
+                    ontap.delete_qos_policy(record)
+                else:
+                    raise Error(405, 'Method not allowed', '6')
+            except Error as e:
+                if query.get('continue_on_failure') != 'true':
+                    raise
+                errors.append(e)
+        return 200, {'num_records': len(selected) - len(errors)}
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+class MockServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A threaded HTTP server holding a MockOntap"""
+
+    daemon_threads = True
+
+    def __init__(self, address, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.ontap = MockOntap()
+        self.verbose = verbose
+
+
+def start(port=0):
+    """Start a mock server in a background thread. Returns the server; its
+    port is server.server_address[1]."""
+    server = MockServer(('127.0.0.1', port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    server = MockServer(('127.0.0.1', port), verbose=True)
+    print("Serving the mock ONTAP REST API on port %d" % port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
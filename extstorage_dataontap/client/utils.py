@@ -15,12 +15,17 @@
 #    under the License.
 
 
+import os
+import json
+import fcntl
 import logging
 import six
 import socket
 import sys
+import threading
 import traceback
 import datetime
+import contextlib
 
 import iso8601
 
@@ -157,4 +162,45 @@ class save_and_reraise_exception(object):
         if self.reraise:
             six.reraise(self.type_, self.value, self.tb)
 
+
+@contextlib.contextmanager
+def file_lock(lock_file):
+    """Hold an exclusive lock on a lock file, waiting for it if necessary"""
+    with open(lock_file, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def write_file(path, text):
+    """Atomically replace a file. The temporary file is unique per thread, so
+    that concurrent writers never mix their contents."""
+    tmp = "%s.%d.%d" % (path, os.getpid(), threading.current_thread().ident)
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, path)
+
+
+def load_state(path, default=None):
+    """Load a JSON state file. Returns default if the file is missing or
+    corrupted."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return default
+
+
+def save_state(path, state):
+    """Atomically replace a JSON state file"""
+    write_file(path, json.dumps(state))
+
+
+def modify_state(path, lock_file, func, default=None):
+    """Load a JSON state file under the lock and pass it to func, which
+    modifies it in place. The file is saved if func returns True."""
+    with file_lock(lock_file):
+        state = load_state(path, default)
+        if func(state):
+            save_state(path, state)
+
 # vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
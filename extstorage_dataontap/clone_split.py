@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Background splitting of LUN clones.
+
+The LUNs created by the snapshot action, by cloning the origin LUN or by
+snapshotting instances share their blocks with their parents for as long as
+they live in the same volume. The provider records the parent and the
+creation time of every clone it creates in an attribute of the clone itself,
+so that the clones are known to every node. The clone lineage is read back
+out of the LUNs to find the clones that are older than CLONE_SPLIT_MIN_AGE or
+deeper than CLONE_SPLIT_MAX_DEPTH in a chain of clones.
+
+Data ONTAP cannot split a FlexClone LUN in place. A LUN moved to a different
+volume gets its own copy of the blocks though, so the clones are split with
+non-disruptive LUN moves to the eligible volume with the most free space. The
+moves only start within CLONE_SPLIT_WINDOW, at most
+CLONE_SPLIT_MAX_PER_AGGREGATE at a time on each aggregate, and are tracked
+with the asynchronous poller. Moves still running when the window closes are
+left to the storage system to complete. They are flagged in the lineage of
+the clones and checked again on the next run.
+"""
+
+import time
+import json
+import fcntl
+import logging
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap import exception
+from extstorage_dataontap import perf
+from extstorage_dataontap.backends import iter_backends
+from extstorage_dataontap.client import api as netapp_api
+from extstorage_dataontap.client import poller
+from extstorage_dataontap.rebalance import add_reporting_nodes
+
+LOG = logging.getLogger(__name__)
+
+# LUN attribute hosting the lineage of a clone
+LINEAGE_ATTRIBUTE = 'ganeti-clone-lineage'
+# Lock file that makes sure only one clone splitter runs at a time
+LOCK_FILE = '/var/lib/extstorage-dataontap/clone-split.lock'
+
+# The lun-info attributes fetched when looking for clones
+ATTRIBUTES = ('path', 'size')
+
+# Time to wait between two checks of the running splits in seconds
+POLL_INTERVAL = 10
+
+
+def _volume(path):
+    """Returns the name of the volume hosting a LUN"""
+    return path.split('/')[2]
+
+
+def in_window(window, now=None):
+    """Check if a time falls in a HH:MM-HH:MM window of the local time. The
+    window may span midnight. A window of None is always open."""
+    if window is None:
+        return True
+    start, end = [int(t[:2]) * 60 + int(t[3:]) for t in window.split('-')]
+    now = time.localtime(now)
+    minute = now.tm_hour * 60 + now.tm_min
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+class CloneLineage(object):
+    """Records the parent and the creation time of the LUN clones in an
+    attribute of the clones"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def get(self, path):
+        """Returns the lineage of a LUN or None if it is not a clone"""
+        client = self.provider.client
+        LOG.debug("Calling get_lun_attribute(%s, %s)", path,
+                  LINEAGE_ATTRIBUTE)
+        value = client.get_lun_attribute(path, LINEAGE_ATTRIBUTE)
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            LOG.warning("Ignoring invalid lineage of LUN %s: %s", path, value)
+            return None
+
+    def set(self, path, lineage):
+        """Store the lineage of a clone"""
+        client = self.provider.client
+        LOG.debug("Calling set_lun_attribute(%s, %s, %r)", path,
+                  LINEAGE_ATTRIBUTE, lineage)
+        client.set_lun_attribute(path, LINEAGE_ATTRIBUTE,
+                                 json.dumps(lineage, sort_keys=True))
+
+    def add(self, path, parent):
+        """Record that a LUN has just been cloned out of another one"""
+        LOG.debug("Recording LUN %s as a clone of %s", path, parent)
+        self.set(path, {'parent': parent, 'created': int(time.time())})
+
+    def split(self, path):
+        """Record that a clone no longer shares its blocks with its parent.
+        The lineage is kept, so that the LUN is still known to be a clone,
+        but its own clones now start a new chain."""
+        lineage = self.get(path)
+        if lineage is None:
+            return
+        LOG.debug("Recording LUN clone %s as split", path)
+        lineage.pop('moving', None)
+        lineage['split'] = True
+        self.set(path, lineage)
+
+    @staticmethod
+    def depth(lineage, name):
+        """Returns the number of clones in the chain ending at a LUN"""
+        depth = 0
+        seen = set()
+        while name in lineage and name not in seen:
+            seen.add(name)
+            depth += 1
+            name = lineage[name]['parent']
+        return depth
+
+
+class CloneSplitter(object):
+    """Splits the old and deeply chained LUN clones of a provider"""
+
+    def __init__(self, provider, max_splits=None, max_per_aggregate=None):
+        if configuration.STORAGE_FAMILY != 'ontap_cluster':
+            raise exception.InvalidInput(
+                reason="LUN moves across volumes are only supported by "
+                       "clustered Data ONTAP")
+        self.provider = provider
+        self.max_splits = max_splits or configuration.CLONE_SPLIT_MAX_SPLITS
+        self.max_per_aggregate = max_per_aggregate or \
+            configuration.CLONE_SPLIT_MAX_PER_AGGREGATE
+        self.min_age = configuration.CLONE_SPLIT_MIN_AGE
+        self.max_depth = configuration.CLONE_SPLIT_MAX_DEPTH
+        self.max_iops = configuration.CLONE_SPLIT_MAX_VOLUME_IOPS
+        self.window = configuration.CLONE_SPLIT_WINDOW
+        self.timeout = configuration.REBALANCE_MOVE_TIMEOUT
+
+    def _ignored(self, name):
+        """Check if a LUN is managed by the provider without backing a disk"""
+        return name.startswith(configuration.TRASH_PREFIX) or \
+            name.startswith(configuration.WARM_POOL_PREFIX)
+
+    def discover(self):
+        """Returns the (path, size, depth, age) tuples of the clones of the
+        selected backend that should be split, oldest first, and the paths
+        of the clones of the backend that are being moved. The lineage is
+        read out of the LUNs, which takes one call per LUN."""
+        now = time.time()
+        lineage = {}
+        luns = {}
+        LOG.debug("Calling iter_lun_pages(%s)", ", ".join(ATTRIBUTES))
+        for page in self.provider.client.iter_lun_pages(ATTRIBUTES):
+            for lun in page:
+                path = lun.get_child_content('path')
+                name = path.rpartition('/')[2]
+                if self._ignored(name):
+                    continue
+                clone = self.provider.clone_lineage.get(path)
+                if clone is None or clone.get('split'):
+                    continue
+                lineage[name] = clone
+                luns[name] = (path, int(lun.get_child_content('size')))
+
+        candidates = []
+        moving = []
+        for name, (path, size) in luns.items():
+            # A clone that is not at the destination of its move has not been
+            # moved at all and is split again
+            if lineage[name].get('moving') == path:
+                moving.append(path)
+                continue
+            depth = CloneLineage.depth(lineage, name)
+            age = now - lineage[name]['created']
+            if (self.min_age and age >= self.min_age) or \
+                    (self.max_depth and depth > self.max_depth):
+                candidates.append((path, size, depth, age))
+        # Parents are older than their clones, so the chains are cut as close
+        # to their root as possible
+        candidates.sort(key=lambda c: -c[3])
+        return candidates, sorted(moving)
+
+    def volume_load(self, interval):
+        """Measure the IOPS of the volumes over interval seconds"""
+        collector = perf.LunPerfCollector(self.provider)
+        collector.collect()
+        time.sleep(interval)
+        load = {}
+        for stat in collector.collect():
+            volume = _volume(stat['path'])
+            load[volume] = load.get(volume, 0.0) + \
+                perf.SORT_KEYS['iops'](stat)
+        return load
+
+    def _destination(self, path, size, available, aggregates, busy):
+        """Returns the eligible volume with the most free space a clone can
+        be moved to without exceeding the concurrent splits of the aggregates
+        involved, or None"""
+        source = aggregates.get(_volume(path))
+        if busy.get(source, 0) >= self.max_per_aggregate:
+            return None
+        volumes = [v for v in available if v != _volume(path) and
+                   available[v] >= size and
+                   busy.get(aggregates.get(v), 0) < self.max_per_aggregate]
+        if not volumes:
+            return None
+        return max(volumes, key=available.get)
+
+    def _start(self, path, volume):
+        """Start moving a clone to a volume. The clone is flagged as moving
+        in its lineage first, so that a move that outlives this run is
+        checked again by the next one. Returns the new path of the clone or
+        None if the move could not be started."""
+        client = self.provider.client
+        lineage = self.provider.clone_lineage
+        new_path = '/vol/%s/%s' % (volume, path.rpartition('/')[2])
+        LOG.info("Splitting LUN clone %s by moving it to %s", path, new_path)
+        try:
+            clone = lineage.get(path)
+            if clone is None:
+                LOG.warning("LUN %s is no longer a clone", path)
+                return None
+            clone['moving'] = new_path
+            lineage.set(path, clone)
+            try:
+                if configuration.SELECTIVE_LUN_MAP:
+                    add_reporting_nodes(client, path, volume)
+                client.start_lun_move(path, new_path)
+            except netapp_api.NaApiError:
+                del clone['moving']
+                lineage.set(path, clone)
+                raise
+        except netapp_api.NaApiError as e:
+            LOG.error("Unable to move LUN %s: %s", path, e)
+            return None
+        return new_path
+
+    def _finish(self, new_path):
+        """Update the instance index and the clone lineage after a clone has
+        been moved to new_path"""
+        name = new_path.rpartition('/')[2]
+        self.provider.instance_index.move(name, new_path)
+        try:
+            self.provider.clone_lineage.split(new_path)
+        except netapp_api.NaApiError as e:
+            # The next run finds the move done and tries again
+            LOG.warning("Unable to update the lineage of LUN %s: %s",
+                        new_path, e)
+
+    def _abort(self, new_path):
+        """Clear the moving flag of a clone whose move failed, so that the
+        split is retried on the next run"""
+        lineage = self.provider.clone_lineage
+        try:
+            clone = lineage.get(new_path)
+            if clone is not None:
+                clone.pop('moving', None)
+                lineage.set(new_path, clone)
+        except netapp_api.NaApiError as e:
+            # A clone left at its old path ignores the stale flag anyway
+            LOG.warning("Unable to clear the moving flag of LUN %s: %s",
+                        new_path, e)
+
+    def split_backend(self, candidates, moving=(), dry_run=False):
+        """Split the clones of the selected backend, starting new splits as
+        the running ones finish. The moves left running by a previous run are
+        tracked along with the new ones. Returns the number of clones split
+        and the number of splits that failed."""
+        provider = self.provider
+        client = provider.client
+
+        if dry_run:
+            # Don't hit the storage system for a fresh capacity snapshot
+            snapshot = provider.placement.cached()
+            if snapshot is None:
+                LOG.info("No cached capacity snapshot. Destination volumes "
+                         "are unknown")
+            available = dict((name, volume['available']) for name, volume
+                             in (snapshot or {}).get('volumes', {}).items())
+            aggregates = client.get_flexvol_aggregates()
+            for new_path in moving:
+                LOG.info("LUN clone %s is being split", new_path)
+            for path, size, depth, age in candidates:
+                LOG.info("Planned split of LUN clone %s (depth %d, %.1f hours "
+                         "old) to volume %s", path, depth, age / 3600,
+                         self._destination(path, size, available, aggregates,
+                                           {}))
+            return 0, 0
+
+        volumes = provider.placement.refresh()['volumes']
+        available = dict((name, volume['available']) for name, volume
+                         in volumes.items())
+        aggregates = client.get_flexvol_aggregates()
+        pending = list(candidates)
+
+        split_poller = poller.AsyncPoller(client._get_lun_move_statuses,
+                                          timeout=self.timeout)
+        deadline = time.time() + self.timeout if self.timeout else None
+        running = {}
+        busy = {}
+        # Only the destination of the moves left running is known
+        for new_path in moving:
+            aggregate = aggregates.get(_volume(new_path))
+            busy[aggregate] = busy.get(aggregate, 0) + 1
+            running[new_path] = set([aggregate])
+            split_poller.add(new_path)
+        split = failed = 0
+        while True:
+            # Stop as soon as the window closes, even with moves running, so
+            # that the lock is not held till the moves time out
+            if not in_window(self.window) or \
+                    (deadline is not None and time.time() >= deadline):
+                break
+
+            for candidate in list(pending):
+                path, size = candidate[:2]
+                volume = self._destination(path, size, available, aggregates,
+                                           busy)
+                if volume is None:
+                    continue
+                pending.remove(candidate)
+                new_path = self._start(path, volume)
+                if new_path is None:
+                    failed += 1
+                    continue
+                involved = set((aggregates.get(_volume(path)),
+                                aggregates.get(volume)))
+                for aggregate in involved:
+                    busy[aggregate] = busy.get(aggregate, 0) + 1
+                available[volume] -= size
+                running[new_path] = involved
+                split_poller.add(new_path)
+
+            if not running:
+                break
+
+            sleep = POLL_INTERVAL
+            if deadline is not None:
+                sleep = max(min(sleep, deadline - time.time()), 0)
+            time.sleep(sleep)
+            for new_path, (state, info) in sorted(split_poller.poll().items()):
+                for aggregate in running.pop(new_path):
+                    busy[aggregate] -= 1
+                if state == poller.COMPLETED:
+                    LOG.info("LUN clone %s split successfully", new_path)
+                    self._finish(new_path)
+                    split += 1
+                else:
+                    LOG.error("Split of LUN clone %s did not complete (%s): "
+                              "%s", new_path, state, info)
+                    # A move that timed out may still complete
+                    if state == poller.FAILED:
+                        self._abort(new_path)
+                    failed += 1
+
+        # The filer completes the moves on its own. They remain flagged in
+        # the lineage of the clones until the next run finds them done.
+        for new_path in sorted(running):
+            LOG.warning("Leaving the split of LUN clone %s running", new_path)
+        for path, _, _, _ in pending:
+            LOG.info("LUN clone %s was not split in this run", path)
+        if split or running:
+            # The free space of the volumes has changed
+            provider.placement.refresh()
+        return split, failed
+
+    def split(self, interval, dry_run=False):
+        """Split the clones of all the backends that are due"""
+        with open(LOCK_FILE, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                LOG.info("Clone splitter is already running")
+                return 0
+
+            if not dry_run and not in_window(self.window):
+                LOG.info("Outside of the clone split window (%s)",
+                         self.window)
+                return 0
+
+            provider = self.provider
+            total = errors = 0
+            for backend in iter_backends(provider):
+                candidates, moving = self.discover()
+                if candidates and self.max_iops:
+                    load = self.volume_load(interval)
+                    candidates = [c for c in candidates if
+                                  load.get(_volume(c[0]), 0.0) <=
+                                  self.max_iops]
+                LOG.info("Found %d LUN clone(s) to split and %d being split "
+                         "on backend %s", len(candidates), len(moving),
+                         backend['NAME'])
+                if not candidates and not moving:
+                    continue
+                split, failed = self.split_backend(
+                    candidates[:self.max_splits - total], moving, dry_run)
+                total += split
+                errors += failed
+                if total >= self.max_splits:
+                    break
+
+            LOG.info("Split %d LUN clone(s)", total)
+        return 1 if errors else 0
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -30,8 +30,8 @@ else:
     from extstorage_dataontap.provider_7mode import DataOnTapProvider
 
 
-def main(action):
-    """Entry point"""
+def setup_logging(action):
+    """Setup the log handlers for an action"""
 
     # This is logged directly by the client
     if configuration.LOG:
@@ -51,9 +51,16 @@ def main(action):
         sh.setFormatter(formatter)
         LOG.addHandler(sh)
 
+
+def main(action):
+    """Entry point"""
+
+    setup_logging(action)
+
     LOG.info("Running Data ONTAP ExtStorage Provider v%s", version)
     try:
-        provider = DataOnTapProvider()
+        provider = DataOnTapProvider(
+            time_budget=configuration.ACTION_TIME_BUDGET)
         return getattr(provider, action)()
     except Exception:
         LOG.exception("action: %s failed", action)
@@ -65,7 +72,7 @@ actions = ['create', 'attach', 'detach', 'remove', 'grow', 'setinfo', 'verify',
            'snapshot', 'open', 'close']
 
 # Hooks that need to be added to Ganeti
-hooks = ['pre_move', 'post_remove']
+hooks = ['pre_move', 'post_remove', 'snapshot_instance']
 
 for action in actions + hooks:
     setattr(sys.modules[__name__], action, partial(main, action=action))
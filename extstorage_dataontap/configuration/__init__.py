@@ -33,6 +33,17 @@ from extstorage_dataontap.configuration.default import *  # noqa
 LOG = logging.getLogger(__name__)
 
 CONFIG = '/etc/ganeti/extstorage-dataontap.conf'
+QOS_OPTIONS = ('QOS_MAX_IOPS', 'QOS_MAX_MBPS', 'QOS_MIN_IOPS', 'QOS_MIN_MBPS')
+# Block device attributes found under /sys/block/<dev>/queue and
+# /sys/block/<dev>/device respectively
+TUNING_QUEUE_ATTRIBUTES = ('scheduler', 'nr_requests', 'read_ahead_kb',
+                           'max_sectors_kb')
+TUNING_DEVICE_ATTRIBUTES = ('queue_depth',)
+# Options a backend may override
+BACKEND_OPTIONS = ('HOSTNAME', 'PORT', 'TRANSPORT_TYPE', 'VERIFY_CERT',
+                   'LOGIN', 'PASSWORD', 'CLUSTER_MODE_VSERVER',
+                   'SEVEN_MODE_VFILER', 'API_TYPE', 'IGROUP', 'POOL',
+                   'POOL_NAME_SEARCH_PATTERN')
 OSTYPES = ('solaris', 'windows', 'hpux', 'aix', 'linux', 'netware', 'vmware',
            'windows_gpt', 'windows_2008', 'xen', 'hyper_v', 'solaris_efi',
            'openvms')
@@ -49,9 +60,13 @@ if os.path.exists(CONFIG):
         raise exception.InvalidConfigurationFile(filename=CONFIG,
                                                  reason=str(e))
 
+# The options that have been overwritten by ExtStorage parameters
+PARAMETERS = []
+
 for var in [i for i in os.environ if i.startswith('EXTP_')]:
     value = os.environ[var] if len(os.environ[var]) else None
     setattr(sys.modules[__name__], var[5:], value)
+    PARAMETERS.append(var[5:])
 
 
 def _check_val(key, check):
@@ -97,6 +112,34 @@ def _is_none_or_in(val_set):
     return partial(inner, val_set=val_set)
 
 
+def _is_none_or_positive_int(val):
+    """Check if a value is None or a positive integer"""
+    if val is None:
+        return
+    try:
+        if int(val) <= 0:
+            raise ValueError("Not a positive integer (%s)" % val)
+    except (TypeError, ValueError):
+        raise ValueError("Not a positive integer (%s)" % val)
+
+
+def _is_none_or_positive_float(val):
+    """Check if a value is None or a positive number"""
+    if val is None:
+        return
+    _is_float(val)
+    if val <= 0:
+        raise ValueError("Not a positive number (%s)" % val)
+
+
+def _is_unset(reason):
+    """Check if a value is not set"""
+    def inner(val, reason):
+        if val is not None:
+            raise ValueError(reason)
+    return partial(inner, reason=reason)
+
+
 def _is_nonempty_string(val):
     """Check if value is a non-empty string"""
     if not (isinstance(val, str) or isinstance(val, unicode)):
@@ -155,6 +198,18 @@ def _is_list(val):
         raise ValueError("Not a list or tuple (%s)" % type(val))
 
 
+def _is_hostnames(val):
+    """Check if the value is a hostname or a non-empty list of hostnames"""
+    if isinstance(val, basestring):
+        _is_nonempty_string(val)
+        return
+    _is_list(val)
+    if not val:
+        raise ValueError("Empty list of hostnames")
+    for hostname in val:
+        _is_nonempty_string(hostname)
+
+
 def _is_list_of_string_lists(val):
     """Check if the value is a list of string lists"""
     _is_list(val)
@@ -172,6 +227,65 @@ def _is_list_of_string_lists(val):
                 raise ValueError("Error in item %r: %s" % (i, e.message))
 
 
+def _is_size_map(val):
+    """Check if the value is a dictionary mapping sizes to counts"""
+    if not isinstance(val, dict):
+        raise ValueError("Not a dictionary (%s)" % type(val))
+    for size, count in val.items():
+        if not isinstance(size, (int, long)) or size <= 0:
+            raise ValueError("Invalid size: %r" % (size,))
+        if not isinstance(count, (int, long)) or count < 0:
+            raise ValueError("Invalid count for size %r: %r" % (size, count))
+
+
+def _is_tuning_profiles(val):
+    """Check if the value is a dictionary of tuning profiles"""
+    if not isinstance(val, dict):
+        raise ValueError("Not a dictionary (%s)" % type(val))
+    for name, profile in val.items():
+        if not isinstance(profile, dict):
+            raise ValueError("Profile %s is not a dictionary" % name)
+        for attr in profile:
+            if attr not in TUNING_QUEUE_ATTRIBUTES + \
+                    TUNING_DEVICE_ATTRIBUTES:
+                raise ValueError("Unknown attribute in profile %s: %s" %
+                                 (name, attr))
+
+
+def _is_node_settings(val):
+    """Check if the value is a dictionary of iSCSI node record settings"""
+    if not isinstance(val, dict):
+        raise ValueError("Not a dictionary (%s)" % type(val))
+    for key in val:
+        if not isinstance(key, basestring) or not key.startswith('node.'):
+            raise ValueError("Not an iSCSI node record key: %r" % (key,))
+
+
+def _is_backends(val):
+    """Check if the value is a list of backends"""
+    _is_list(val)
+    names = set()
+    for backend in val:
+        if not isinstance(backend, dict):
+            raise ValueError("Backend %r is not a dictionary" % (backend,))
+        name = backend.get('NAME')
+        try:
+            _is_nonempty_string(name)
+        except ValueError as e:
+            raise ValueError("Invalid backend name %r: %s" %
+                             (name, e.message))
+        if name in names:
+            raise ValueError("Duplicate backend name: %s" % name)
+        names.add(name)
+        for key in backend:
+            if key != 'NAME' and key not in BACKEND_OPTIONS:
+                raise ValueError("Unknown option in backend %s: %s" %
+                                 (name, key))
+        if backend.get('API_TYPE', 'zapi') not in ('zapi', 'rest'):
+            raise ValueError("Invalid API_TYPE of backend %s: %s" %
+                             (name, backend['API_TYPE']))
+
+
 # Validate the configuration
 if STORAGE_FAMILY == 'ontap_cluster':
     # Not usable in cluster mode
@@ -180,11 +294,29 @@ if STORAGE_FAMILY == 'ontap_cluster':
 elif STORAGE_FAMILY == 'ontap_7mode':
     # Not usable in cluster mode
     del CLUSTER_MODE_VSERVER  # noqa
+    for _option in QOS_OPTIONS:
+        _check_val(_option, _is_unset("QoS is not supported in 7-mode"))
 _check_val('STORAGE_FAMILY', _is_in(('ontap_cluster', 'ontap_7mode')))
 _check_val('STORAGE_PROTOCOL', _is_in(('iscsi', 'fc')))
+_check_val('HOSTNAME', _is_hostnames)
 _check_val('PORT', _is_none_or_in(xrange(2**16)))
 _check_val('TRANSPORT_TYPE', _is_in(('http', 'https')))
 _check_val('VERIFY_CERT', _is_bool)
+_check_val('API_TYPE', _is_in(('zapi', 'rest')))
+_check_val('API_CALL_TIMEOUT', _is_none_or_positive_int)
+_check_val('ACTION_TIME_BUDGET', _is_none_or_positive_int)
+_check_val('API_RETRIES', _is_in(xrange(0, 101)))
+_check_val('API_HEDGE_PERCENTILE', _is_none_or_in(xrange(1, 101)))
+_check_val('MANAGEMENT_ADDRESS_CACHE_TTL', _is_float)
+_check_val('API_READ_RATE_LIMIT', _is_none_or_positive_float)
+_check_val('API_WRITE_RATE_LIMIT', _is_none_or_positive_float)
+_check_val('API_RATE_LIMIT_BURST', _is_in(xrange(1, 1001)))
+if API_RATE_LIMIT_METRICS_FILE is not None:
+    _check_val('API_RATE_LIMIT_METRICS_FILE', _is_nonempty_string)
+if STORAGE_FAMILY == 'ontap_7mode' and API_TYPE != 'zapi':
+    raise exception.InvalidConfigurationValue(
+        option='API_TYPE', value=API_TYPE,
+        reason="Data ONTAP operating in 7-mode only supports zapi")
 _check_val('LOGIN', _is_nonempty_string)
 _check_val('PASSWORD', _is_nonempty_string)
 _check_val('LUN_SPACE_RESERVATION', _is_bool)
@@ -192,6 +324,59 @@ _check_val('POOL_NAME_SEARCH_PATTERN', _is_regexp)
 _check_val('LUN_OSTYPE', _is_in((OSTYPES)))
 _check_val('POOL', _match(POOL_NAME_SEARCH_PATTERN))
 _check_val('LUN_DEVICE_PATH_FORMAT', _is_format_string)
+_check_val('POOL_PLACEMENT', _is_bool)
+_check_val('PLACEMENT_CACHE_TTL', _is_float)
+_check_val('PLACEMENT_LATENCY_WEIGHT', _is_float)
+for _option in QOS_OPTIONS:
+    _check_val(_option, _is_none_or_positive_int)
+_check_val('QOS_LIFECYCLE', _is_bool)
+if STORAGE_FAMILY == 'ontap_7mode' and QOS_LIFECYCLE:
+    raise exception.InvalidConfigurationValue(
+        option='QOS_LIFECYCLE', value=QOS_LIFECYCLE,
+        reason="QoS is not supported in 7-mode")
+_check_val('SELECTIVE_LUN_MAP', _is_bool)
+if STORAGE_FAMILY == 'ontap_7mode' and SELECTIVE_LUN_MAP:
+    raise exception.InvalidConfigurationValue(
+        option='SELECTIVE_LUN_MAP', value=SELECTIVE_LUN_MAP,
+        reason="Selective LUN map is not supported in 7-mode")
+_check_val('QOS_IDLE_POLICY_GROUP', _is_nonempty_string)
+_check_val('QOS_IDLE_MAX_THROUGHPUT', _is_nonempty_string)
+_check_val('WARM_POOL', _is_size_map)
+_check_val('WARM_POOL_PREFIX', _is_nonempty_string)
+_check_val('DEFERRED_REMOVE', _is_bool)
+_check_val('TRASH_PREFIX', _is_nonempty_string)
+_check_val('VERIFY_RECONCILE', _is_bool)
+_check_val('GANETI_CONFIG_FILE', _is_nonempty_string)
+_check_val('GANETI_PROVIDER_NAME', _is_nonempty_string)
+_check_val('REAPER_BATCH_SIZE', _is_in(xrange(1, 1001)))
+_check_val('REAPER_BATCH_INTERVAL', _is_float)
+_check_val('REBALANCE_THRESHOLD', _is_float)
+_check_val('REBALANCE_MAX_MOVES', _is_in(xrange(1, 1001)))
+_check_val('REBALANCE_MAX_CONCURRENT', _is_in(xrange(1, 101)))
+_check_val('REBALANCE_MOVE_TIMEOUT', _is_none_or_positive_int)
+_check_val('CLONE_SPLIT_MIN_AGE', _is_none_or_positive_int)
+_check_val('CLONE_SPLIT_MAX_DEPTH', _is_none_or_positive_int)
+if CLONE_SPLIT_WINDOW is not None:
+    _check_val('CLONE_SPLIT_WINDOW',
+               _match(r'^([01]\d|2[0-3]):[0-5]\d-([01]\d|2[0-3]):[0-5]\d$'))
+_check_val('CLONE_SPLIT_MAX_VOLUME_IOPS', _is_none_or_positive_float)
+_check_val('CLONE_SPLIT_MAX_PER_AGGREGATE', _is_in(xrange(1, 101)))
+_check_val('CLONE_SPLIT_MAX_SPLITS', _is_in(xrange(1, 1001)))
+_check_val('TUNING_PROFILES', _is_tuning_profiles)
+_check_val('TUNING_PROFILE', _is_none_or_in(TUNING_PROFILES.keys()))
+_check_val('SYSFS_ROOT', _is_nonempty_string)
+_check_val('ISCSI_SESSION_MANAGEMENT', _is_bool)
+_check_val('ISCSI_SESSIONS_PER_PORTAL', _is_in(xrange(1, 17)))
+_check_val('ISCSI_PORTAL_CACHE_TTL', _is_float)
+_check_val('ISCSI_NODE_SETTINGS', _is_node_settings)
+_check_val('FC_TARGETED_RESCAN', _is_bool)
+_check_val('FC_TARGET_CACHE_TTL', _is_float)
+_check_val('MULTIPATH_FAST_IO_FAIL_TMO', _is_float)
+_check_val('MULTIPATH_DEV_LOSS_TMO', _is_nonempty_string)
+_check_val('BACKENDS', _is_backends)
+_check_val('BACKEND', _is_none_or_in([b['NAME'] for b in BACKENDS] or
+                                     ['default']))
+_check_val('BACKEND_ROUTING', _is_in(('default', 'capacity')))
 _check_val("%s_ATTACH_COMMANDS" % STORAGE_PROTOCOL.upper(),
            _is_list_of_string_lists)
 _check_val("%s_DETACH_COMMANDS" % STORAGE_PROTOCOL.upper(),
@@ -203,6 +388,31 @@ LUN_DETACH_COMMANDS = getattr(sys.modules[__name__],
                               "%s_DETACH_COMMANDS" % STORAGE_PROTOCOL.upper())
 
 
+def get_backends():
+    """Returns the list of backends. Each backend is a dictionary holding
+    its NAME and the values of all the BACKEND_OPTIONS. The options that have
+    been overwritten by ExtStorage parameters take precedence over the ones
+    of the backends."""
+    module = sys.modules[__name__]
+    defaults = dict((o, getattr(module, o, None)) for o in BACKEND_OPTIONS)
+    if not BACKENDS:
+        return [dict(defaults, NAME='default')]
+
+    backends = []
+    for backend in BACKENDS:
+        options = dict(defaults)
+        options.update((k, v) for k, v in backend.items()
+                       if k not in PARAMETERS)
+        if not re.match(options['POOL_NAME_SEARCH_PATTERN'],
+                        options['POOL']):
+            raise exception.InvalidConfigurationValue(
+                option='BACKENDS', value=backend['NAME'],
+                reason="Pool %s does not comply with pattern: %s" %
+                (options['POOL'], options['POOL_NAME_SEARCH_PATTERN']))
+        backends.append(options)
+    return backends
+
+
 def run_cmds(commands, fatal=True):
     """Run commands"""
 
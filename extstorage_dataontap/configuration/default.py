@@ -32,7 +32,11 @@ STORAGE_FAMILY = "ontap_cluster"
 # storage system.
 STORAGE_PROTOCOL = 'iscsi'
 
-# The hostname (or IP address) for the storage system or proxy server.
+# The hostname (or IP address) for the storage system or proxy server. This
+# may also be a list of management addresses (e.g. the cluster and node
+# management LIFs). In this case every API call is sent to the address with
+# the lowest recent latency and the others are used if it fails. Names are
+# resolved to addresses only if VERIFY_CERT is False.
 HOSTNAME = 'example.org'
 
 # The TCP port to use for communication with the storage system or proxy
@@ -48,6 +52,59 @@ TRANSPORT_TYPE = "https"
 # WARNING: Turning this to False has security implications!
 VERIFY_CERT = True
 
+# The management API used to talk to the storage system. Valid values are
+# "zapi" for the XML based ONTAPI and "rest" for the ONTAP REST API, which
+# requires clustered Data ONTAP 9.6 or newer (9.11 for the performance
+# statistics used by POOL_PLACEMENT latency weighting and the rebalancer).
+API_TYPE = "zapi"
+
+# Time in seconds to wait for the response of an API call. None means that
+# the calls may block forever. Note that some modifying calls (e.g.
+# lun-destroy or lun-resize of a large LUN on a busy storage system) may take
+# minutes and that they are never retried after a timeout.
+API_CALL_TIMEOUT = None
+
+# Time in seconds all the API calls of an ExtStorage action may take in total.
+# The timeout of each call is reduced accordingly and no calls are made after
+# the budget is exhausted, so that a hung storage system can't block a Ganeti
+# job forever. The budget includes the time spent waiting for asynchronous
+# operations (e.g. 7-mode clones), so it should be set well above their
+# expected duration. None means no limit. The tools are not affected.
+ACTION_TIME_BUDGET = None
+
+# Number of times an API call is retried when it fails with an error that is
+# expected to go away (storage system busy or throttling, connection refused
+# or reset). Calls that timed out are only retried if they only read
+# information. The retries stop when ACTION_TIME_BUDGET is exhausted.
+API_RETRIES = 4
+
+# When HOSTNAME lists more than one management address, read calls (e.g.
+# lun-get-iter) that take longer than this percentile of the recent latencies
+# of the selected address are also sent to the next one and the first
+# response is used. Set to None to disable hedging.
+API_HEDGE_PERCENTILE = 95
+
+# Time in seconds the addresses the management hostnames resolve to are
+# cached for.
+MANAGEMENT_ADDRESS_CACHE_TTL = 300
+
+# Maximum number of read and modifying API calls per second all the provider
+# processes of a node may send to a storage system. The limits are shared
+# through a file under /var/lib/extstorage-dataontap, so that mass operations
+# (e.g. evacuating a node) do not overload the management LIFs. Set to None
+# to disable the limit.
+API_READ_RATE_LIMIT = None
+API_WRITE_RATE_LIMIT = None
+
+# Number of calls that may be sent at once above the rate limits after a
+# period of inactivity.
+API_RATE_LIMIT_BURST = 10
+
+# File to export the number of API calls and the time spent waiting for the
+# rate limits to, in the Prometheus text format (e.g. for the node exporter
+# textfile collector). Set to None to disable.
+API_RATE_LIMIT_METRICS_FILE = None
+
 # Administrative user account name used to access the storage system or proxy
 # server.
 LOGIN = None
@@ -95,9 +152,124 @@ POOL_NAME_SEARCH_PATTERN = "(.+)"
 # the LUNs on.
 POOL = "vol0"
 
+# If set, new LUNs are not always created on POOL. Each new LUN is placed on
+# the volume matching POOL_NAME_SEARCH_PATTERN that has the most free space
+# left after creating it (and optionally the lowest latency). An explicitly
+# specified pool parameter always takes precedence.
+POOL_PLACEMENT = False
+
+# Time in seconds the capacity and latency snapshot of the volumes used for
+# placing new LUNs is cached.
+PLACEMENT_CACHE_TTL = 30
+
+# Weight of the average latency of a volume (in milliseconds) when placing new
+# LUNs. The score of a volume is the fraction of it that will remain free after
+# creating the LUN, minus its latency multiplied by this weight. For example,
+# with a weight of 0.01, 10ms of latency cost as much as 10% of free space. Set
+# this to 0 to skip collecting the volume latency counters.
+PLACEMENT_LATENCY_WEIGHT = 0
+
 # Map the LUN to the specified initiator group upon creation.
 IGROUP = None
 
+# Per LUN QoS limits. If any of those is set, a dedicated QoS policy group is
+# created for each new LUN with the specified maximum and/or minimum
+# throughput, in I/O operations per second and/or mebibytes per second. Those
+# are meant to be used as ExtStorage parameters (qos_max_iops, qos_max_mbps,
+# qos_min_iops and qos_min_mbps). Minimum throughput requires a Data ONTAP
+# version and platform that support QoS floors. QoS is only supported in
+# clustered Data ONTAP.
+QOS_MAX_IOPS = None
+QOS_MAX_MBPS = None
+QOS_MIN_IOPS = None
+QOS_MIN_MBPS = None
+
+# If set, open and close switch LUNs between an "active" and an "idle" QoS
+# policy group, so that background work on the disks of stopped instances
+# (scrubbing, clone splits, backups, ...) never starves running instances.
+# While a LUN is open, it is assigned its per LUN policy group if QoS limits
+# have been requested for it (see QOS_MAX_IOPS) or QOS_ACTIVE_POLICY_GROUP
+# otherwise. When all the nodes that opened a LUN have closed it, the LUN is
+# assigned to QOS_IDLE_POLICY_GROUP. New LUNs start idle. This is only
+# supported in clustered Data ONTAP.
+QOS_LIFECYCLE = False
+
+# The QoS policy group of open LUNs without per LUN QoS limits. If None, open
+# LUNs are not assigned to any policy group.
+QOS_ACTIVE_POLICY_GROUP = None
+
+# The QoS policy group shared by all idle LUNs. It is created on demand if it
+# does not exist.
+QOS_IDLE_POLICY_GROUP = "extstorage-idle"
+
+# Maximum throughput of the idle QoS policy group when it is created on demand
+# (e.g. "500iops" or "50MB/s"). Keep in mind that the limit is shared by all
+# the idle LUNs.
+QOS_IDLE_MAX_THROUGHPUT = "500iops"
+
+# If set, new LUNs are not created empty. They are cloned out of the template
+# LUN with this name and grown to the requested size instead. This is meant to
+# be used as an ExtStorage parameter (origin) to provision instances out of
+# golden images without copying any data. The template LUN must not be larger
+# than the LUNs created out of it.
+ORIGIN = None
+
+# Named block device tuning profiles. Each profile is a dictionary mapping
+# block device attributes to their values. The supported attributes are
+# scheduler, nr_requests, read_ahead_kb and max_sectors_kb, which are set on
+# the device of the LUN and on the SCSI devices underneath it if it is a
+# multipath device, and queue_depth, which is only set on the SCSI devices.
+TUNING_PROFILES = {
+    'random': {'scheduler': 'none', 'queue_depth': 64, 'nr_requests': 256,
+               'read_ahead_kb': 16, 'max_sectors_kb': 512},
+    'sequential': {'scheduler': 'mq-deadline', 'queue_depth': 64,
+                   'nr_requests': 256, 'read_ahead_kb': 4096,
+                   'max_sectors_kb': 1024},
+}
+
+# The tuning profile attach and grow will apply to the block device of the
+# LUN. This option may be overwritten by an ExtStorage parameter
+# (tuning_profile). None means that the devices are not tuned.
+TUNING_PROFILE = None
+
+# The directory sysfs is mounted on
+SYSFS_ROOT = "/sys"
+
+# If set, new LUN maps are only reported through the node owning the LUN and
+# its HA partner, instead of through every node of the cluster. This reduces
+# the number of paths, and therefore devices, the hosts have to discover. When
+# the rebalancer moves a LUN to a volume of a different HA pair, the nodes of
+# that pair are added to the reporting nodes before the move. The nodes of
+# the old HA pair are removed by the dataontap-lun-maps command, which should
+# be run after the hosts have discovered the new paths. The same command
+# restricts existing LUN maps. This is only supported by clustered Data ONTAP.
+SELECTIVE_LUN_MAP = False
+
+# A list of storage systems to spread the LUNs across. Each backend is a
+# dictionary with a unique NAME and any of the HOSTNAME, PORT, TRANSPORT_TYPE,
+# VERIFY_CERT, LOGIN, PASSWORD, CLUSTER_MODE_VSERVER, SEVEN_MODE_VFILER,
+# IGROUP, POOL and POOL_NAME_SEARCH_PATTERN options, which override the global
+# ones for this backend, e.g.:
+# BACKENDS = [{'NAME': 'filer1', 'HOSTNAME': 'filer1.example.org'},
+#             {'NAME': 'filer2', 'HOSTNAME': 'filer2.example.org',
+#              'POOL': 'vol1'}]
+# An empty list means that a single backend defined by the global options is
+# used. All the backends must use the same storage family and protocol.
+BACKENDS = []
+
+# The backend new LUNs are created on and the administrative commands operate
+# on. This option may be overwritten by an ExtStorage parameter (backend).
+# None means the first backend.
+BACKEND = None
+
+# How create chooses the backend of a new LUN if neither the backend nor the
+# pool parameter has been specified. Valid values are "default" for the
+# backend specified by BACKEND and "capacity" for the backend with the most
+# available space in the volumes matching its POOL_NAME_SEARCH_PATTERN. If a
+# pool is specified, the first backend whose POOL_NAME_SEARCH_PATTERN matches
+# it is used.
+BACKEND_ROUTING = "default"
+
 # This pattern defines the path we expect a LUN to find under
 LUN_DEVICE_PATH_FORMAT = "/dev/disk/{hostname}/{pool}/{name}"
 
@@ -108,6 +280,28 @@ LUN_DEVICE_PATH_FORMAT = "/dev/disk/{hostname}/{pool}/{name}"
 ISCSI_ATTACH_COMMANDS = (("iscsiadm", "-m", "node", "-R"), ("multipath", "-r"),
                          ("udevadm", 'settle'))
 
+# If set, attach will discover all the operational iSCSI portals of the storage
+# system and log in to the ones the host has no session with, before running
+# the attach commands. The logins are performed in parallel.
+ISCSI_SESSION_MANAGEMENT = False
+
+# Number of sessions to open with each iSCSI portal when session management is
+# enabled. More than one session per portal increases the number of paths
+# multipath can spread the I/O across.
+ISCSI_SESSIONS_PER_PORTAL = 1
+
+# Time in seconds the discovered iSCSI portals are cached for
+ISCSI_PORTAL_CACHE_TTL = 300
+
+# Settings of the iSCSI node records of the target. This option is a dictionary
+# mapping iscsiadm node record keys to their values, e.g.:
+# {'node.session.queue_depth': 128, 'node.session.cmds_max': 1024,
+#  'node.session.timeo.replacement_timeout': 5}
+# The records that have drifted from those settings are updated on attach.
+# Existing sessions pick up the new settings on their next login. An empty
+# dictionary leaves the node records untouched.
+ISCSI_NODE_SETTINGS = {}
+
 # Commands to run to detaching the LUN from a host when iSCSI protocol is used.
 # Warning: This option is a tuple of tuples (or a list of lists). To create an
 # empty tuple use (). To create a tuple with a single command with no args,
@@ -121,6 +315,21 @@ ISCSI_DETACH_COMMANDS = ()
 FC_ATTACH_COMMANDS = (("rescan-scsi-bus.sh",), ("multipath", "-r"),
                       ("udevadm", 'settle'))
 
+# If set, attach will only scan the FC remote ports of the storage system for
+# the ID the LUN is mapped with, instead of relying on the attach commands to
+# discover the device. The remote ports of different HBAs are scanned in
+# parallel. When enabling this, rescan-scsi-bus.sh should be removed from
+# FC_ATTACH_COMMANDS.
+FC_TARGETED_RESCAN = False
+
+# Time in seconds the WWPNs of the target ports are cached for
+FC_TARGET_CACHE_TTL = 300
+
+# The fast_io_fail_tmo and dev_loss_tmo of the multipath device section the
+# dataontap-multipath command generates when FC protocol is used
+MULTIPATH_FAST_IO_FAIL_TMO = 5
+MULTIPATH_DEV_LOSS_TMO = "infinity"
+
 # Commands to run to detaching the LUN from a host when FC protocol is used.
 # Warning: This option is a tuple of tuples (or a list of lists). To create an
 # empty tuple use (). To create a tuple with a single command with no args,
@@ -136,4 +345,98 @@ SCSI_ID_COMMAND = "/lib/udev/scsi_id", "-g", "-d", "{device}"
 # of the device of the LUN
 DEVICE_CLEANUP_COMMAND = ()
 
+# Keep a pool of pre-created LUNs that are already mapped to IGROUP, so that
+# create only needs to rename one of them instead of creating and mapping a new
+# LUN. This option is a dictionary mapping a LUN size in mebibytes to the
+# number of LUNs of this size the pool should hold. The pool is refilled by the
+# dataontap-warm-pool command, which should be run periodically (e.g. by cron)
+# on the master node, and it is only used for disks that don't override any of
+# the pool, igroup, lun_ostype and lun_space_reservation parameters. An empty
+# dictionary disables the warm pool.
+WARM_POOL = {}
+
+# Name prefix of the LUNs that belong to the warm pool. LUNs with this prefix
+# should never be used for anything else.
+WARM_POOL_PREFIX = "warm-pool-"
+
+# If set, remove will not destroy the LUN. Instead, it will unmap it and rename
+# it into the trash namespace (see TRASH_PREFIX). The trashed LUNs are then
+# destroyed in throttled batches by the dataontap-reaper command, which should
+# be run periodically (e.g. by a systemd timer) on the master node.
+DEFERRED_REMOVE = False
+
+# Name prefix of the LUNs that have been moved to the trash. LUNs with this
+# prefix will be destroyed by the reaper.
+TRASH_PREFIX = "trash-"
+
+# If set, verify compares the disks in Ganeti's configuration with the LUNs
+# of all the backends and logs the LUNs Ganeti does not know about, the disks
+# that have no LUN and the LUNs whose size or mapping state is wrong. The
+# check only runs on the nodes that have a copy of the configuration (the
+# master candidates). The dataontap-reconcile command performs the same check
+# on demand.
+VERIFY_RECONCILE = False
+
+# Ganeti's configuration file, read by the reconciliation.
+GANETI_CONFIG_FILE = "/var/lib/ganeti/config.data"
+
+# Name this provider is installed under in Ganeti's ExtStorage directory
+# (e.g. /usr/share/ganeti/extstorage/dataontap). Only the disks of this
+# provider are reconciled.
+GANETI_PROVIDER_NAME = "dataontap"
+
+# Maximum number of trashed LUNs the reaper will destroy in a batch
+REAPER_BATCH_SIZE = 10
+
+# Time to wait between two reaper batches in seconds
+REAPER_BATCH_INTERVAL = 30
+
+# The dataontap-rebalance command moves LUNs from the busiest volumes matching
+# POOL_NAME_SEARCH_PATTERN to the least busy ones using non-disruptive LUN
+# moves. This is only supported by clustered Data ONTAP. A rebalance is only
+# performed if the IOPS of the busiest volume exceed those of the least busy
+# volume by more than this fraction of the busiest volume's IOPS.
+REBALANCE_THRESHOLD = 0.2
+
+# Maximum number of LUNs a single rebalance run will move
+REBALANCE_MAX_MOVES = 4
+
+# Maximum number of LUN moves that may be in progress at the same time
+REBALANCE_MAX_CONCURRENT = 2
+
+# Maximum time to wait for a LUN move to finish in seconds. None means wait
+# forever.
+REBALANCE_MOVE_TIMEOUT = None
+
+# The dataontap-clone-split command splits the LUN clones created by the
+# provider (snapshots, clones of the origin LUN and instance snapshots) from
+# their parents by moving them to the eligible volume with the most free space.
+# This is only supported by clustered Data ONTAP. Clones older than this many
+# seconds are split. None disables splitting clones because of their age.
+CLONE_SPLIT_MIN_AGE = 7 * 24 * 3600
+
+# Clones that are deeper than this in a chain of clones (a clone of a clone of
+# a LUN has a depth of 2) are split regardless of their age. None disables
+# splitting clones because of their depth.
+CLONE_SPLIT_MAX_DEPTH = 2
+
+# Local time window splits may be started in, in the HH:MM-HH:MM format (e.g.
+# "01:00-06:00"). The window may span midnight. Splits that are running when
+# the window closes are allowed to finish. None means at any time.
+CLONE_SPLIT_WINDOW = None
+
+# Clones hosted on volumes that serve more IOPS than this are not split. The
+# load of the volumes is measured before starting the splits. None disables
+# the check.
+CLONE_SPLIT_MAX_VOLUME_IOPS = None
+
+# Maximum number of splits that may be running at the same time on each
+# aggregate. A split counts against both the source and the destination
+# aggregate. Splits are tracked with the same timeout as the LUN moves of the
+# rebalancer (REBALANCE_MOVE_TIMEOUT).
+CLONE_SPLIT_MAX_PER_AGGREGATE = 1
+
+# Maximum number of clones a single run will split
+CLONE_SPLIT_MAX_SPLITS = 10
+
 # vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Targeted FC rescans.
+
+Instead of scanning every target of every HBA of the host, only the remote
+ports that belong to the storage system are scanned and only for the LUN ID
+the LUN is mapped with. The remote ports of different HBAs are scanned in
+parallel.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap.client import utils
+
+LOG = logging.getLogger(__name__)
+
+# File hosting the cached target WWPNs
+CACHE_FILE = '/var/lib/extstorage-dataontap/fc-targets.json'
+
+
+def _normalize(wwpn):
+    """Returns a WWPN as a lowercase hex string without separators"""
+    wwpn = wwpn.strip().lower()
+    if wwpn.startswith('0x'):
+        wwpn = wwpn[2:]
+    return wwpn.replace(':', '')
+
+
+def _read(path):
+    """Read a sysfs attribute"""
+    with open(path) as f:
+        return f.read().strip()
+
+
+class FCScanner(object):
+    """Scans the FC remote ports of the storage system for a LUN"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.ttl = configuration.FC_TARGET_CACHE_TTL
+
+    @property
+    def usable(self):
+        """Check if targeted rescans are enabled"""
+        return configuration.STORAGE_PROTOCOL == 'fc' and \
+            configuration.FC_TARGETED_RESCAN
+
+    def target_wwpns(self):
+        """Returns the (possibly cached) WWPNs of the target ports"""
+        cache_file = self.provider.backend_file(CACHE_FILE)
+        cached = utils.load_state(cache_file, {})
+        if time.time() - cached.get('timestamp', 0) <= self.ttl and \
+                'wwpns' in cached:
+            return cached['wwpns']
+
+        LOG.debug("Calling get_fc_target_wwpns()")
+        wwpns = sorted(_normalize(w) for w in
+                       self.provider.client.get_fc_target_wwpns())
+        utils.save_state(cache_file, {'timestamp': time.time(),
+                                      'wwpns': wwpns})
+        return wwpns
+
+    def remote_ports(self, wwpns):
+        """Returns a dictionary mapping the SCSI hosts to the (channel,
+        target) tuples of the online remote ports with the given WWPNs"""
+        rports_dir = os.path.join(configuration.SYSFS_ROOT, 'class',
+                                  'fc_remote_ports')
+        wwpns = set(wwpns)
+        ports = {}
+        for rport in sorted(os.listdir(rports_dir)):
+            path = os.path.join(rports_dir, rport)
+            try:
+                if _normalize(_read(os.path.join(path, 'port_name'))) \
+                        not in wwpns:
+                    continue
+                if _read(os.path.join(path, 'port_state')) != 'Online':
+                    continue
+                target = int(_read(os.path.join(path, 'scsi_target_id')))
+            except (IOError, ValueError) as e:
+                LOG.debug("Skipping remote port %s: %s", rport, e)
+                continue
+            if target < 0:
+                continue
+            # The name of a remote port is rport-<host>:<channel>-<number>
+            host, channel = rport[len('rport-'):].split('-')[0].split(':')
+            ports.setdefault(host, []).append((channel, target))
+        return ports
+
+    def _scan_host(self, host, targets, lun_id):
+        """Scan a number of targets of a SCSI host for a LUN"""
+        scan = os.path.join(configuration.SYSFS_ROOT, 'class', 'scsi_host',
+                            'host%s' % host, 'scan')
+        for channel, target in targets:
+            LOG.debug("Scanning host%s channel %s target %s LUN %d", host,
+                      channel, target, lun_id)
+            try:
+                with open(scan, 'w') as f:
+                    f.write("%s %s %d" % (channel, target, lun_id))
+            except (IOError, OSError) as e:
+                LOG.warning("Unable to scan host%s target %s: %s", host,
+                            target, e)
+
+    def rescan(self, lun_id):
+        """Scan the remote ports of the storage system for a LUN ID"""
+        ports = self.remote_ports(self.target_wwpns())
+        if not ports:
+            LOG.warning("No online FC remote port of the storage system "
+                        "found")
+            return
+
+        LOG.info("Scanning %d FC remote port(s) for LUN %d",
+                 sum(len(t) for t in ports.values()), lun_id)
+        threads = []
+        for host, targets in sorted(ports.items()):
+            t = threading.Thread(target=self._scan_host,
+                                 args=(host, targets, lun_id))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Crash-consistent snapshots of all the disks of an instance.
+
+The snapshot action of Ganeti clones one LUN at a time, so the disks of an
+instance are captured at different points in time. Instead, a single
+Snapshot copy is taken of the volumes hosting the LUNs of the instance (a
+consistency group Snapshot copy if they are spread over several volumes) and
+all the LUNs are then cloned out of it concurrently. The Snapshot copy is
+released once the clones exist: it is deleted right away on clustered Data
+ONTAP, while on 7-mode the reaper deletes it once the clones stop depending
+on it. The lineage of the
+clones is recorded with them, so that the clone splitter can split them later
+on.
+"""
+
+import re
+import time
+import calendar
+import logging
+
+from extstorage_dataontap import exception
+from extstorage_dataontap.backends import run_parallel, using_backend
+
+LOG = logging.getLogger(__name__)
+
+# Name prefix of the Snapshot copies taken
+SNAPSHOT_PREFIX = 'ganeti-'
+# Default name suffix of the LUN clones, followed by the timestamp
+CLONE_SUFFIX = '.snap-'
+# Format of the timestamps in the names of the Snapshot copies and the clones
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+
+# Matches the names of the Snapshot copies taken
+SNAPSHOT_REGEXP = re.compile(r'^%s.+-(\d{14})$' % re.escape(SNAPSHOT_PREFIX))
+
+
+def snapshot_time(snapshot_name):
+    """Returns the time a Snapshot copy of an instance has been taken at or
+    None if it has not been taken by an instance snapshot"""
+    match = SNAPSHOT_REGEXP.match(snapshot_name)
+    if match is None:
+        return None
+    return calendar.timegm(time.strptime(match.group(1), TIMESTAMP_FORMAT))
+
+
+class InstanceSnapshot(object):
+    """Takes consistent snapshots of the disks of instances"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def luns(self, instance):
+        """Returns the (name, backend, path) tuples of the LUNs of an
+        instance. They are always looked up on the storage systems, since
+        the instance index of this node may miss disks or hold stale
+        paths."""
+        luns = self.provider.instance_index.lookup(self.provider, instance)
+        if not luns:
+            raise exception.NotFound("No LUNs found for instance %s" %
+                                     instance)
+        return luns
+
+    def snapshot(self, instance, suffix=None):
+        """Snapshot all the disks of an instance at once. The clone of each
+        LUN is named after the LUN followed by the suffix. Returns a list of
+        (LUN name, clone name) tuples."""
+        provider = self.provider
+        luns = self.luns(instance)
+
+        backends = sorted(set(backend for _, backend, _ in luns))
+        if len(backends) > 1:
+            raise exception.InvalidInput(
+                reason="The disks of instance %s are spread over backends %s"
+                % (instance, ", ".join(backends)))
+        with using_backend(provider, backends[0]):
+            return self._snapshot_luns(instance, luns, suffix)
+
+    def _snapshot_luns(self, instance, luns, suffix):
+        """Snapshot the LUNs of an instance, which live on the selected
+        backend"""
+        provider = self.provider
+        timestamp = time.strftime(TIMESTAMP_FORMAT, time.gmtime())
+        snapshot_name = "%s%s-%s" % (SNAPSHOT_PREFIX, instance, timestamp)
+        if suffix is None:
+            suffix = CLONE_SUFFIX + timestamp
+        volumes = sorted(set(path.split('/')[2] for _, _, path in luns))
+        LOG.info("Taking Snapshot copy %s of volume(s) %s", snapshot_name,
+                 ", ".join(volumes))
+        provider._snapshot_volumes(volumes, snapshot_name)
+
+        paths = dict((name, path) for name, _, path in luns)
+        LOG.info("Cloning %d LUN(s) of instance %s out of %s", len(paths),
+                 instance, snapshot_name)
+        try:
+            results = run_parallel(
+                lambda name: provider._clone_lun_from_snapshot(
+                    paths[name], snapshot_name, name + suffix), sorted(paths))
+        finally:
+            # Don't let the Snapshot copies pile up in the volumes
+            provider._release_snapshot(volumes, snapshot_name)
+
+        clones = []
+        error = None
+        for name, result in sorted(results.items()):
+            if isinstance(result, Exception):
+                LOG.error("Unable to clone LUN %s: %s", paths[name], result)
+                error = result
+                continue
+            provider._record_backend(name + suffix)
+            provider.clone_lineage.add("%s/%s" % (
+                paths[name].rpartition('/')[0], name + suffix), name)
+            clones.append((name, name + suffix))
+        if error is not None:
+            raise error
+        return clones
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Instance to LUN index.
+
+setinfo stores the metadata Ganeti passes to it, which contains the name of
+the instance, in the comment of the LUN. The index maps the instance names to
+the LUNs backing their disks. It is kept up to date by the provider actions
+and the rebalancer of the node running them only, so the index of any single
+node may miss disks or hold stale paths. It is rebuilt from the LUN comments
+at any time, and the LUNs of a single instance are looked up by listing only
+the LUNs whose comment names the instance, which refreshes the index too.
+"""
+
+import re
+import logging
+
+from extstorage_dataontap.backends import iter_backends
+from extstorage_dataontap.client import utils
+
+LOG = logging.getLogger(__name__)
+
+# File hosting the instance to LUN index
+INDEX_FILE = '/var/lib/extstorage-dataontap/instances.json'
+# Lock file protecting the index
+LOCK_FILE = '/var/lib/extstorage-dataontap/instances.lock'
+
+# The lun-info attributes fetched when rebuilding the index
+ATTRIBUTES = ('path', 'comment')
+
+# Prefix of the instance name in the metadata Ganeti passes to setinfo
+INSTANCE_METADATA_PREFIX = 'originstname+'
+# Ganeti names the volumes of ext disks <uuid>.ext.disk<index>
+DISK_INDEX_REGEXP = re.compile(r'\.disk(\d+)$')
+
+
+def parse_instance_name(metadata):
+    """Returns the instance name out of the metadata stored in a LUN comment
+    or None if the comment does not contain Ganeti metadata"""
+    if metadata and metadata.startswith(INSTANCE_METADATA_PREFIX):
+        return metadata[len(INSTANCE_METADATA_PREFIX):]
+    return None
+
+
+def parse_disk_index(lun_name):
+    """Returns the index of the instance disk a LUN is backing or None if the
+    LUN name does not follow Ganeti's naming scheme"""
+    match = DISK_INDEX_REGEXP.search(lun_name)
+    return int(match.group(1)) if match else None
+
+
+def _empty():
+    """Returns an empty index"""
+    return {'instances': {}, 'luns': {}}
+
+
+class InstanceIndex(object):
+    """Maps instance names to the LUNs backing their disks. Every LUN is
+    recorded along with its path and the backend hosting it."""
+
+    def _load(self):
+        """Load the index"""
+        return utils.load_state(INDEX_FILE, _empty())
+
+    def get(self, instance):
+        """Returns the (name, backend, path) tuples of the LUNs of an
+        instance, ordered by disk index"""
+        luns = self._load()['instances'].get(instance, {})
+        return sorted(((name, lun['backend'], lun['path'])
+                       for name, lun in luns.items()),
+                      key=lambda l: (parse_disk_index(l[0]), l[0]))
+
+    def _modify(self, func):
+        """Apply a modification to the index under the lock"""
+        utils.modify_state(INDEX_FILE, LOCK_FILE, func, _empty())
+
+    @staticmethod
+    def _remove(index, name):
+        """Remove a LUN from an index. Returns True if it was there."""
+        instance = index['luns'].pop(name, None)
+        if instance is None:
+            return False
+        luns = index['instances'].get(instance, {})
+        luns.pop(name, None)
+        if not luns:
+            index['instances'].pop(instance, None)
+        return True
+
+    def set(self, name, instance, backend, path):
+        """Record the instance a LUN belongs to"""
+        LOG.debug("Recording LUN %s (%s) of instance %s", name, path,
+                  instance)
+
+        def modify(index):
+            lun = {'backend': backend, 'path': path}
+            if index['luns'].get(name) == instance and \
+                    index['instances'][instance].get(name) == lun:
+                return False
+            self._remove(index, name)
+            index['luns'][name] = instance
+            index['instances'].setdefault(instance, {})[name] = lun
+            return True
+
+        self._modify(modify)
+
+    def move(self, name, path):
+        """Record the new path of a LUN, if it belongs to an instance"""
+        def modify(index):
+            instance = index['luns'].get(name)
+            if instance is None:
+                return False
+            LOG.debug("Recording new path %s of LUN %s", path, name)
+            index['instances'][instance][name]['path'] = path
+            return True
+
+        self._modify(modify)
+
+    def delete(self, name):
+        """Remove a LUN from the index"""
+        LOG.debug("Removing LUN %s from the instance index", name)
+        self._modify(lambda index: self._remove(index, name))
+
+    @staticmethod
+    def _iter_luns(provider, query=None):
+        """Yields the (name, instance, backend, path) tuples of the LUNs of
+        all the backends that are named after Ganeti disks and match a
+        lun-info query. Only the path and the comment of each LUN are
+        fetched."""
+        for backend in iter_backends(provider):
+            LOG.debug("Calling iter_lun_pages(%s)", ", ".join(ATTRIBUTES))
+            for page in provider.client.iter_lun_pages(ATTRIBUTES, query):
+                for lun in page:
+                    instance = parse_instance_name(
+                        lun.get_child_content('comment'))
+                    if instance is None:
+                        continue
+                    path = lun.get_child_content('path')
+                    name = path.rpartition('/')[2]
+                    # Clones inherit the comment of their parent
+                    if parse_disk_index(name) is None:
+                        continue
+                    yield name, instance, backend['NAME'], path
+
+    def lookup(self, provider, instance):
+        """Returns the (name, backend, path) tuples of the LUNs of an
+        instance, ordered by disk index, as listed out of the storage
+        systems. The indexed LUNs of the instance are replaced with them."""
+        query = {'comment': INSTANCE_METADATA_PREFIX + instance}
+        luns = {}
+        # 7-mode can't filter the LUNs by comment
+        for name, owner, backend, path in self._iter_luns(provider, query):
+            if owner == instance:
+                luns[name] = {'backend': backend, 'path': path}
+
+        def modify(index):
+            if index['instances'].get(instance, {}) == luns:
+                return False
+            LOG.info("Updating the %d indexed LUN(s) of instance %s",
+                     len(luns), instance)
+            for name in list(index['instances'].get(instance, {})):
+                self._remove(index, name)
+            for name, lun in luns.items():
+                self._remove(index, name)
+                index['luns'][name] = instance
+                index['instances'].setdefault(instance, {})[name] = lun
+            return True
+
+        self._modify(modify)
+        return sorted(((name, lun['backend'], lun['path'])
+                       for name, lun in luns.items()),
+                      key=lambda l: (parse_disk_index(l[0]), l[0]))
+
+    def rebuild(self, provider):
+        """Rebuild the index out of the comments of the LUNs of all the
+        backends that are named after Ganeti disks. Only the path and the
+        comment of each LUN are fetched. Returns the number of LUNs
+        indexed."""
+        index = _empty()
+        for name, instance, backend, path in self._iter_luns(provider):
+            index['luns'][name] = instance
+            index['instances'].setdefault(instance, {})[name] = {
+                'backend': backend, 'path': path}
+
+        with utils.file_lock(LOCK_FILE):
+            utils.save_state(INDEX_FILE, index)
+        LOG.info("Indexed %d LUNs of %d instances", len(index['luns']),
+                 len(index['instances']))
+        return len(index['luns'])
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Streaming LUN inventory.
+
+The LUNs of the storage systems are exported one JSON record per line
+(NDJSON). Each page of LUNs is written out as soon as it has been fetched,
+along with the LUN maps of the LUNs in the page, so that the output starts
+immediately and the memory usage does not depend on the number of LUNs.
+"""
+
+import json
+import logging
+
+from extstorage_dataontap.backends import iter_backends
+from extstorage_dataontap.instances import parse_instance_name, \
+    parse_disk_index
+
+LOG = logging.getLogger(__name__)
+
+# The lun-info attributes fetched for each LUN
+ATTRIBUTES = ('path', 'size', 'uuid', 'is-space-reservation-enabled',
+              'comment')
+
+
+def _lun_record(backend, lun, maps):
+    """Returns the inventory record of a LUN"""
+    path = lun.get_child_content('path')
+    volume = path.split('/')[2]
+    name = path.rpartition('/')[2]
+    size = lun.get_child_content('size')
+    comment = lun.get_child_content('comment')
+    return {
+        'backend': backend,
+        'path': path,
+        'volume': volume,
+        'name': name,
+        'size': int(size) if size is not None else None,
+        'uuid': lun.get_child_content('uuid'),
+        'space_reserved':
+            lun.get_child_content('is-space-reservation-enabled') == 'true',
+        'comment': comment,
+        'instance': parse_instance_name(comment),
+        'disk_index': parse_disk_index(name),
+        'maps': maps,
+    }
+
+
+def iter_pages(provider, backends=None):
+    """Yields the inventory records of the LUNs of a number of backends (all
+    of them by default) one page at a time"""
+    for backend in iter_backends(provider, backends):
+        client = provider.client
+        LOG.debug("Calling iter_lun_pages(%s)", ", ".join(ATTRIBUTES))
+        for page in client.iter_lun_pages(ATTRIBUTES):
+            paths = [lun.get_child_content('path') for lun in page]
+            LOG.debug("Calling get_lun_maps() for %d LUNs", len(paths))
+            maps = {}
+            for lun_map in client.get_lun_maps(paths):
+                lun_id = lun_map['lun-id']
+                maps.setdefault(lun_map['path'], []).append({
+                    'igroup': lun_map['initiator-group'],
+                    'lun_id': int(lun_id) if lun_id is not None else None,
+                    'reporting_nodes': lun_map['reporting-nodes'],
+                })
+            yield [_lun_record(backend['NAME'], lun,
+                               maps.get(lun.get_child_content('path'), []))
+                   for lun in page]
+
+
+def export(provider, stream, backends=None):
+    """Write the inventory to a stream as NDJSON. Returns the number of LUNs
+    written."""
+    count = 0
+    for records in iter_pages(provider, backends):
+        for record in records:
+            stream.write(json.dumps(record, sort_keys=True) + "\n")
+        stream.flush()
+        count += len(records)
+    LOG.info("Exported %d LUNs", count)
+    return count
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
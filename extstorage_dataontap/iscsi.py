@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""iSCSI session management.
+
+The default attach commands only rescan the sessions that already exist on
+the host. When session management is enabled, the iSCSI portals of the
+storage system are discovered through the API and the host logs in to every
+portal it has no session with, so that multipath can spread the I/O across
+all the target ports.
+"""
+
+import re
+import json
+import hashlib
+import time
+import logging
+import threading
+import subprocess
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap.client import utils
+
+LOG = logging.getLogger(__name__)
+
+# File hosting the cached target portals
+CACHE_FILE = '/var/lib/extstorage-dataontap/iscsi-portals.json'
+# File recording the node settings last applied to the node records
+NODE_CACHE_FILE = '/var/lib/extstorage-dataontap/iscsi-nodes.json'
+# Lock file that serializes the session management on a host
+LOCK_FILE = '/var/lib/extstorage-dataontap/iscsi.lock'
+
+# Matches the lines of `iscsiadm -m session' e.g.:
+# tcp: [3] 10.0.0.1:3260,1030 iqn.1992-08.com.netapp:sn.123:vs.4 (non-flash)
+SESSION_REGEXP = re.compile(r'^\S+:\s+\[(\d+)\]\s+(\S+),\S+\s+(\S+)')
+# Matches the lines of `iscsiadm -m node' e.g.:
+# 10.0.0.1:3260,1030 iqn.1992-08.com.netapp:sn.123:vs.4
+NODE_REGEXP = re.compile(r'^(\S+),\S+\s+(\S+)$')
+# Matches the lines of `iscsiadm -m node -T <target> -p <portal>' e.g.:
+# node.session.queue_depth = 32
+SETTING_REGEXP = re.compile(r'^(\S+)\s+=\s+(.*)$')
+
+# Exit status of iscsiadm when no session exists
+ISCSI_ERR_NO_OBJS_FOUND = 21
+
+
+def _portal(address, port):
+    """Returns the iscsiadm portal string of an address and a port"""
+    if ':' in address:
+        address = '[%s]' % address
+    return '%s:%s' % (address, port)
+
+
+def _iscsiadm(*args):
+    """Run iscsiadm and return its output"""
+    cmd = ('iscsiadm',) + args
+    LOG.debug('Running command: "%s"', '" "'.join(cmd))
+    return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+
+class SessionManager(object):
+    """Makes sure the host has sessions with all the target portals"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.sessions_per_portal = configuration.ISCSI_SESSIONS_PER_PORTAL
+        self.ttl = configuration.ISCSI_PORTAL_CACHE_TTL
+        self.node_settings = configuration.ISCSI_NODE_SETTINGS
+
+    @property
+    def usable(self):
+        """Check if session management is enabled"""
+        return configuration.STORAGE_PROTOCOL == 'iscsi' and \
+            configuration.ISCSI_SESSION_MANAGEMENT
+
+    def _load(self, filename=CACHE_FILE):
+        """Load a cache file"""
+        return utils.load_state(self.provider.backend_file(filename))
+
+    def _save(self, data, filename=CACHE_FILE):
+        """Atomically replace a cache file"""
+        utils.save_state(self.provider.backend_file(filename), data)
+
+    def _discover(self):
+        """Fetch the target name and the enabled portals of the storage
+        system"""
+        client = self.provider.client
+        LOG.debug("Calling get_iscsi_service_details()")
+        target = client.get_iscsi_service_details()
+        LOG.debug("Calling get_iscsi_target_details()")
+        details = client.get_iscsi_target_details()
+
+        operational = None
+        if configuration.STORAGE_FAMILY == 'ontap_cluster':
+            LOG.debug("Calling get_operational_network_interface_addresses()")
+            operational = set(
+                client.get_operational_network_interface_addresses())
+
+        portals = []
+        for d in details:
+            if d.get('interface-enabled') == 'false':
+                continue
+            if operational is not None and d['address'] not in operational:
+                continue
+            portals.append(_portal(d['address'], d['port']))
+        LOG.debug("Discovered iSCSI portals of %s: %s", target,
+                  ", ".join(portals))
+        return {'timestamp': time.time(), 'target': target,
+                'portals': sorted(portals)}
+
+    def targets(self, refresh=False):
+        """Returns the (possibly cached) target name and portals"""
+        targets = self._load()
+        if refresh or targets is None or \
+                time.time() - targets['timestamp'] > self.ttl:
+            targets = self._discover()
+            self._save(targets)
+        return targets
+
+    def sessions(self, target):
+        """Returns a dictionary mapping the portals of a target to the IDs
+        of the sessions the host has with them"""
+        try:
+            output = _iscsiadm('-m', 'session')
+        except subprocess.CalledProcessError as e:
+            if e.returncode == ISCSI_ERR_NO_OBJS_FOUND:
+                return {}
+            raise
+
+        sessions = {}
+        for line in output.splitlines():
+            m = SESSION_REGEXP.match(line)
+            if m and m.group(3) == target:
+                sessions.setdefault(m.group(2), []).append(m.group(1))
+        return sessions
+
+    def nodes(self, target):
+        """Returns the portals of the node records of a target"""
+        try:
+            output = _iscsiadm('-m', 'node')
+        except subprocess.CalledProcessError as e:
+            if e.returncode == ISCSI_ERR_NO_OBJS_FOUND:
+                return []
+            raise
+
+        portals = []
+        for line in output.splitlines():
+            m = NODE_REGEXP.match(line)
+            if m and m.group(2) == target:
+                portals.append(m.group(1))
+        return portals
+
+    def _sync_node(self, target, portal):
+        """Update the settings of a node record that differ from the
+        configured ones. Returns the number of settings updated."""
+        output = _iscsiadm('-m', 'node', '-T', target, '-p', portal)
+        current = {}
+        for line in output.splitlines():
+            m = SETTING_REGEXP.match(line)
+            if m:
+                current[m.group(1)] = m.group(2).strip()
+
+        updated = 0
+        for key, value in sorted(self.node_settings.items()):
+            if current.get(key) == str(value):
+                continue
+            LOG.info("Setting %s of iSCSI node %s to %s (was %s)", key,
+                     portal, value, current.get(key))
+            _iscsiadm('-m', 'node', '-T', target, '-p', portal,
+                      '-o', 'update', '-n', key, '-v', str(value))
+            updated += 1
+        return updated
+
+    def _digest(self, target):
+        """Returns a digest identifying the configured node settings"""
+        return hashlib.sha1(json.dumps(
+            [target, sorted(self.node_settings.items())])).hexdigest()
+
+    def sync_node_settings(self):
+        """Apply the configured settings to the node records of the target
+        that have drifted from them. The settings take effect on the next
+        login of each session. The check is skipped if the same settings have
+        been applied less than ISCSI_PORTAL_CACHE_TTL seconds ago. Returns the
+        number of settings updated."""
+        if not self.node_settings:
+            return 0
+
+        with utils.file_lock(LOCK_FILE):
+
+            target = self.targets()['target']
+            if not target:
+                LOG.warning("No iSCSI service found on the storage system")
+                return 0
+            digest = self._digest(target)
+            cached = self._load(NODE_CACHE_FILE)
+            if cached and cached['digest'] == digest and \
+                    time.time() - cached['timestamp'] <= self.ttl:
+                LOG.debug("iSCSI node settings are up to date")
+                return 0
+
+            updated = 0
+            for portal in self.nodes(target):
+                updated += self._sync_node(target, portal)
+            self._save({'digest': digest, 'timestamp': time.time()},
+                       NODE_CACHE_FILE)
+        return updated
+
+    def _login(self, target, portal, sids, errors):
+        """Open the missing sessions with a portal"""
+        try:
+            if not sids:
+                LOG.info("Logging in to iSCSI portal %s", portal)
+                _iscsiadm('-m', 'node', '-T', target, '-p', portal,
+                          '-o', 'new')
+                if self.node_settings:
+                    self._sync_node(target, portal)
+                _iscsiadm('-m', 'node', '-T', target, '-p', portal,
+                          '--login')
+                sids = self.sessions(target).get(portal, [])
+                if not sids:
+                    raise RuntimeError("no session found after login")
+            for _ in xrange(self.sessions_per_portal - len(sids)):
+                LOG.info("Adding a session to iSCSI portal %s", portal)
+                _iscsiadm('-m', 'session', '-r', sids[0], '--op', 'new')
+        except (subprocess.CalledProcessError, RuntimeError) as e:
+            LOG.warning("Unable to log in to iSCSI portal %s: %s", portal,
+                        getattr(e, 'output', e))
+            errors.append(portal)
+
+    def ensure(self):
+        """Log in to all the target portals the host has fewer sessions with
+        than required. Returns the number of portals that failed."""
+        with utils.file_lock(LOCK_FILE):
+
+            targets = self.targets()
+            if not targets['target']:
+                LOG.warning("No iSCSI service found on the storage system")
+                return 0
+            sessions = self.sessions(targets['target'])
+            missing = [p for p in targets['portals'] if
+                       len(sessions.get(p, [])) < self.sessions_per_portal]
+            if not missing:
+                LOG.debug("All iSCSI sessions are present")
+                return 0
+
+            errors = []
+            threads = []
+            for portal in missing:
+                t = threading.Thread(
+                    target=self._login,
+                    args=(targets['target'], portal,
+                          sessions.get(portal, []), errors))
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+
+            # The portals may have changed since they were cached
+            if errors:
+                self._save(dict(targets, timestamp=0))
+        return len(errors)
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""multipath-tools configuration for the storage system.
+
+The device section generated here groups the paths by their ALUA priority, so
+that I/O is only spread across the optimized paths and the non-optimized
+ones are only used if all the optimized paths fail.
+"""
+
+import re
+import logging
+import subprocess
+
+from extstorage_dataontap import configuration
+
+LOG = logging.getLogger(__name__)
+
+VENDOR = 'NETAPP'
+PRODUCT = 'LUN.*'
+
+# Settings that must be in effect for the I/O to avoid the non-optimized paths
+REQUIRED_SETTINGS = ('path_grouping_policy', 'prio', 'hardware_handler',
+                     'path_selector', 'failback')
+
+# LUN OS types suitable for Linux hosts
+LINUX_OSTYPES = ('linux', 'xen')
+
+# Matches a setting line of a multipath configuration
+SETTING_REGEXP = re.compile(r'^\s*(\w+)\s+(.*?)\s*$')
+
+
+def settings(provider):
+    """Returns a list of (key, value) tuples with the device settings"""
+    if configuration.LUN_OSTYPE not in LINUX_OSTYPES:
+        LOG.warning("LUN OS type %s is not meant for Linux hosts",
+                    configuration.LUN_OSTYPE)
+
+    LOG.debug("Calling get_igroup_alua(%s)", provider.igroup)
+    alua = provider.client.get_igroup_alua(provider.igroup)
+    if alua is None:
+        LOG.warning("igroup %s not found", provider.igroup)
+    elif not alua:
+        LOG.warning("ALUA is not enabled on igroup %s. The paths can't be "
+                    "prioritized", provider.igroup)
+
+    device = [
+        ('vendor', '"%s"' % VENDOR),
+        ('product', '"%s"' % PRODUCT),
+        ('path_grouping_policy', 'group_by_prio'),
+        ('path_selector', '"service-time 0"'),
+        ('path_checker', 'tur'),
+        ('hardware_handler', '"1 alua"'),
+        ('prio', 'alua'),
+        ('failback', 'immediate'),
+        ('features', '"2 pg_init_retries 50"'),
+        ('no_path_retry', 'queue'),
+        ('rr_weight', 'uniform'),
+        ('flush_on_last_del', 'yes'),
+    ]
+    # The remote port timeouts only apply to FC. With iSCSI the session
+    # replacement timeout is used instead (see ISCSI_NODE_SETTINGS).
+    if configuration.STORAGE_PROTOCOL == 'fc':
+        device.append(('fast_io_fail_tmo',
+                       str(configuration.MULTIPATH_FAST_IO_FAIL_TMO)))
+        device.append(('dev_loss_tmo',
+                       str(configuration.MULTIPATH_DEV_LOSS_TMO)))
+    return device
+
+
+def generate(provider):
+    """Returns the devices section of multipath.conf for the storage
+    system"""
+    lines = ['devices {', '\tdevice {']
+    for key, value in settings(provider):
+        lines.append('\t\t%s %s' % (key, value))
+    lines.extend(['\t}', '}'])
+    return "\n".join(lines) + "\n"
+
+
+def running_settings():
+    """Returns the settings of the storage system device section of the
+    running multipathd configuration or None if there is no such section"""
+    cmd = ('multipath', '-t')
+    LOG.debug('Running command: "%s"', '" "'.join(cmd))
+    output = subprocess.check_output(cmd)
+
+    # Look for the device subsection of the devices section matching our
+    # vendor. If there are more than one, the last one wins.
+    found = None
+    device = None
+    section = []
+    for line in output.splitlines():
+        line = line.strip()
+        if line.endswith('{'):
+            section.append(line[:-1].strip())
+            if section == ['devices', 'device']:
+                device = {}
+            continue
+        if line == '}':
+            if section == ['devices', 'device'] and \
+                    device.get('vendor', '').strip('"') == VENDOR:
+                found = device
+            if section:
+                section.pop()
+            continue
+        if section == ['devices', 'device']:
+            m = SETTING_REGEXP.match(line)
+            if m:
+                device[m.group(1)] = m.group(2)
+    return found
+
+
+def check(provider):
+    """Compare the running configuration with the generated one. Returns a
+    list of (key, expected, actual) tuples for the settings that differ."""
+    running = running_settings()
+    if running is None:
+        return [('vendor', '"%s"' % VENDOR, None)]
+
+    expected = dict(settings(provider))
+    keys = REQUIRED_SETTINGS
+    if configuration.STORAGE_PROTOCOL == 'fc':
+        keys += ('fast_io_fail_tmo', 'dev_loss_tmo')
+
+    drift = []
+    for key in keys:
+        actual = running.get(key)
+        if actual is None or actual.strip('"') != expected[key].strip('"'):
+            drift.append((key, expected[key], actual))
+    return drift
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Per LUN performance statistics.
+
+The raw LUN performance counters are fetched in bulk using the
+perf-object-get-instances API and the LUNs are mapped to Ganeti instances and
+disks through the metadata setinfo stores in the LUN comments.
+"""
+
+import time
+import logging
+
+from extstorage_dataontap.client import utils
+from extstorage_dataontap.instances import parse_instance_name, \
+    parse_disk_index
+
+LOG = logging.getLogger(__name__)
+
+# Raw LUN counters needed to compute the statistics
+LUN_COUNTERS = ('read_ops', 'write_ops', 'read_data', 'write_data',
+                'avg_read_latency', 'avg_write_latency')
+
+# Maximum number of instances to request per perf-object-get-instances call
+BATCH_SIZE = 200
+
+# The statistics computed for each LUN, in the order they are displayed
+STATS = ('read_iops', 'write_iops', 'read_mbps', 'write_mbps',
+         'read_latency', 'write_latency')
+
+# Statistics used to sort the LUNs
+SORT_KEYS = {
+    'latency': lambda s: max(s['read_latency'], s['write_latency']),
+    'iops': lambda s: s['read_iops'] + s['write_iops'],
+    'throughput': lambda s: s['read_mbps'] + s['write_mbps'],
+}
+
+
+class LunPerfCollector(object):
+    """Collects the performance statistics of the LUNs of a provider"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.luns = {}
+        self._last = None
+
+    def refresh_luns(self):
+        """Refresh the LUN path to Ganeti instance and disk mapping"""
+        luns = {}
+        for lun in self.provider.client.get_lun_list():
+            path = lun.get_child_content('path')
+            name = path.rpartition('/')[2]
+            luns[path] = {
+                'instance': parse_instance_name(
+                    lun.get_child_content('comment')),
+                'disk': parse_disk_index(name),
+                'size': int(lun.get_child_content('size'))}
+        LOG.debug("Found %d LUN(s)", len(luns))
+        self.luns = luns
+
+    def _sample(self):
+        """Fetch the raw counters of all the LUNs"""
+        client = self.provider.client
+        paths = sorted(self.luns.keys())
+        counters = {}
+        for i in range(0, len(paths), BATCH_SIZE):
+            counters.update(client.get_perf_counters(
+                'lun', paths[i:i + BATCH_SIZE], LUN_COUNTERS))
+        return time.time(), counters
+
+    def collect(self):
+        """Returns the statistics of the LUNs since the previous call as a
+        list of dictionaries. The first call only records the counters and
+        returns an empty list."""
+        if not self.luns:
+            self.refresh_luns()
+
+        now, counters = self._sample()
+        last, self._last = self._last, (now, counters)
+        if last is None:
+            return []
+
+        elapsed = now - last[0]
+        stats = []
+        for path, new in counters.items():
+            old = last[1].get(path)
+            if old is None or elapsed <= 0:
+                continue
+            try:
+                delta = dict((c, new[c] - old[c]) for c in LUN_COUNTERS)
+            except KeyError:
+                continue
+            # Counters have been reset
+            if any(v < 0 for v in delta.values()):
+                continue
+
+            read_ops = delta['read_ops']
+            write_ops = delta['write_ops']
+            stat = {
+                'path': path,
+                'read_iops': read_ops / elapsed,
+                'write_iops': write_ops / elapsed,
+                'read_mbps': delta['read_data'] / elapsed / (1024 ** 2),
+                'write_mbps': delta['write_data'] / elapsed / (1024 ** 2),
+                # The latency counters are in microseconds and their bases
+                # are the corresponding operation counters
+                'read_latency': delta['avg_read_latency'] / read_ops / 1000.0
+                if read_ops else 0.0,
+                'write_latency':
+                    delta['avg_write_latency'] / write_ops / 1000.0
+                    if write_ops else 0.0,
+            }
+            stat.update(self.luns.get(path, {'instance': None, 'disk': None,
+                                             'size': 0}))
+            stats.append(stat)
+        return stats
+
+
+def sort_stats(stats, key):
+    """Sort the statistics in descending order"""
+    return sorted(stats, key=SORT_KEYS[key], reverse=True)
+
+
+def format_table(stats):
+    """Format the statistics as a table"""
+    header = "%-32s %4s %10s %10s %10s %10s %10s %10s  %s" % (
+        'INSTANCE', 'DISK', 'R_IOPS', 'W_IOPS', 'R_MB/s', 'W_MB/s',
+        'R_LAT(ms)', 'W_LAT(ms)', 'LUN')
+    lines = [header]
+    for s in stats:
+        lines.append("%-32s %4s %10.1f %10.1f %10.2f %10.2f %10.2f %10.2f  %s"
+                     % ((s['instance'] or '-')[:32],
+                        '-' if s['disk'] is None else s['disk'],
+                        s['read_iops'], s['write_iops'], s['read_mbps'],
+                        s['write_mbps'], s['read_latency'],
+                        s['write_latency'], s['path']))
+    return "\n".join(lines)
+
+
+def format_metrics(stats):
+    """Format the statistics in the Prometheus text exposition format"""
+    lines = []
+    for stat in STATS:
+        lines.append("# TYPE dataontap_lun_%s gauge" % stat)
+        for s in stats:
+            labels = 'lun="%s",instance="%s",disk="%s"' % (
+                s['path'], s['instance'] or '',
+                '' if s['disk'] is None else s['disk'])
+            lines.append("dataontap_lun_%s{%s} %f" % (stat, labels, s[stat]))
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(stats, filename):
+    """Atomically write the statistics to a metrics file"""
+    utils.write_file(filename, format_metrics(stats))
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Capacity and latency aware placement of new LUNs.
+
+Instead of creating every LUN on POOL, pick the volume matching
+POOL_NAME_SEARCH_PATTERN with the best headroom. The capacity (and optionally
+the latency) of the volumes is fetched in bulk and cached for a short period
+of time, so that creating many LUNs at once does not hit the filer for every
+one of them.
+"""
+
+import time
+import logging
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap.client import utils
+
+LOG = logging.getLogger(__name__)
+
+# File hosting the cached snapshot of the volumes
+CACHE_FILE = '/var/lib/extstorage-dataontap/placement.json'
+# Lock file protecting the cache
+LOCK_FILE = '/var/lib/extstorage-dataontap/placement.lock'
+
+# Volume performance counters used to compute the average latency
+LATENCY_COUNTERS = ('avg_latency', 'total_ops')
+
+
+class Placement(object):
+    """Chooses the pool new LUNs of a provider are created on"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.ttl = configuration.PLACEMENT_CACHE_TTL
+        self.latency_weight = configuration.PLACEMENT_LATENCY_WEIGHT
+
+    @property
+    def usable(self):
+        """Check if placement should be used for the current disk. A pool that
+        has been explicitly specified always takes precedence."""
+        return configuration.POOL_PLACEMENT and \
+            'POOL' not in configuration.PARAMETERS
+
+    def _load(self):
+        """Load the cached snapshot"""
+        return utils.load_state(self.provider.backend_file(CACHE_FILE))
+
+    def _save(self, snapshot):
+        """Atomically replace the cached snapshot"""
+        utils.save_state(self.provider.backend_file(CACHE_FILE), snapshot)
+
+    def _take_snapshot(self, previous):
+        """Fetch the capacity (and latency) of all the eligible volumes"""
+        client = self.provider.client
+        now = time.time()
+
+        volumes = {}
+        for name, (total, available) in \
+                client.get_flexvol_capacities().items():
+            if self.provider.pool_regexp.match(name):
+                volumes[name] = {'total': total, 'available': available,
+                                 'latency': 0.0, 'counters': {}}
+        LOG.debug("Eligible pools: %s", ", ".join(sorted(volumes.keys())))
+
+        if self.latency_weight and volumes:
+            counters = client.get_perf_counters('volume', volumes.keys(),
+                                                LATENCY_COUNTERS)
+            old_volumes = previous['volumes'] if previous else {}
+            for name, values in counters.items():
+                if name not in volumes:
+                    continue
+                volumes[name]['counters'] = values
+                old = old_volumes.get(name, {}).get('counters', {})
+                try:
+                    ops = values['total_ops'] - old['total_ops']
+                    latency = values['avg_latency'] - old['avg_latency']
+                except KeyError:
+                    continue
+                # avg_latency is in microseconds and its base is total_ops
+                if ops > 0:
+                    volumes[name]['latency'] = latency / ops / 1000.0
+
+        return {'timestamp': now, 'volumes': volumes}
+
+    def _score(self, volume, size):
+        """Returns the headroom score of a volume for a LUN of a given size.
+        The score is the fraction of the volume that will remain free after
+        the LUN is created, reduced by the weighted latency in milliseconds."""
+        if volume['total'] <= 0:
+            return None
+        if self.provider.space_reserved == 'true' and \
+                volume['available'] < size:
+            return None
+        headroom = (volume['available'] - size) / volume['total']
+        return headroom - self.latency_weight * volume['latency']
+
+    def snapshot(self, refresh=False):
+        """Returns the (possibly cached) snapshot of the eligible volumes.
+        Must be called with the lock held."""
+        snapshot = self._load()
+        if refresh or snapshot is None or \
+                time.time() - snapshot['timestamp'] > self.ttl:
+            LOG.debug("Refreshing the pool capacity snapshot")
+            snapshot = self._take_snapshot(snapshot)
+            self._save(snapshot)
+        return snapshot
+
+    def cached(self):
+        """Returns the cached snapshot of the eligible volumes, however old
+        it is, or None"""
+        return self._load()
+
+    def refresh(self):
+        """Returns a fresh snapshot of the eligible volumes"""
+        with utils.file_lock(LOCK_FILE):
+            return self.snapshot(refresh=True)
+
+    def choose(self, size):
+        """Returns the pool a LUN of size bytes should be created on"""
+        with utils.file_lock(LOCK_FILE):
+            snapshot = self.snapshot()
+
+            scores = {}
+            for name, volume in snapshot['volumes'].items():
+                score = self._score(volume, size)
+                if score is not None:
+                    scores[name] = score
+            LOG.debug("Pool scores: %r", scores)
+
+            if not scores:
+                LOG.warning("No pool with enough free space found. Using the "
+                            "default pool: %s", self.provider.pool_name)
+                return self.provider.pool_name
+
+            pool = max(scores, key=scores.get)
+
+            # Account for the new LUN, so that the next LUNs placed using the
+            # same snapshot get spread across the pools.
+            snapshot['volumes'][pool]['available'] -= size
+            self._save(snapshot)
+
+        LOG.info("Placing new LUN on pool %s", pool)
+        return pool
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -16,7 +16,6 @@
 
 import logging
 
-from extstorage_dataontap import configuration
 from extstorage_dataontap.provider_base import DataOnTapProviderBase
 from extstorage_dataontap.client.client_7mode import Client
 
@@ -26,15 +25,10 @@ LOG = logging.getLogger(__name__)
 class DataOnTapProvider(DataOnTapProviderBase):
     """ExtStorage provider class for NetApp's Data ONTAP working in 7-mode"""
 
-    def _client_setup(self):
-        """Setup the Data ONTAP client"""
-        return Client(hostname=configuration.HOSTNAME,
-                      transport_type=configuration.TRANSPORT_TYPE,
-                      port=configuration.PORT,
-                      username=configuration.LOGIN,
-                      password=configuration.PASSWORD,
-                      vfiler=configuration.SEVEN_MODE_VFILER,
-                      verify_cert=configuration.VERIFY_CERT)
+    def _client_setup(self, backend):
+        """Setup the Data ONTAP client of a backend"""
+        return Client(vfiler=backend['SEVEN_MODE_VFILER'],
+                      **self._client_options(backend))
 
     def _create_lun_meta(self, lun):
         """Creates LUN metadata dictionary."""
@@ -49,6 +43,19 @@ class DataOnTapProvider(DataOnTapProviderBase):
         meta_dict['UUID'] = lun.get_child_content('uuid')
         return meta_dict
 
+    def _get_lun_id(self, path):
+        """Returns the ID the LUN is mapped with to the igroup or None if it
+        is not mapped"""
+        LOG.debug("Calling get_lun_map(%s)", path)
+        result = self.client.get_lun_map(path)
+        igroups = result.get_child_by_name('initiator-groups')
+        if igroups:
+            for info in igroups.get_children():
+                if info.get_child_content('initiator-group-name') == \
+                        self.igroup:
+                    return int(info.get_child_content('lun-id'))
+        return None
+
     def _clone_lun(self, lun, new_name):
         """Clone an existing Lun"""
 
@@ -60,4 +67,23 @@ class DataOnTapProvider(DataOnTapProviderBase):
         self.client.clone_lun(path, clone_path, lun.name, new_name,
                               self.space_reserved)
 
+    def _clone_lun_from_snapshot(self, path, snapshot_name, new_name):
+        """Clone the copy of a LUN in a Snapshot copy of its volume"""
+        clone_path = "%s/%s" % (path.rpartition('/')[0], new_name)
+        name = path.rpartition('/')[2]
+
+        LOG.debug("Calling clone_lun(%s, %s, %s, %s, %s, source_snapshot=%s)",
+                  path, clone_path, name, new_name, self.space_reserved,
+                  snapshot_name)
+        self.client.clone_lun(path, clone_path, name, new_name,
+                              self.space_reserved,
+                              source_snapshot=snapshot_name)
+
+    def _release_snapshot(self, volumes, snapshot_name):
+        """Release a Snapshot copy of a number of volumes once the LUNs have
+        been cloned out of it. The clones are backed by the Snapshot copy
+        until they are split or destroyed, so it is left to the reaper."""
+        LOG.debug("Leaving Snapshot copy %s of volume(s) %s to the reaper",
+                  snapshot_name, ", ".join(volumes))
+
 # vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -29,6 +29,21 @@ import subprocess
 
 from extstorage_dataontap import configuration
 from extstorage_dataontap import exception
+from extstorage_dataontap.warm_pool import WarmPool
+from extstorage_dataontap.placement import Placement
+from extstorage_dataontap.iscsi import SessionManager
+from extstorage_dataontap.tuning import tune_device
+from extstorage_dataontap.fc import FCScanner
+from extstorage_dataontap.reaper import trash_path
+from extstorage_dataontap.reconcile import Reconciler
+from extstorage_dataontap.instances import InstanceIndex, \
+    parse_instance_name
+from extstorage_dataontap.instance_snapshot import InstanceSnapshot
+from extstorage_dataontap.clone_split import CloneLineage
+from extstorage_dataontap.backends import BackendIndex, backend_file, \
+    run_parallel
+from extstorage_dataontap.client import lifs
+from extstorage_dataontap.client import ratelimit
 
 LOG = logging.getLogger(__name__)
 
@@ -38,6 +53,8 @@ WAIT = 1
 MAX_RETRIES = 5
 # Cleanup files directory
 DEVICE_CLEANUP_DIR = '/var/lib/extstorage-dataontap/device-cleanup'
+# LUN attribute hosting the list of nodes that have the LUN open
+OPEN_NODES_ATTRIBUTE = 'ganeti-open-nodes'
 
 
 def getenv(name):
@@ -126,34 +143,231 @@ class NetAppLun(object):
 class DataOnTapProviderBase(object):
     """ExtStorage provider class for NetApp's Data ONTAP"""
 
-    def __init__(self):
-        """Initializes the provider"""
-        self._client = None
-        self.pool_name = configuration.POOL
+    def __init__(self, time_budget=None):
+        """Initializes the provider. If a time budget is given, the API calls
+        will fail once time_budget seconds have passed."""
+        self.deadline = time.time() + time_budget if time_budget else None
+        self._clients = {}
+        self.backends = configuration.get_backends()
+        self.default_backend = configuration.BACKEND or \
+            self.backends[0]['NAME']
+        self.backend_index = BackendIndex()
+        self.instance_index = InstanceIndex()
+        self.clone_lineage = CloneLineage(self)
+        self._select_backend(self.default_backend)
         self.ostype = configuration.LUN_OSTYPE
         self.space_reserved = str(configuration.LUN_SPACE_RESERVATION).lower()
-        self.pool_regexp = re.compile(configuration.POOL_NAME_SEARCH_PATTERN)
-        self.igroup = configuration.IGROUP
+        self.warm_pool = WarmPool(self)
+        self.placement = Placement(self)
+        self.sessions = SessionManager(self)
+        self.fc = FCScanner(self)
 
     @property
     def client(self):
-        """Initializes the NetApp client"""
-        if not self._client:
+        """The NetApp client of the selected backend"""
+        return self._get_client(self.backend)
+
+    def _get_client(self, backend):
+        """Initializes the NetApp client of a backend"""
+        name = backend['NAME']
+        if name not in self._clients:
             LOG.info("Initializing NetApp client")
-            self._client = self._client_setup()
+            self._clients[name] = self._client_setup(backend)
             LOG.info("NetApp initialization finished")
-        return self._client
+        return self._clients[name]
 
-    def _client_setup(self):
-        """Setup the Data ONTAP client"""
+    def _client_setup(self, backend):
+        """Setup the Data ONTAP client of a backend"""
         raise NotImplementedError()
 
+    def _client_options(self, backend):
+        """Returns the client arguments that are common to all the storage
+        families"""
+        metrics_file = configuration.API_RATE_LIMIT_METRICS_FILE
+        if metrics_file:
+            metrics_file = self._backend_file(metrics_file, backend)
+        return {'hostname': backend['HOSTNAME'],
+                'transport_type': backend['TRANSPORT_TYPE'],
+                'port': backend['PORT'],
+                'username': backend['LOGIN'],
+                'password': backend['PASSWORD'],
+                'verify_cert': backend['VERIFY_CERT'],
+                'timeout': configuration.API_CALL_TIMEOUT,
+                'deadline': self.deadline,
+                'retries': configuration.API_RETRIES,
+                'hedge_percentile': configuration.API_HEDGE_PERCENTILE,
+                'lif_cache_file': self._backend_file(lifs.CACHE_FILE,
+                                                     backend),
+                'lif_cache_ttl': configuration.MANAGEMENT_ADDRESS_CACHE_TTL,
+                'rate_limits': {
+                    ratelimit.READ: configuration.API_READ_RATE_LIMIT,
+                    ratelimit.WRITE: configuration.API_WRITE_RATE_LIMIT},
+                'rate_limit_burst': configuration.API_RATE_LIMIT_BURST,
+                'rate_limit_file': self._backend_file(ratelimit.STATE_FILE,
+                                                      backend),
+                'rate_limit_lock_file': self._backend_file(
+                    ratelimit.LOCK_FILE, backend),
+                'rate_limit_metrics_file': metrics_file}
+
+    def _select_backend(self, name):
+        """Perform all the subsequent operations on a backend"""
+        for backend in self.backends:
+            if backend['NAME'] == name:
+                break
+        else:
+            raise exception.InvalidInput(reason="Unknown backend: %s" % name)
+
+        if len(self.backends) > 1:
+            LOG.debug("Using backend %s", name)
+        self.backend = backend
+        self.pool_name = backend['POOL']
+        self.pool_regexp = re.compile(backend['POOL_NAME_SEARCH_PATTERN'])
+        self.igroup = backend['IGROUP']
+
+    def _backend_file(self, path, backend):
+        """Returns the version of a state file path that is specific to a
+        backend"""
+        if len(self.backends) == 1:
+            return path
+        return backend_file(path, backend['NAME'])
+
+    def backend_file(self, path):
+        """Returns the version of a state file path that is specific to the
+        selected backend"""
+        return self._backend_file(path, self.backend)
+
+    def _record_backend(self, name):
+        """Record that a LUN is hosted on the selected backend"""
+        if len(self.backends) > 1:
+            self.backend_index.set(name, self.backend['NAME'])
+
+    def _forget_backend(self, name):
+        """Remove a LUN from the backend index"""
+        if len(self.backends) > 1:
+            self.backend_index.delete(name)
+
+    def _index_lun(self, lun_name, path, metadata):
+        """Record the instance a LUN belongs to, according to the metadata
+        stored in its comment"""
+        instance = parse_instance_name(metadata)
+        if instance is None:
+            self.instance_index.delete(lun_name)
+        else:
+            self.instance_index.set(lun_name, instance, self.backend['NAME'],
+                                    path)
+
+    def _index_new_lun(self, lun_name, path):
+        """Record the instance a new LUN belongs to, if Ganeti has passed
+        the metadata of the disk"""
+        metadata = os.getenv('VOL_METADATA')
+        if metadata:
+            self._index_lun(lun_name, path, metadata)
+
+    def _route(self, lun_name):
+        """Select the backend a new LUN will be created on"""
+        if len(self.backends) == 1:
+            return
+
+        if configuration.ORIGIN:
+            # Clones are always created next to their origin. Looking the
+            # origin up selects its backend.
+            self._get_lun_by_name(configuration.ORIGIN)
+        elif 'BACKEND' in configuration.PARAMETERS:
+            self._select_backend(configuration.BACKEND)
+        elif 'POOL' in configuration.PARAMETERS:
+            for backend in self.backends:
+                if re.match(backend['POOL_NAME_SEARCH_PATTERN'],
+                            configuration.POOL):
+                    self._select_backend(backend['NAME'])
+                    break
+            else:
+                raise exception.InvalidInput(
+                    reason="No backend matches pool: %s" % configuration.POOL)
+        elif configuration.BACKEND_ROUTING == 'capacity':
+            self._select_backend(self._emptiest_backend())
+        else:
+            self._select_backend(self.default_backend)
+
+        LOG.info("Creating volume %s on backend %s", lun_name,
+                 self.backend['NAME'])
+        self._record_backend(lun_name)
+
+    def _emptiest_backend(self):
+        """Returns the backend with the most available space in its eligible
+        volumes"""
+        backends = dict((b['NAME'], b) for b in self.backends)
+        clients = dict((n, self._get_client(b)) for n, b in backends.items())
+
+        LOG.debug("Calling get_flexvol_capacities() on all backends")
+        results = run_parallel(lambda n: clients[n].get_flexvol_capacities(),
+                               sorted(backends))
+
+        available = {}
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                LOG.warning("Unable to fetch the capacity of backend %s: %s",
+                            name, result)
+                continue
+            regexp = re.compile(backends[name]['POOL_NAME_SEARCH_PATTERN'])
+            available[name] = sum(free for vol, (_, free) in result.items()
+                                  if regexp.match(vol))
+        LOG.debug("Available space per backend: %r", available)
+
+        if not available:
+            return self.default_backend
+        return max(available, key=available.get)
+
     def _create_lun_meta(self, lun):
         """Creates LUN metadata dictionary"""
         raise NotImplementedError()
 
     def _get_lun_by_name(self, name):
-        """Fetch a lun by name"""
+        """Fetch a lun by name. If there are many backends, the one hosting
+        the LUN gets selected."""
+        if len(self.backends) > 1:
+            return self._search_backends(name)
+        return self._lookup_lun(name)
+
+    def _search_backends(self, name):
+        """Fetch a lun by name from the backend that hosts it"""
+        cached = self.backend_index.get(name)
+        if cached in [b['NAME'] for b in self.backends]:
+            self._select_backend(cached)
+            lun = self._lookup_lun(name)
+            if lun is not None:
+                return lun
+            LOG.debug("LUN %s not found on backend %s", name, cached)
+
+        # Initialize the clients before using them in parallel
+        clients = dict((b['NAME'], self._get_client(b))
+                       for b in self.backends)
+        path = '/vol/*/%s' % name
+        LOG.debug("Calling get_lun_by_args(path='%s') on all backends", path)
+        results = run_parallel(
+            lambda n: clients[n].get_lun_by_args(path=path), sorted(clients))
+
+        found = []
+        for backend, result in sorted(results.items()):
+            # The LUN may live on a backend that can't be reached
+            if isinstance(result, Exception):
+                LOG.error("Unable to search backend %s: %s", backend, result)
+                raise result
+            found.extend((backend, lun) for lun in result)
+
+        assert len(found) < 2, "Multiple LUNs found with name: `%s'" % name
+
+        if len(found) == 0:
+            if cached is not None:
+                self.backend_index.delete(name)
+            return None
+
+        backend, lun = found[0]
+        self._select_backend(backend)
+        self.backend_index.set(name, backend)
+        return self._create_lun(lun)
+
+    def _lookup_lun(self, name):
+        """Fetch a lun by name from the selected backend"""
 
         LOG.debug("Calling get_lun_by_args(path='/vol/*/%s')", name)
         lun_list = self.client.get_lun_by_args(path='/vol/*/%s' % name)
@@ -164,14 +378,108 @@ class DataOnTapProviderBase(object):
         if len(lun_list) == 0:
             return None
 
-        return NetAppLun(name,
-                         int(lun_list[0].get_child_content('size')),
-                         self._create_lun_meta(lun_list[0]))
+        return self._create_lun(lun_list[0])
+
+    def _create_lun(self, lun):
+        """Creates a NetAppLun out of a LUN returned by the client"""
+        return NetAppLun(lun.get_child_content('path').rpartition('/')[2],
+                         int(lun.get_child_content('size')),
+                         self._create_lun_meta(lun))
+
+    def _destroy_lun(self, lun, fast_clone_delete=False):
+        """Destroy an existing LUN. If fast_clone_delete is set, the LUN must
+        have already been unmapped."""
+        LOG.debug("Calling destroy_lun(%s)", lun.metadata['Path'])
+        self.client.destroy_lun(lun.metadata['Path'])
 
     def _clone_lun(self, lun, new_name):
         """Clone an existing Lun"""
         raise NotImplementedError()
 
+    def _snapshot_volumes(self, volumes, snapshot_name):
+        """Take a single Snapshot copy of a number of volumes"""
+        if len(volumes) == 1:
+            LOG.debug("Calling create_snapshot(%s, %s)", volumes[0],
+                      snapshot_name)
+            self.client.create_snapshot(volumes[0], snapshot_name)
+        else:
+            LOG.debug("Calling create_cg_snapshot(%s, %s)",
+                      ", ".join(volumes), snapshot_name)
+            self.client.create_cg_snapshot(volumes, snapshot_name)
+
+    def _clone_lun_from_snapshot(self, path, snapshot_name, new_name):
+        """Clone the copy of a LUN in a Snapshot copy of its volume"""
+        raise NotImplementedError()
+
+    def _release_snapshot(self, volumes, snapshot_name):
+        """Release a Snapshot copy of a number of volumes once the LUNs have
+        been cloned out of it"""
+        raise NotImplementedError()
+
+    def _map_lun(self, path):
+        """Map a LUN to the igroup"""
+        LOG.debug("Calling map_lun(%s, %s)", path, self.igroup)
+        self.client.map_lun(path, self.igroup)
+        if configuration.SELECTIVE_LUN_MAP:
+            self._restrict_lun_map(path, self.igroup)
+
+    def _restrict_lun_map(self, path, igroup):
+        """Report a LUN map only through the HA pair owning the LUN"""
+        raise NotImplementedError()
+
+    def _get_lun_id(self, path):
+        """Returns the ID the LUN is mapped with to the igroup or None if it
+        is not mapped"""
+        raise NotImplementedError()
+
+    def _provision_qos(self, lun_name):
+        """Create the QoS policy group of a new LUN if QoS limits have been
+        requested. Returns the name of the policy group or None."""
+        return None
+
+    def _set_qos(self, path, qos_policy_group):
+        """Assign a QoS policy group to a LUN"""
+        raise NotImplementedError()
+
+    def _update_qos(self, lun):
+        """Apply the requested QoS limits to an existing LUN"""
+        pass
+
+    def _release_qos(self, lun):
+        """Mark the QoS policy group of a removed LUN for deletion"""
+        pass
+
+    def _cleanup_qos(self):
+        """Delete the QoS policy groups that have been marked for deletion"""
+        pass
+
+    def _activate_qos(self, lun):
+        """Switch an opened LUN to its active QoS policy group"""
+        raise NotImplementedError()
+
+    def _deactivate_qos(self, lun):
+        """Switch a closed LUN to the idle QoS policy group"""
+        raise NotImplementedError()
+
+    def _update_open_nodes(self, lun, opened):
+        """Add the current node to (or remove it from) the list of nodes that
+        have the LUN open. The list is stored in a LUN attribute, so that all
+        the nodes can see it. Returns the updated list."""
+        node = socket.getfqdn()
+        value = self.client.get_lun_attribute(lun.metadata['Path'],
+                                              OPEN_NODES_ATTRIBUTE)
+        nodes = set(n for n in (value or '').split(',') if n)
+        if opened:
+            nodes.add(node)
+        else:
+            nodes.discard(node)
+        LOG.debug("Nodes that have LUN %s open: %s", lun.name,
+                  ", ".join(sorted(nodes)))
+        self.client.set_lun_attribute(lun.metadata['Path'],
+                                      OPEN_NODES_ATTRIBUTE,
+                                      ','.join(sorted(nodes)))
+        return nodes
+
     def _search_lun_device(self, name):
         """Find device path of a LUN if mapped on the host"""
         f = string.Formatter()
@@ -194,6 +502,19 @@ class DataOnTapProviderBase(object):
         # Not found
         return None
 
+    def _rescan_fc(self, name):
+        """Scan the FC remote ports of the storage system for a LUN"""
+        lun = self._get_lun_by_name(name)
+        if lun is None:
+            raise exception.VolumeNotFound(volume_id=name)
+
+        lun_id = self._get_lun_id(lun.metadata['Path'])
+        if lun_id is None:
+            LOG.warning("LUN %s is not mapped to igroup %s", name,
+                        self.igroup)
+            return
+        self.fc.rescan(lun_id)
+
     def _get_lun_device(self, name):
         """Returns the LUN's block device if mapped on the host. Run the attach
         commands if the device is not present."""
@@ -204,6 +525,13 @@ class DataOnTapProviderBase(object):
             return device
         else:
             LOG.info("Device not found. Running device mapping commands")
+            if self.sessions.usable:
+                failed = self.sessions.ensure()
+                if failed:
+                    LOG.warning("Unable to log in to %d iSCSI portal(s)",
+                                failed)
+            if self.fc.usable:
+                self._rescan_fc(name)
             configuration.run_cmds(configuration.LUN_ATTACH_COMMANDS)
 
         # If the file we are searching for is created by a udev rule triggered
@@ -227,6 +555,40 @@ class DataOnTapProviderBase(object):
         LOG.warning("Device for LUN %s not found after scanning", name)
         return None
 
+    def _get_origin(self, size):
+        """Returns the template LUN specified by the origin parameter, making
+        sure it can be cloned into a LUN of size bytes"""
+        origin = self._get_lun_by_name(configuration.ORIGIN)
+        if origin is None:
+            raise exception.VolumeNotFound(volume_id=configuration.ORIGIN)
+
+        if size < origin.size:
+            raise exception.InvalidInput(
+                reason="Origin LUN %s is larger than the requested size" %
+                origin.name)
+        return origin
+
+    def _create_from_origin(self, origin, lun_name, size, qos_policy_group):
+        """Create a LUN of size bytes by cloning the template LUN origin"""
+        LOG.info("Cloning volume %s out of %s", lun_name, origin.name)
+        self._clone_lun(origin, lun_name)
+
+        # The clone is always created in the volume of the origin
+        path = '/vol/%s/%s' % (origin.metadata['Volume'], lun_name)
+        self.clone_lineage.add(path, origin.name)
+        if size > origin.size:
+            LOG.debug("Calling do_direct_resize(%s, %d)", path, size)
+            self.client.do_direct_resize(path, size)
+
+        if qos_policy_group:
+            self._set_qos(path, qos_policy_group)
+
+        LOG.info("Mapping volume %s to igroup %s", lun_name, self.igroup)
+        self._map_lun(path)
+
+        self._index_new_lun(lun_name, path)
+        return 0
+
     @map_environ(lun_name="VOL_NAME", size="VOL_SIZE")
     def create(self, lun_name, size):
         """Driver's entry point for the create script"""
@@ -239,21 +601,47 @@ class DataOnTapProviderBase(object):
             raise exception.VolumeExists(name=exists.name,
                                          pool=exists.metadata['Volume'])
 
+        self._route(lun_name)
+
+        # Check the origin before anything is provisioned for the LUN
+        origin = None
+        if configuration.ORIGIN:
+            origin = self._get_origin(int(size) * (1024 ** 2))
+
+        qos_policy_group = self._provision_qos(lun_name)
+
+        if origin is not None:
+            return self._create_from_origin(origin, lun_name,
+                                            int(size) * (1024 ** 2),
+                                            qos_policy_group)
+
+        if self.warm_pool.usable:
+            path = '/vol/%s/%s' % (self.pool_name, lun_name)
+            if self.warm_pool.claim(int(size), path):
+                if qos_policy_group:
+                    self._set_qos(path, qos_policy_group)
+                self._index_new_lun(lun_name, path)
+                return 0
+
         size = int(size) * (1024 ** 2)  # Size was in mebibytes
 
+        if self.placement.usable:
+            self.pool_name = self.placement.choose(size)
+
         metadata = {
             'OsType': self.ostype,
             'SpaceReserved': self.space_reserved,
             'Path': '/vol/%s/%s' % (self.pool_name, lun_name)}
 
-        LOG.debug("Calling create_lun(%s, %s, %d, %r, None)",
-                  self.pool_name, lun_name, size, metadata)
-        self.client.create_lun(self.pool_name, lun_name, size, metadata, None)
+        LOG.debug("Calling create_lun(%s, %s, %d, %r, %s)",
+                  self.pool_name, lun_name, size, metadata, qos_policy_group)
+        self.client.create_lun(self.pool_name, lun_name, size, metadata,
+                               qos_policy_group)
 
         LOG.info("Mapping volume %s to igroup %s", lun_name, self.igroup)
-        LOG.debug("Calling map_lun(%s, %s)", metadata['Path'], self.igroup)
-        self.client.map_lun(metadata['Path'], self.igroup)
+        self._map_lun(metadata['Path'])
 
+        self._index_new_lun(lun_name, metadata['Path'])
         return 0
 
     @map_environ(lun_name="VOL_NAME")
@@ -261,8 +649,18 @@ class DataOnTapProviderBase(object):
         """Driver's entry point for the attach script"""
         LOG.info("Attaching volume %s", lun_name)
 
+        # The session management, the targeted rescans and the node settings
+        # are specific to the backend hosting the LUN
+        if len(self.backends) > 1:
+            self._get_lun_by_name(lun_name)
+
+        if configuration.STORAGE_PROTOCOL == 'iscsi':
+            self.sessions.sync_node_settings()
+
         device = self._get_lun_device(lun_name)
         if device:
+            if configuration.TUNING_PROFILE:
+                tune_device(device, configuration.TUNING_PROFILE)
             LOG.debug("Outputing: %s", device)
             sys.stdout.write(device)
         else:
@@ -304,8 +702,23 @@ class DataOnTapProviderBase(object):
         if lun is None:
             raise exception.VolumeNotFound(volume_id=lun_name)
 
-        LOG.debug("Calling destroy_lun(%s)", lun.metadata['Path'])
-        self.client.destroy_lun(lun.metadata['Path'])
+        if configuration.DEFERRED_REMOVE:
+            # Unmap the LUN and move it to the trash. The reaper will destroy
+            # it later.
+            new_path = trash_path(lun.metadata['Path'])
+            LOG.debug("Calling unmap_lun(%s, %s)", lun.metadata['Path'],
+                      self.igroup)
+            self.client.unmap_lun(lun.metadata['Path'], self.igroup)
+            LOG.info("Moving volume %s to the trash", lun_name)
+            LOG.debug("Calling move_lun(%s, %s)", lun.metadata['Path'],
+                      new_path)
+            self.client.move_lun(lun.metadata['Path'], new_path)
+        else:
+            self._destroy_lun(lun)
+
+        self._release_qos(lun)
+        self._forget_backend(lun_name)
+        self.instance_index.delete(lun_name)
         return 0
 
     @map_environ(lun_name="VOL_NAME", size="VOL_NEW_SIZE")
@@ -327,6 +740,12 @@ class DataOnTapProviderBase(object):
         # commands only if the device is not present. After growing, the device
         # may be present and have wrong size.
         configuration.run_cmds(configuration.LUN_ATTACH_COMMANDS)
+
+        # The attach commands may have discovered new paths
+        if configuration.TUNING_PROFILE:
+            device = self._search_lun_device(lun_name)
+            if device:
+                tune_device(device, configuration.TUNING_PROFILE)
         return 0
 
     @map_environ(lun_name="VOL_NAME", metadata="VOL_METADATA")
@@ -342,12 +761,22 @@ class DataOnTapProviderBase(object):
         LOG.debug("Calling set_lun_comment(%s, %s)",
                   lun.metadata['Path'], metadata)
         self.client.set_lun_comment(lun.metadata['Path'], metadata)
+        self._index_lun(lun_name, lun.metadata['Path'], metadata)
+
+        self._update_qos(lun)
         return 0
 
     def verify(self):
         """Driver's entry point for the verify script"""
         LOG.info("Verify script called")
 
+        if configuration.VERIFY_RECONCILE:
+            # Only the master candidates have a copy of the configuration
+            try:
+                Reconciler(self).reconcile()
+            except IOError as e:
+                LOG.info("Not reconciling: %s", e)
+
         return 0
 
     @map_environ(lun_name="VOL_NAME", new_name="VOL_SNAPSHOT_NAME",
@@ -364,6 +793,9 @@ class DataOnTapProviderBase(object):
             raise exception.VolumeNotFound(volume_id=lun_name)
 
         self._clone_lun(lun, new_name)
+        self.clone_lineage.add(
+            '/vol/%s/%s' % (lun.metadata['Volume'], new_name), lun_name)
+        self._record_backend(new_name)
         return 0
 
     @map_environ(lun_name="VOL_NAME")
@@ -371,6 +803,14 @@ class DataOnTapProviderBase(object):
         """Driver's entry point for the open script"""
         LOG.info("Opening volume %s", lun_name)
 
+        if configuration.QOS_LIFECYCLE:
+            lun = self._get_lun_by_name(lun_name)
+            if lun is None:
+                raise exception.VolumeNotFound(volume_id=lun_name)
+
+            self._update_open_nodes(lun, opened=True)
+            self._activate_qos(lun)
+
         return 0
 
     @map_environ(lun_name="VOL_NAME")
@@ -378,6 +818,16 @@ class DataOnTapProviderBase(object):
         """Driver's entry point for the close script"""
         LOG.info("Closing volume %s", lun_name)
 
+        if configuration.QOS_LIFECYCLE:
+            lun = self._get_lun_by_name(lun_name)
+            if lun is None:
+                raise exception.VolumeNotFound(volume_id=lun_name)
+
+            # During migrations the LUN is opened on the target node before
+            # it gets closed on the source node.
+            if not self._update_open_nodes(lun, opened=False):
+                self._deactivate_qos(lun)
+
         return 0
 
     @run_hook_on_node(name="GANETI_NEW_PRIMARY", descr="target")
@@ -396,6 +846,18 @@ class DataOnTapProviderBase(object):
         configuration.run_cmds(configuration.LUN_ATTACH_COMMANDS)
         return 0
 
+    @run_hook_on_node(name="GANETI_MASTER", descr="Ganeti master")
+    @map_environ(instance="GANETI_INSTANCE_NAME",
+                 disk_template="GANETI_INSTANCE_DISK_TEMPLATE")
+    def snapshot_instance(self, instance, disk_template):
+        """Driver's entry point for the instance snapshot hook"""
+        if disk_template != 'ext':
+            return 0
+
+        for name, clone in InstanceSnapshot(self).snapshot(instance):
+            LOG.info("Volume %s snapshotted to %s", name, clone)
+        return 0
+
     @run_hook_on_node(name="GANETI_MASTER", descr="Ganeti master")
     @map_environ(node="GANETI_INSTANCE_PRIMARY",
                  disk_template="GANETI_INSTANCE_DISK_TEMPLATE",
@@ -20,23 +20,37 @@ import logging
 from extstorage_dataontap import configuration
 from extstorage_dataontap.provider_base import DataOnTapProviderBase
 from extstorage_dataontap.client.client_cmode import Client
+from extstorage_dataontap.client.client_rest import Client as RestClient
+from extstorage_dataontap.client import api as netapp_api
 
 LOG = logging.getLogger(__name__)
 
+# Name prefix of the QoS policy groups created for LUNs
+QOS_POLICY_GROUP_PREFIX = 'extstorage-'
+# Error code returned when creating an object that already exists
+EDUPLICATEENTRY = '13130'
+
+
+def _throughput(iops, mbps):
+    """Returns a QoS throughput specification out of an IOPS and a MB/s
+    limit"""
+    limits = []
+    if iops:
+        limits.append('%diops' % int(iops))
+    if mbps:
+        limits.append('%dMB/s' % int(mbps))
+    return ','.join(limits) or None
+
 
 class DataOnTapProvider(DataOnTapProviderBase):
     """ExtStorage provider class for NetApp's Data ONTAP working in cluster
     mode
     """
-    def _client_setup(self):
-        """Setup the Data ONTAP client"""
-        return Client(hostname=configuration.HOSTNAME,
-                      transport_type=configuration.TRANSPORT_TYPE,
-                      port=configuration.PORT,
-                      username=configuration.LOGIN,
-                      password=configuration.PASSWORD,
-                      vserver=configuration.CLUSTER_MODE_VSERVER,
-                      verify_cert=configuration.VERIFY_CERT)
+    def _client_setup(self, backend):
+        """Setup the Data ONTAP client of a backend"""
+        client_class = RestClient if backend['API_TYPE'] == 'rest' else Client
+        return client_class(vserver=backend['CLUSTER_MODE_VSERVER'],
+                            **self._client_options(backend))
 
     def _create_lun_meta(self, lun):
         """Creates LUN metadata dictionary."""
@@ -50,8 +64,150 @@ class DataOnTapProvider(DataOnTapProviderBase):
         meta_dict['SpaceReserved'] = \
             lun.get_child_content('is-space-reservation-enabled')
         meta_dict['UUID'] = lun.get_child_content('uuid')
+        meta_dict['IsClone'] = lun.get_child_content('is-clone')
+        meta_dict['QosPolicyGroup'] = \
+            lun.get_child_content('qos-policy-group')
         return meta_dict
 
+    def _get_lun_id(self, path):
+        """Returns the ID the LUN is mapped with to the igroup or None if it
+        is not mapped"""
+        LOG.debug("Calling get_lun_map(%s)", path)
+        for lun_map in self.client.get_lun_map(path):
+            if lun_map['initiator-group'] == self.igroup:
+                return int(lun_map['lun-id'])
+        return None
+
+    def _restrict_lun_map(self, path, igroup):
+        """Report a LUN map only through the HA pair owning the LUN"""
+        LOG.debug("Calling remove_lun_map_remote_reporting_nodes(%s, %s)",
+                  path, igroup)
+        self.client.remove_lun_map_remote_reporting_nodes(path, igroup)
+
+    def _qos_policy_group_spec(self, lun_name):
+        """Returns the specification of the QoS policy group of a LUN or None
+        if no QoS limits have been requested"""
+        max_throughput = _throughput(configuration.QOS_MAX_IOPS,
+                                     configuration.QOS_MAX_MBPS)
+        min_throughput = _throughput(configuration.QOS_MIN_IOPS,
+                                     configuration.QOS_MIN_MBPS)
+        if max_throughput is None and min_throughput is None:
+            return None
+        return {'policy_name': QOS_POLICY_GROUP_PREFIX + lun_name,
+                'max_throughput': max_throughput,
+                'min_throughput': min_throughput}
+
+    def _provision_qos(self, lun_name):
+        """Create the QoS policy group of a new LUN if QoS limits have been
+        requested. Returns the name of the policy group or None."""
+        spec = self._qos_policy_group_spec(lun_name)
+        if spec is not None:
+            LOG.info("Creating QoS policy group %s", spec['policy_name'])
+            LOG.debug("Calling provision_qos_policy_group(%r)", spec)
+            self.client.provision_qos_policy_group({'spec': spec})
+
+        # New LUNs start idle. They become active when they are opened.
+        if configuration.QOS_LIFECYCLE:
+            self._ensure_idle_qos_policy_group()
+            return configuration.QOS_IDLE_POLICY_GROUP
+
+        return spec['policy_name'] if spec is not None else None
+
+    def _set_qos(self, path, qos_policy_group):
+        """Assign a QoS policy group to a LUN"""
+        LOG.debug("Calling set_lun_qos_policy_group(%s, %s)", path,
+                  qos_policy_group)
+        self.client.set_lun_qos_policy_group(path, qos_policy_group)
+
+    def _update_qos(self, lun):
+        """Apply the requested QoS limits to an existing LUN"""
+        spec = self._qos_policy_group_spec(lun.name)
+        if spec is None:
+            return
+
+        name = spec['policy_name']
+        if self.client.qos_policy_group_exists(name):
+            LOG.info("Updating QoS policy group %s", name)
+            self.client.qos_policy_group_modify(name, spec['max_throughput'],
+                                                spec['min_throughput'])
+        else:
+            LOG.info("Creating QoS policy group %s", name)
+            self.client.provision_qos_policy_group({'spec': spec})
+
+        # Idle LUNs will be switched to their policy group when opened
+        idle = configuration.QOS_LIFECYCLE and \
+            lun.metadata['QosPolicyGroup'] == \
+            configuration.QOS_IDLE_POLICY_GROUP
+
+        if not idle and lun.metadata['QosPolicyGroup'] != name:
+            self._set_qos(lun.metadata['Path'], name)
+
+    def _release_qos(self, lun):
+        """Mark the QoS policy group of a removed LUN for deletion"""
+        # The per LUN policy group may exist even if the LUN is not assigned
+        # to it (e.g. if the LUN is idle).
+        name = QOS_POLICY_GROUP_PREFIX + lun.name
+        if lun.metadata['QosPolicyGroup'] != name and \
+                self._qos_policy_group_spec(lun.name) is None:
+            return
+
+        LOG.info("Releasing QoS policy group %s", name)
+        self.client.mark_qos_policy_group_for_deletion(
+            {'spec': {'policy_name': name}})
+
+    def _ensure_idle_qos_policy_group(self):
+        """Create the idle QoS policy group if it does not exist"""
+        name = configuration.QOS_IDLE_POLICY_GROUP
+        if self.client.qos_policy_group_exists(name):
+            return
+
+        LOG.info("Creating idle QoS policy group %s", name)
+        try:
+            self.client.qos_policy_group_create(
+                name, configuration.QOS_IDLE_MAX_THROUGHPUT)
+        except netapp_api.NaApiError as e:
+            # Someone else may have created it in the meantime
+            if e.code != EDUPLICATEENTRY:
+                raise
+
+    def _activate_qos(self, lun):
+        """Switch an opened LUN to its active QoS policy group"""
+        spec = self._qos_policy_group_spec(lun.name)
+        if spec is not None:
+            name = spec['policy_name']
+            if not self.client.qos_policy_group_exists(name):
+                self.client.provision_qos_policy_group({'spec': spec})
+        else:
+            name = configuration.QOS_ACTIVE_POLICY_GROUP or 'none'
+
+        if lun.metadata['QosPolicyGroup'] != name:
+            LOG.info("Switching volume %s to QoS policy group %s", lun.name,
+                     name)
+            self._set_qos(lun.metadata['Path'], name)
+
+    def _deactivate_qos(self, lun):
+        """Switch a closed LUN to the idle QoS policy group"""
+        name = configuration.QOS_IDLE_POLICY_GROUP
+        if lun.metadata['QosPolicyGroup'] != name:
+            self._ensure_idle_qos_policy_group()
+            LOG.info("Switching volume %s to QoS policy group %s", lun.name,
+                     name)
+            self._set_qos(lun.metadata['Path'], name)
+
+    def _cleanup_qos(self):
+        """Delete the QoS policy groups that have been marked for deletion"""
+        LOG.debug("Calling remove_unused_qos_policy_groups()")
+        self.client.remove_unused_qos_policy_groups()
+
+    def _destroy_lun(self, lun, fast_clone_delete=False):
+        """Destroy an existing LUN. If fast_clone_delete is set, the LUN must
+        have already been unmapped, as LUN clones are then deleted as files
+        by the fast clone deletion engine."""
+        path = lun.metadata['Path']
+        is_clone = fast_clone_delete and lun.metadata['IsClone'] == 'true'
+        LOG.debug("Calling destroy_lun(%s, is_clone=%s)", path, is_clone)
+        self.client.destroy_lun(path, is_clone=is_clone)
+
     def _clone_lun(self, lun, new_name):
         """Clone an existing Lun"""
 
@@ -60,4 +216,27 @@ class DataOnTapProvider(DataOnTapProviderBase):
                   new_name, self.space_reserved)
         self.client.clone_lun(volume, lun.name, new_name, self.space_reserved)
 
+    def _clone_lun_from_snapshot(self, path, snapshot_name, new_name):
+        """Clone the copy of a LUN in a Snapshot copy of its volume"""
+        volume = path.split('/')[2]
+        name = path.rpartition('/')[2]
+        LOG.debug("Calling clone_lun(%s, %s, %s, %s, source_snapshot=%s)",
+                  volume, name, new_name, self.space_reserved, snapshot_name)
+        self.client.clone_lun(volume, name, new_name, self.space_reserved,
+                              source_snapshot=snapshot_name)
+
+    def _release_snapshot(self, volumes, snapshot_name):
+        """Release a Snapshot copy of a number of volumes once the LUNs have
+        been cloned out of it. The clones don't depend on the Snapshot copy,
+        so it is deleted right away. The reaper deletes the copies that
+        could not be deleted."""
+        for volume in volumes:
+            LOG.debug("Calling delete_snapshot(%s, %s)", volume,
+                      snapshot_name)
+            try:
+                self.client.delete_snapshot(volume, snapshot_name)
+            except netapp_api.NaApiError as e:
+                LOG.warning("Unable to delete Snapshot copy %s of volume %s: "
+                            "%s", snapshot_name, volume, e)
+
 # vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
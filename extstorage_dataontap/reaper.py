@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Deferred LUN destruction.
+
+Destroying a large thick LUN or a LUN with clone dependencies may take a long
+time. When deferred removal is enabled, remove only moves the LUN into the
+trash namespace and the reaper destroys the trashed LUNs later, in throttled
+batches.
+
+The reaper also deletes the Snapshot copies left behind by instance
+snapshots. On 7-mode they back the clones taken out of them, so they can only
+be deleted once these clones have been destroyed.
+"""
+
+import time
+import fcntl
+import logging
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap.backends import iter_backends
+from extstorage_dataontap.client import api as netapp_api
+from extstorage_dataontap.instance_snapshot import snapshot_time
+
+LOG = logging.getLogger(__name__)
+
+# Lock file that makes sure only one reaper runs at a time
+LOCK_FILE = '/var/lib/extstorage-dataontap/reaper.lock'
+
+# Minimum age in seconds of the Snapshot copies of instance snapshots that are
+# deleted, so that the clones of running instance snapshots are not affected
+SNAPSHOT_MIN_AGE = 3600
+
+
+def trash_path(path):
+    """Returns the path a LUN is moved to when trashed"""
+    volume_path, _, name = path.rpartition('/')
+    return "%s/%s%d-%s" % (volume_path, configuration.TRASH_PREFIX,
+                           int(time.time()), name)
+
+
+class Reaper(object):
+    """Destroys the trashed LUNs of a provider"""
+
+    def __init__(self, provider, batch_size=None, interval=None):
+        self.provider = provider
+        self.batch_size = batch_size or configuration.REAPER_BATCH_SIZE
+        self.interval = interval if interval is not None else \
+            configuration.REAPER_BATCH_INTERVAL
+
+    def list_luns(self):
+        """Returns the trashed LUNs"""
+        client = self.provider.client
+        return client.get_lun_by_args(
+            path='/vol/*/%s*' % configuration.TRASH_PREFIX)
+
+    def reap_batch(self):
+        """Destroy a batch of trashed LUNs. Returns the number of LUNs that
+        were destroyed and the number of LUNs that failed."""
+        destroyed = failed = 0
+        for lun in self.list_luns()[:self.batch_size]:
+            lun = self.provider._create_lun(lun)
+            LOG.info("Destroying trashed LUN %s", lun.metadata['Path'])
+            try:
+                # Trashed LUNs have been unmapped by remove
+                self.provider._destroy_lun(lun, fast_clone_delete=True)
+                destroyed += 1
+            except netapp_api.NaApiError as e:
+                LOG.error("Unable to destroy LUN %s: %s",
+                          lun.metadata['Path'], e)
+                failed += 1
+
+        # The QoS policy groups of the destroyed LUNs are not in use anymore
+        if destroyed:
+            self.provider._cleanup_qos()
+        return destroyed, failed
+
+    def reap_snapshots(self):
+        """Delete the Snapshot copies of instance snapshots left in the pool
+        volumes of all the backends. The copies that are still busy are
+        tried again on the next run. Returns the number of Snapshot copies
+        deleted."""
+        provider = self.provider
+        now = time.time()
+        deleted = 0
+        for backend in iter_backends(provider):
+            client = provider.client
+            LOG.debug("Calling get_flexvol_capacities()")
+            volumes = [v for v in client.get_flexvol_capacities()
+                       if v == provider.pool_name or
+                       provider.pool_regexp.match(v)]
+            for volume in sorted(volumes):
+                LOG.debug("Calling get_snapshot_names(%s)", volume)
+                for name in client.get_snapshot_names(volume):
+                    taken = snapshot_time(name)
+                    if taken is None or now - taken < SNAPSHOT_MIN_AGE:
+                        continue
+                    LOG.info("Deleting Snapshot copy %s of volume %s", name,
+                             volume)
+                    try:
+                        client.delete_snapshot(volume, name)
+                        deleted += 1
+                    except netapp_api.NaApiError as e:
+                        LOG.info("Unable to delete Snapshot copy %s of "
+                                 "volume %s: %s", name, volume, e)
+        return deleted
+
+    def reap(self):
+        """Destroy all the trashed LUNs, one batch at a time"""
+        with open(LOCK_FILE, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                LOG.info("Reaper is already running")
+                return 0
+
+            total = errors = 0
+            while True:
+                destroyed, failed = self.reap_batch()
+                total += destroyed
+                errors += failed
+                # Don't loop forever on LUNs that can't be destroyed
+                if destroyed == 0 or destroyed + failed < self.batch_size:
+                    break
+                LOG.debug("Sleeping for %s seconds", self.interval)
+                time.sleep(self.interval)
+
+            LOG.info("Destroyed %d trashed LUN(s)", total)
+
+            LOG.info("Deleted %d Snapshot copies of instance snapshots",
+                     self.reap_snapshots())
+        return 1 if errors else 0
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
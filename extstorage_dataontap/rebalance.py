@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Hot LUN rebalancing across volumes.
+
+The load of each eligible volume is computed by summing the IOPS of the LUNs
+it hosts. LUNs are then moved from the busiest volumes to the least busy ones
+that have enough free space, using non-disruptive LUN moves. A LUN keeps its
+name, comment and attributes when it is moved, and the provider looks LUNs up
+by name across all volumes, so the disks remain usable while and after they
+are moved.
+"""
+
+import time
+import fcntl
+import logging
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap import exception
+from extstorage_dataontap.client import api as netapp_api
+from extstorage_dataontap.client import poller
+from extstorage_dataontap import perf
+
+LOG = logging.getLogger(__name__)
+
+# Lock file that makes sure only one rebalancer runs at a time
+LOCK_FILE = '/var/lib/extstorage-dataontap/rebalance.lock'
+
+
+def _volume(path):
+    """Returns the name of the volume hosting a LUN"""
+    return path.split('/')[2]
+
+
+def add_reporting_nodes(client, path, volume):
+    """Report the maps of a LUN through the HA pair hosting the volume it is
+    about to be moved to, so that the hosts keep having optimized paths to it
+    after the move"""
+    LOG.debug("Calling get_lun_map(%s)", path)
+    for lun_map in client.get_lun_map(path):
+        LOG.debug("Calling add_lun_map_reporting_nodes(%s, %s, %s)", path,
+                  lun_map['initiator-group'], volume)
+        try:
+            client.add_lun_map_reporting_nodes(
+                path, lun_map['initiator-group'], volume)
+        except netapp_api.NaApiError as e:
+            # The LUN remains accessible through non-optimized paths
+            LOG.warning("Unable to add reporting nodes to map of LUN %s to "
+                        "igroup %s: %s", path, lun_map['initiator-group'], e)
+
+
+class Rebalancer(object):
+    """Moves the hot LUNs of a provider to less busy volumes"""
+
+    def __init__(self, provider, threshold=None, max_moves=None,
+                 max_concurrent=None):
+        if configuration.STORAGE_FAMILY != 'ontap_cluster':
+            raise exception.InvalidInput(
+                reason="LUN moves across volumes are only supported by "
+                       "clustered Data ONTAP")
+        self.provider = provider
+        self.threshold = threshold if threshold is not None else \
+            configuration.REBALANCE_THRESHOLD
+        self.max_moves = max_moves or configuration.REBALANCE_MAX_MOVES
+        self.max_concurrent = max_concurrent or \
+            configuration.REBALANCE_MAX_CONCURRENT
+        self.timeout = configuration.REBALANCE_MOVE_TIMEOUT
+
+    def _movable(self, stat):
+        """Check if a LUN may be moved"""
+        name = stat['path'].rpartition('/')[2]
+        return not (name.startswith(configuration.TRASH_PREFIX) or
+                    name.startswith(configuration.WARM_POOL_PREFIX))
+
+    def sample(self, interval):
+        """Measure the load of the LUNs over interval seconds"""
+        collector = perf.LunPerfCollector(self.provider)
+        collector.collect()
+        time.sleep(interval)
+        return collector.collect()
+
+    def plan(self, stats, volumes):
+        """Returns a list of (path, volume) tuples describing the LUNs that
+        should be moved and their destination volumes. The volumes argument
+        is a dictionary mapping the eligible volumes to their available space
+        in bytes."""
+        load = dict.fromkeys(volumes, 0.0)
+        luns = {}
+        for stat in stats:
+            volume = _volume(stat['path'])
+            if volume not in load:
+                continue
+            iops = perf.SORT_KEYS['iops'](stat)
+            load[volume] += iops
+            if self._movable(stat):
+                luns.setdefault(volume, []).append((iops, stat))
+        available = dict(volumes)
+
+        moves = []
+        while len(moves) < self.max_moves and len(load) > 1:
+            hot = max(load, key=load.get)
+            LOG.debug("Busiest volume: %s (%.1f IOPS)", hot, load[hot])
+
+            # Try the least busy volumes first. Pick the LUN that brings the
+            # two volumes closest to each other. Moving a LUN with more IOPS
+            # than the gap would only swap them.
+            for cold in sorted(load, key=load.get):
+                gap = load[hot] - load[cold]
+                if gap <= self.threshold * load[hot]:
+                    candidates = []
+                    break
+                candidates = [(l_iops, l_stat) for l_iops, l_stat
+                              in luns.get(hot, [])
+                              if 0 < l_iops < gap and
+                              l_stat['size'] <= available[cold]]
+                if candidates:
+                    break
+            if not candidates:
+                LOG.info("No LUN of volume %s can be moved", hot)
+                break
+            iops, stat = min(candidates, key=lambda c: abs(gap / 2 - c[0]))
+
+            moves.append((stat['path'], cold))
+            luns[hot].remove((iops, stat))
+            load[hot] -= iops
+            load[cold] += iops
+            available[cold] -= stat['size']
+            available[hot] += stat['size']
+        return moves
+
+    def move(self, moves):
+        """Perform the LUN moves, at most max_concurrent at a time. Returns
+        the number of moves that failed."""
+        client = self.provider.client
+        failed = 0
+        for i in range(0, len(moves), self.max_concurrent):
+            started = []
+            for path, volume in moves[i:i + self.max_concurrent]:
+                new_path = '/vol/%s/%s' % (volume, path.rpartition('/')[2])
+                LOG.info("Moving LUN %s to %s", path, new_path)
+                try:
+                    if configuration.SELECTIVE_LUN_MAP:
+                        add_reporting_nodes(client, path, volume)
+                    client.start_lun_move(path, new_path)
+                    started.append(new_path)
+                except netapp_api.NaApiError as e:
+                    LOG.error("Unable to move LUN %s: %s", path, e)
+                    failed += 1
+
+            if not started:
+                continue
+            results = client.wait_for_lun_moves(started, self.timeout)
+            for new_path, (state, info) in sorted(results.items()):
+                if state == poller.COMPLETED:
+                    LOG.info("LUN %s moved successfully", new_path)
+                    self.provider.instance_index.move(
+                        new_path.rpartition('/')[2], new_path)
+                else:
+                    LOG.error("Move of LUN %s did not complete (%s): %s",
+                              new_path, state, info)
+                    failed += 1
+        return failed
+
+    def rebalance(self, interval, dry_run=False):
+        """Measure the load of the volumes and move the hot LUNs"""
+        with open(LOCK_FILE, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                LOG.info("Rebalancer is already running")
+                return 0
+
+            stats = self.sample(interval)
+            snapshot = self.provider.placement.refresh()
+            volumes = dict((name, volume['available']) for name, volume
+                           in snapshot['volumes'].items())
+            moves = self.plan(stats, volumes)
+            if not moves:
+                LOG.info("Volumes are balanced, nothing to move")
+                return 0
+            for path, volume in moves:
+                LOG.info("Planned move of LUN %s to volume %s", path, volume)
+            if dry_run:
+                return 0
+
+            failed = self.move(moves)
+            # The free space of the volumes has changed
+            self.provider.placement.refresh()
+            LOG.info("Moved %d LUN(s)", len(moves) - failed)
+            if configuration.SELECTIVE_LUN_MAP:
+                LOG.info("Run dataontap-lun-maps after the hosts have "
+                         "discovered the new paths of the moved LUNs")
+        return 1 if failed else 0
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
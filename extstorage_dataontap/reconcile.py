@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Reconciliation of the Ganeti configuration with the storage systems.
+
+The disks of the provider are read out of Ganeti's configuration and the LUNs
+are streamed out of the storage systems, fetching only their path, size and
+mapping state. Both sides are compared by name in memory, so that the whole
+check takes a few API calls per thousand LUNs instead of a lookup per disk.
+"""
+
+import re
+import json
+import logging
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap.backends import iter_backends
+from extstorage_dataontap.instance_snapshot import CLONE_SUFFIX
+
+LOG = logging.getLogger(__name__)
+
+# The lun-info attributes fetched for each LUN
+ATTRIBUTES = ('path', 'size', 'mapped')
+
+# Kinds of discrepancies
+ORPHAN = 'orphan'
+MISSING = 'missing'
+SIZE_MISMATCH = 'size-mismatch'
+UNMAPPED = 'unmapped'
+
+# Matches the names of the clones taken by instance snapshots
+INSTANCE_SNAPSHOT_REGEXP = re.compile(r'%s\d{14}$' % re.escape(CLONE_SUFFIX))
+
+
+def _iter_ext_disks(config):
+    """Yields the ext disks of a Ganeti configuration. Ganeti 2.16 and newer
+    keep the disks in a top level dictionary, older versions inside the
+    instances."""
+    if 'disks' in config:
+        for disk in config['disks'].values():
+            yield disk
+        return
+    for instance in config.get('instances', {}).values():
+        for disk in instance.get('disks', []):
+            if isinstance(disk, dict):
+                yield disk
+
+
+def load_ganeti_disks(filename, provider_name):
+    """Returns a dictionary mapping the volume names of the disks of a
+    provider to their size in mebibytes"""
+    with open(filename) as f:
+        config = json.load(f)
+
+    disks = {}
+    for disk in _iter_ext_disks(config):
+        if disk.get('dev_type') != 'ext':
+            continue
+        logical_id = disk.get('logical_id') or []
+        if len(logical_id) != 2 or logical_id[0] != provider_name:
+            continue
+        disks[logical_id[1]] = int(disk.get('size', 0))
+    return disks
+
+
+class Reconciler(object):
+    """Compares the disks Ganeti knows about with the LUNs of a provider"""
+
+    def __init__(self, provider, config_file=None, provider_name=None):
+        self.provider = provider
+        self.config_file = config_file or configuration.GANETI_CONFIG_FILE
+        self.provider_name = provider_name or \
+            configuration.GANETI_PROVIDER_NAME
+        # LUNs that are managed by the provider but don't back Ganeti disks
+        self.ignored_prefixes = (configuration.WARM_POOL_PREFIX,
+                                 configuration.TRASH_PREFIX)
+
+    def iter_luns(self):
+        """Yields the (backend, path, size, mapped) tuples of the LUNs of all
+        the backends. The backend of a LUN stays selected while the LUN is
+        being processed."""
+        provider = self.provider
+        for backend in iter_backends(provider):
+            LOG.debug("Calling iter_lun_pages(%s)", ", ".join(ATTRIBUTES))
+            for page in provider.client.iter_lun_pages(ATTRIBUTES):
+                for lun in page:
+                    yield (backend['NAME'], lun.get_child_content('path'),
+                           int(lun.get_child_content('size')),
+                           lun.get_child_content('mapped') == 'true')
+
+    def reconcile(self):
+        """Returns a list of (kind, name, details) tuples describing the
+        discrepancies between Ganeti and the storage systems"""
+        disks = load_ganeti_disks(self.config_file, self.provider_name)
+        LOG.info("Reconciling %d Ganeti disks with the storage systems",
+                 len(disks))
+
+        found = []
+        seen = set()
+        count = 0
+        for backend, path, size, mapped in self.iter_luns():
+            count += 1
+            name = path.rpartition('/')[2]
+            if name.startswith(self.ignored_prefixes):
+                continue
+            if name not in disks:
+                # The clones taken by the snapshot action and by instance
+                # snapshots don't back Ganeti disks either. Their lineage is
+                # only read for the few LUNs that look like orphans.
+                if INSTANCE_SNAPSHOT_REGEXP.search(name) or \
+                        self.provider.clone_lineage.get(path) is not None:
+                    continue
+                found.append((ORPHAN, name, "%s on backend %s, %d bytes" %
+                              (path, backend, size)))
+                continue
+            seen.add(name)
+            if size // 1024 ** 2 != disks[name]:
+                found.append((SIZE_MISMATCH, name,
+                              "%s is %d MiB instead of %d MiB" %
+                              (path, size // 1024 ** 2, disks[name])))
+            if not mapped:
+                found.append((UNMAPPED, name, "%s on backend %s" %
+                              (path, backend)))
+
+        for name in sorted(set(disks) - seen):
+            found.append((MISSING, name, "%d MiB" % disks[name]))
+
+        LOG.info("Checked %d LUNs: %d discrepancies found", count,
+                 len(found))
+        for kind, name, details in found:
+            LOG.warning("%s LUN %s: %s", kind, name, details)
+        return found
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1 @@
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests of the REST client against the mock storage system"""
+
+import unittest
+
+from extstorage_dataontap.client import api as netapp_api
+from extstorage_dataontap.client import client_rest
+from extstorage_dataontap.client import rest_mock
+
+METADATA = {'OsType': 'linux', 'SpaceReserved': 'false'}
+MiB = 1024 ** 2
+
+
+class RestClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = rest_mock.start()
+        self.ontap = self.server.ontap
+        self.client = client_rest.Client(
+            hostname='127.0.0.1', port=self.server.server_address[1],
+            transport_type='http', verify_cert=False, username='admin',
+            password='secret', vserver=rest_mock.VSERVER)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _lun(self, path):
+        """Returns the record of a LUN of the mock or None"""
+        for lun in self.ontap.luns:
+            if lun['name'] == path:
+                return lun
+        return None
+
+    def test_create_lun(self):
+        self.client.create_lun('ganeti0', 'lun0', 10 * MiB, METADATA)
+        lun = self._lun('/vol/ganeti0/lun0')
+        self.assertEqual(lun['space']['size'], 10 * MiB)
+        self.assertEqual(lun['os_type'], 'linux')
+        self.assertFalse(lun['space']['guarantee']['requested'])
+
+        luns = self.client.get_lun_by_args(path='/vol/ganeti0/lun0')
+        self.assertEqual(len(luns), 1)
+        self.assertEqual(luns[0].get_child_content('size'), str(10 * MiB))
+        self.assertEqual(luns[0].get_child_content('volume'), 'ganeti0')
+
+    def test_iter_lun_pages_query(self):
+        for name in ('lun0', 'lun1'):
+            self.client.create_lun('ganeti0', name, MiB, METADATA)
+        self.client.set_lun_comment('/vol/ganeti0/lun1', 'inst1')
+        luns = [lun for page in self.client.iter_lun_pages(
+            ('path', 'comment'), {'comment': 'inst1'}) for lun in page]
+        self.assertEqual([lun.get_child_content('path') for lun in luns],
+                         ['/vol/ganeti0/lun1'])
+
+    def test_map_and_unmap_lun(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        path = '/vol/ganeti0/lun0'
+        self.assertEqual(self.client.map_lun(path, 'ganeti', 3), '3')
+        self.assertEqual(self.client.get_lun_map(path),
+                         [{'initiator-group': 'ganeti', 'lun-id': '3',
+                           'vserver': rest_mock.VSERVER}])
+        self.assertTrue(self._lun(path)['status']['mapped'])
+
+        self.client.unmap_lun(path, 'ganeti')
+        self.assertEqual(self.client.get_lun_map(path), [])
+        # Unmapping a LUN that is not mapped is not an error
+        self.client.unmap_lun(path, 'ganeti')
+
+    def test_clone_lun(self):
+        self.client.create_lun('ganeti0', 'lun0', 4 * MiB, METADATA)
+        self.client.set_lun_comment('/vol/ganeti0/lun0', 'comment')
+        self.client.clone_lun('ganeti0', 'lun0', 'clone0', 'false')
+        clone = self._lun('/vol/ganeti0/clone0')
+        self.assertEqual(clone['space']['size'], 4 * MiB)
+        self.assertEqual(clone['comment'], 'comment')
+
+    def test_clone_lun_blocks(self):
+        self.client.create_lun('ganeti0', 'lun0', 4 * MiB, METADATA)
+        self.client.create_lun('ganeti0', 'lun1', 8 * MiB, METADATA)
+        self.client.clone_lun('ganeti0', 'lun0', 'lun1', 'false',
+                              src_block=0, dest_block=256, block_count=1024)
+        self.assertRaises(netapp_api.NaApiError, self.client.clone_lun,
+                          'ganeti0', 'lun0', 'lun1', 'false', src_block=0,
+                          dest_block=0, block_count=2048)
+
+    def test_clone_lun_from_snapshot(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        self.client.create_snapshot('ganeti0', 'snap0')
+        self.client.do_direct_resize('/vol/ganeti0/lun0', 2 * MiB)
+        self.client.clone_lun('ganeti0', 'lun0', 'clone0', 'false',
+                              source_snapshot='snap0')
+        # The clone has the size of the LUN when the snapshot was taken
+        self.assertEqual(self._lun('/vol/ganeti0/clone0')['space']['size'],
+                         MiB)
+
+    def test_create_cg_snapshot(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        self.client.create_lun('ganeti1', 'lun1', MiB, METADATA)
+        self.client.create_cg_snapshot(['ganeti0', 'ganeti1'], 'snap0')
+        self.assertEqual(sorted(self.ontap.snapshots),
+                         [('ganeti0', 'snap0'), ('ganeti1', 'snap0')])
+        # The consistency group is only used to take the Snapshot copy
+        self.assertEqual(self.ontap.consistency_groups, [])
+
+    def test_delete_snapshot(self):
+        self.client.create_snapshot('ganeti0', 'snap0')
+        self.client.create_snapshot('ganeti0', 'snap1')
+        self.assertEqual(sorted(self.client.get_snapshot_names('ganeti0')),
+                         ['snap0', 'snap1'])
+        self.client.delete_snapshot('ganeti0', 'snap0')
+        self.assertEqual(self.client.get_snapshot_names('ganeti0'), ['snap1'])
+        self.assertRaises(netapp_api.NaApiError,
+                          self.client.delete_snapshot, 'ganeti0', 'snap0')
+
+    def test_resize_lun(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        self.client.do_direct_resize('/vol/ganeti0/lun0', 5 * MiB)
+        self.assertEqual(self._lun('/vol/ganeti0/lun0')['space']['size'],
+                         5 * MiB)
+
+    def test_destroy_lun(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        path = '/vol/ganeti0/lun0'
+        self.client.map_lun(path, 'ganeti')
+        self.client.destroy_lun(path)
+        self.assertIsNone(self._lun(path))
+        self.assertEqual(self.ontap.lun_maps, [])
+
+    def test_destroy_mapped_lun_without_force(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        path = '/vol/ganeti0/lun0'
+        self.client.map_lun(path, 'ganeti')
+        try:
+            self.client.destroy_lun(path, force=False)
+        except netapp_api.NaApiError as e:
+            # Errors without a zAPI equivalent keep the REST error code
+            self.assertEqual(e.code, '5374785')
+        else:
+            self.fail("Destroying a mapped LUN did not fail")
+        self.assertIsNotNone(self._lun(path))
+
+    def test_duplicate_lun_error(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        try:
+            self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        except netapp_api.NaApiError as e:
+            self.assertEqual(e.code, client_rest.EDUPLICATEENTRY)
+        else:
+            self.fail("Creating a duplicate LUN did not fail")
+
+    def test_missing_lun_error(self):
+        try:
+            self.client.do_direct_resize('/vol/ganeti0/nolun', MiB)
+        except netapp_api.NaApiError as e:
+            self.assertEqual(e.code, client_rest.EOBJECTNOTFOUND)
+        else:
+            self.fail("Resizing a missing LUN did not fail")
+
+    def test_missing_volume_error(self):
+        try:
+            self.client.create_snapshot('novolume', 'snap0')
+        except netapp_api.NaApiError as e:
+            self.assertEqual(e.code, client_rest.EOBJECTNOTFOUND)
+        else:
+            self.fail("Taking a Snapshot copy of a missing volume did not "
+                      "fail")
+
+    def test_lun_attribute(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        path = '/vol/ganeti0/lun0'
+        self.assertIsNone(self.client.get_lun_attribute(path, 'nodes'))
+        self.client.set_lun_attribute(path, 'nodes', 'node1')
+        self.assertEqual(self.client.get_lun_attribute(path, 'nodes'),
+                         'node1')
+
+    def test_lun_attribute_error(self):
+        self.client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        self.server.shutdown()
+        self.server.server_close()
+        self.client.close()
+        self.assertRaises(netapp_api.NaApiError,
+                          self.client.get_lun_attribute,
+                          '/vol/ganeti0/lun0', 'nodes')
+
+    def test_failover_to_next_address(self):
+        # Nothing listens on the port of the mock at 127.0.0.2
+        client = client_rest.Client(
+            hostname=['127.0.0.2', '127.0.0.1'],
+            port=self.server.server_address[1], transport_type='http',
+            verify_cert=False, username='admin', password='secret',
+            vserver=rest_mock.VSERVER)
+        try:
+            client.create_lun('ganeti0', 'lun0', MiB, METADATA)
+        finally:
+            client.close()
+        self.assertIsNotNone(self._lun('/vol/ganeti0/lun0'))
+        self.assertEqual(client.lifs.order(), ['127.0.0.1', '127.0.0.2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
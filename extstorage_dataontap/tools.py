@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Administrative commands shipped along with the ExtStorage provider"""
+
+import sys
+import errno
+import time
+import logging
+import argparse
+
+from extstorage_dataontap import version
+from extstorage_dataontap.common import DataOnTapProvider, setup_logging
+from extstorage_dataontap.reaper import Reaper
+from extstorage_dataontap.rebalance import Rebalancer
+from extstorage_dataontap.reconcile import Reconciler
+from extstorage_dataontap.instance_snapshot import InstanceSnapshot
+from extstorage_dataontap.clone_split import CloneSplitter
+from extstorage_dataontap import perf
+from extstorage_dataontap import inventory as inv
+from extstorage_dataontap import multipath as mpath
+from extstorage_dataontap.client import api as netapp_api
+
+LOG = logging.getLogger()
+
+
+def _run(name, func):
+    """Run a command against a provider instance"""
+
+    setup_logging(name)
+
+    LOG.debug("Running Data ONTAP ExtStorage Provider v%s command: %s",
+              version, name)
+    try:
+        provider = DataOnTapProvider()
+        return func(provider)
+    except Exception:
+        LOG.exception("command: %s failed", name)
+        return 2
+
+
+def warm_pool(argv=None):
+    """Entry point of the dataontap-warm-pool command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-warm-pool',
+        description="Refill the warm pool of pre-created LUNs")
+    parser.parse_args(argv)
+
+    return _run('warm-pool', lambda provider: provider.warm_pool.maintain())
+
+
+def reaper(argv=None):
+    """Entry point of the dataontap-reaper command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-reaper',
+        description="Destroy the LUNs that have been moved to the trash and "
+                    "the Snapshot copies left by instance snapshots")
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help="maximum number of LUNs to destroy in a batch")
+    parser.add_argument('--interval', type=float, default=None,
+                        help="seconds to wait between two batches")
+    args = parser.parse_args(argv)
+
+    return _run('reaper', lambda provider: Reaper(
+        provider, args.batch_size, args.interval).reap())
+
+
+def top(argv=None):
+    """Entry point of the dataontap-top command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-top',
+        description="Display the busiest LUNs and the Ganeti disks they "
+                    "back")
+    parser.add_argument('-i', '--interval', type=float, default=5,
+                        help="seconds between two samples (default: 5)")
+    parser.add_argument('-n', '--iterations', type=int, default=None,
+                        help="exit after this many updates")
+    parser.add_argument('-s', '--sort', choices=sorted(perf.SORT_KEYS),
+                        default='latency',
+                        help="sort the LUNs by this statistic "
+                             "(default: latency)")
+    parser.add_argument('-l', '--limit', type=int, default=20,
+                        help="number of LUNs to display (default: 20)")
+    parser.add_argument('-r', '--refresh', type=int, default=12,
+                        help="look for new and removed LUNs every this many "
+                             "updates (default: 12)")
+    parser.add_argument('-m', '--metrics', metavar='FILE', default=None,
+                        help="write the statistics of all the LUNs to FILE in "
+                             "the Prometheus text format instead of "
+                             "displaying them")
+    args = parser.parse_args(argv)
+
+    def run(provider):
+        collector = perf.LunPerfCollector(provider)
+        collector.collect()
+        iteration = 0
+        while args.iterations is None or iteration < args.iterations:
+            # New LUNs are displayed from the update after they are found
+            if iteration and args.refresh > 0 and \
+                    iteration % args.refresh == 0:
+                collector.refresh_luns()
+            time.sleep(args.interval)
+            stats = perf.sort_stats(collector.collect(), args.sort)
+            if args.metrics:
+                perf.write_metrics(stats, args.metrics)
+            else:
+                if sys.stdout.isatty():
+                    sys.stdout.write("\033[H\033[2J")
+                sys.stdout.write(perf.format_table(stats[:args.limit]) + "\n")
+                sys.stdout.flush()
+            iteration += 1
+        return 0
+
+    return _run('top', run)
+
+
+def rebalance(argv=None):
+    """Entry point of the dataontap-rebalance command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-rebalance',
+        description="Move hot LUNs from the busiest volumes to the least busy "
+                    "ones")
+    parser.add_argument('-i', '--interval', type=float, default=30,
+                        help="seconds to measure the load of the LUNs for "
+                             "(default: 30)")
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="minimum load difference between the busiest "
+                             "and the least busy volume, as a fraction of the "
+                             "load of the busiest volume")
+    parser.add_argument('--max-moves', type=int, default=None,
+                        help="maximum number of LUNs to move")
+    parser.add_argument('--max-concurrent', type=int, default=None,
+                        help="maximum number of concurrent LUN moves")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="only display the moves that would be performed")
+    args = parser.parse_args(argv)
+
+    return _run('rebalance', lambda provider: Rebalancer(
+        provider, args.threshold, args.max_moves,
+        args.max_concurrent).rebalance(args.interval, args.dry_run))
+
+
+def lun_maps(argv=None):
+    """Entry point of the dataontap-lun-maps command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-lun-maps',
+        description="Restrict the LUN maps to the HA pairs owning the LUNs")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="only display the LUN maps that would be "
+                             "restricted")
+    args = parser.parse_args(argv)
+
+    def run(provider):
+        errors = 0
+        for lun_map in provider.client.get_lun_maps():
+            # The owning node and its HA partner
+            if len(lun_map['reporting-nodes']) <= 2:
+                continue
+            LOG.info("Restricting map of LUN %s to igroup %s (reported by: "
+                     "%s)", lun_map['path'], lun_map['initiator-group'],
+                     ", ".join(lun_map['reporting-nodes']))
+            if args.dry_run:
+                continue
+            try:
+                provider._restrict_lun_map(lun_map['path'],
+                                           lun_map['initiator-group'])
+            except netapp_api.NaApiError as e:
+                LOG.error("Unable to restrict map of LUN %s: %s",
+                          lun_map['path'], e)
+                errors += 1
+        return 1 if errors else 0
+
+    return _run('lun-maps', run)
+
+
+def multipath(argv=None):
+    """Entry point of the dataontap-multipath command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-multipath',
+        description="Generate the multipath.conf device section for the "
+                    "storage system or check the running configuration "
+                    "against it")
+    parser.add_argument('-c', '--check', action='store_true',
+                        help="check the running multipathd configuration "
+                             "instead of printing the device section")
+    args = parser.parse_args(argv)
+
+    def run(provider):
+        if not args.check:
+            sys.stdout.write(mpath.generate(provider))
+            return 0
+
+        drift = mpath.check(provider)
+        for key, expected, actual in drift:
+            LOG.error("multipath setting %s is %s instead of %s", key,
+                      actual, expected)
+        if drift:
+            return 1
+        LOG.info("multipath configuration is up to date")
+        return 0
+
+    return _run('multipath', run)
+
+
+def inventory(argv=None):
+    """Entry point of the dataontap-inventory command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-inventory',
+        description="Stream the LUNs of the storage systems along with their "
+                    "metadata and LUN maps as NDJSON, one LUN per line")
+    parser.add_argument('-b', '--backend', action='append', default=None,
+                        help="only export the LUNs of this backend (may be "
+                             "given more than once)")
+    args = parser.parse_args(argv)
+
+    def run(provider):
+        try:
+            inv.export(provider, sys.stdout, args.backend)
+        except IOError as e:
+            # The reading end of the pipe has been closed
+            if e.errno != errno.EPIPE:
+                raise
+        return 0
+
+    return _run('inventory', run)
+
+
+def reconcile(argv=None):
+    """Entry point of the dataontap-reconcile command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-reconcile',
+        description="Compare the disks in Ganeti's configuration with the "
+                    "LUNs of the storage systems")
+    parser.add_argument('-c', '--config', default=None,
+                        help="Ganeti's configuration file (default: "
+                             "GANETI_CONFIG_FILE)")
+    args = parser.parse_args(argv)
+
+    def run(provider):
+        found = Reconciler(provider, args.config).reconcile()
+        for kind, name, details in found:
+            sys.stdout.write("%s %s %s\n" % (kind, name, details))
+        return 1 if found else 0
+
+    return _run('reconcile', run)
+
+
+def instances(argv=None):
+    """Entry point of the dataontap-instances command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-instances',
+        description="Display the LUNs backing the disks of Ganeti instances")
+    parser.add_argument('-r', '--rebuild', action='store_true',
+                        help="rebuild the instance index out of the LUN "
+                             "comments first")
+    parser.add_argument('instance', nargs='*',
+                        help="name of an instance")
+    args = parser.parse_args(argv)
+
+    def run(provider):
+        index = provider.instance_index
+        if args.rebuild:
+            index.rebuild(provider)
+        errors = 0
+        for instance in args.instance:
+            # The index of this node may be stale
+            luns = index.lookup(provider, instance)
+            if not luns:
+                LOG.error("No LUNs found for instance %s", instance)
+                errors += 1
+            for name, backend, path in luns:
+                sys.stdout.write("%s %s %s\n" % (instance, backend, path))
+        return 1 if errors else 0
+
+    return _run('instances', run)
+
+
+def snapshot_instance(argv=None):
+    """Entry point of the dataontap-snapshot-instance command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-snapshot-instance',
+        description="Snapshot all the disks of an instance at the same point "
+                    "in time")
+    parser.add_argument('-s', '--suffix', default=None,
+                        help="suffix appended to the LUN names to name the "
+                             "clones (default: .snap-<timestamp>)")
+    parser.add_argument('instance', help="name of the instance")
+    args = parser.parse_args(argv)
+
+    def run(provider):
+        for name, clone in InstanceSnapshot(provider).snapshot(args.instance,
+                                                               args.suffix):
+            sys.stdout.write("%s %s\n" % (name, clone))
+        return 0
+
+    return _run('snapshot-instance', run)
+
+
+def clone_split(argv=None):
+    """Entry point of the dataontap-clone-split command"""
+    parser = argparse.ArgumentParser(
+        prog='dataontap-clone-split',
+        description="Split old and deeply chained LUN clones from their "
+                    "parents")
+    parser.add_argument('-i', '--interval', type=float, default=30,
+                        help="seconds to measure the load of the volumes for, "
+                             "if CLONE_SPLIT_MAX_VOLUME_IOPS is set "
+                             "(default: 30)")
+    parser.add_argument('--max-splits', type=int, default=None,
+                        help="maximum number of clones to split")
+    parser.add_argument('--max-per-aggregate', type=int, default=None,
+                        help="maximum number of concurrent splits per "
+                             "aggregate")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="only display the splits that would be "
+                             "performed")
+    args = parser.parse_args(argv)
+
+    return _run('clone-split', lambda provider: CloneSplitter(
+        provider, args.max_splits,
+        args.max_per_aggregate).split(args.interval, args.dry_run))
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
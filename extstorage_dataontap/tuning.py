@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Block device tuning.
+
+The tuning profiles defined in TUNING_PROFILES are applied through sysfs to
+the block device of a LUN and, if this is a device-mapper (multipath) device,
+to the SCSI devices underneath it.
+"""
+
+import os
+import logging
+
+from extstorage_dataontap import configuration
+
+LOG = logging.getLogger(__name__)
+
+
+def _block_dir(name):
+    """Returns the sysfs directory of a block device"""
+    return os.path.join(configuration.SYSFS_ROOT, 'block', name)
+
+
+def _write(path, value):
+    """Write a value to a sysfs attribute. Returns True on success."""
+    LOG.debug("Writing %s to %s", value, path)
+    try:
+        with open(path, 'w') as f:
+            f.write(str(value))
+    except (IOError, OSError) as e:
+        LOG.warning("Unable to write %s to %s: %s", value, path, e)
+        return False
+    return True
+
+
+def _tune(name, profile):
+    """Apply a profile to a single block device"""
+    block_dir = _block_dir(name)
+    for attr in configuration.TUNING_QUEUE_ATTRIBUTES:
+        if attr in profile:
+            _write(os.path.join(block_dir, 'queue', attr), profile[attr])
+    # Only SCSI devices have a queue depth
+    for attr in configuration.TUNING_DEVICE_ATTRIBUTES:
+        path = os.path.join(block_dir, 'device', attr)
+        if attr in profile and os.path.exists(path):
+            _write(path, profile[attr])
+
+
+def slaves(name):
+    """Returns the devices underneath a device-mapper device"""
+    slaves_dir = os.path.join(_block_dir(name), 'slaves')
+    if not os.path.isdir(slaves_dir):
+        return []
+    return sorted(os.listdir(slaves_dir))
+
+
+def tune_device(device, profile_name):
+    """Apply the tuning profile named profile_name to a device and its
+    slaves"""
+    profile = configuration.TUNING_PROFILES[profile_name]
+    name = os.path.basename(os.path.realpath(device))
+    LOG.info("Applying tuning profile %s to device %s (%s)", profile_name,
+             device, name)
+
+    # The slaves are tuned first, because the max_sectors_kb of a
+    # device-mapper device may not exceed the ones of its slaves.
+    for slave in slaves(name):
+        _tune(slave, profile)
+    _tune(name, profile)
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
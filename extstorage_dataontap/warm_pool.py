@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 GRNET S.A.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Pool of pre-created and pre-mapped LUNs.
+
+Creating a LUN involves a lookup, a lun-create-by-size and a lun-map call. The
+warm pool keeps a number of LUNs of common sizes that have already been
+created and mapped, so that create only needs to rename one of them. The pool
+is refilled by the dataontap-warm-pool command only.
+"""
+
+import uuid
+import fcntl
+import logging
+
+from extstorage_dataontap import configuration
+from extstorage_dataontap.client import api as netapp_api
+
+LOG = logging.getLogger(__name__)
+
+# Lock file that makes sure only one pool maintainer runs at a time
+LOCK_FILE = '/var/lib/extstorage-dataontap/warm-pool.lock'
+
+# If any of those parameters is overwritten for a disk, the pooled LUNs are
+# not suitable for it.
+PARAMETERS = ('POOL', 'IGROUP', 'LUN_OSTYPE', 'LUN_SPACE_RESERVATION',
+              'BACKEND')
+
+
+class WarmPool(object):
+    """The warm pool of a provider"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.sizes = configuration.WARM_POOL
+        self.prefix = configuration.WARM_POOL_PREFIX
+
+    @property
+    def usable(self):
+        """Check if the pool may be used for the current disk"""
+        overwritten = set(PARAMETERS) & set(configuration.PARAMETERS)
+        if overwritten:
+            LOG.debug("Not using the warm pool. Parameters overwritten: %s",
+                      ", ".join(sorted(overwritten)))
+            return False
+        # The pool is only maintained on the default backend
+        if self.provider.backend['NAME'] != self.provider.default_backend:
+            return False
+        return len(self.sizes) > 0
+
+    def _path(self, name):
+        """Returns the path of a LUN in the pool volume"""
+        return '/vol/%s/%s' % (self.provider.pool_name, name)
+
+    def _size(self, path):
+        """Returns the size in mebibytes encoded in the name of a pooled LUN
+        or None if this is not a pooled LUN"""
+        name = path.rpartition('/')[2]
+        if not name.startswith(self.prefix):
+            return None
+        try:
+            return int(name[len(self.prefix):].split('-')[0])
+        except ValueError:
+            return None
+
+    def list_luns(self):
+        """Returns a dictionary mapping sizes to lists of pooled LUN paths"""
+        client = self.provider.client
+        pool = {}
+        for lun in client.get_lun_by_args(path=self._path(self.prefix + '*')):
+            path = lun.get_child_content('path')
+            size = self._size(path)
+            if size is not None:
+                pool.setdefault(size, []).append(path)
+        return pool
+
+    def claim(self, size, path):
+        """Rename a pooled LUN to path. The LUN is resized if the pool does not
+        have a LUN of the requested size (in mebibytes). Returns True on
+        success and False if no suitable LUN could be claimed."""
+        client = self.provider.client
+        pool = self.list_luns()
+
+        for pool_size in sorted([s for s in pool if s <= size], reverse=True):
+            for lun_path in pool[pool_size]:
+                try:
+                    LOG.debug("Calling move_lun(%s, %s)", lun_path, path)
+                    client.move_lun(lun_path, path)
+                except netapp_api.NaApiError as e:
+                    # Someone else may have claimed the LUN
+                    LOG.debug("Unable to claim LUN %s: %s", lun_path, e)
+                    continue
+
+                LOG.info("Claimed LUN %s from the warm pool", lun_path)
+                if pool_size == size:
+                    return True
+
+                try:
+                    LOG.debug("Calling do_direct_resize(%s, %d)", path,
+                              size * (1024 ** 2))
+                    client.do_direct_resize(path, size * (1024 ** 2))
+                    return True
+                except netapp_api.NaApiError as e:
+                    LOG.warning("Unable to resize claimed LUN %s: %s", path, e)
+
+                # Give the LUN back to the pool
+                try:
+                    LOG.debug("Calling move_lun(%s, %s)", path, lun_path)
+                    client.move_lun(path, lun_path)
+                except netapp_api.NaApiError as e:
+                    LOG.error("Unable to return LUN %s to the warm pool: %s",
+                              path, e)
+                    client.destroy_lun(path)
+                return False
+
+        LOG.info("No suitable LUN found in the warm pool")
+        return False
+
+    def refill(self):
+        """Create the missing LUNs of the pool. Returns the number of LUNs
+        created."""
+        client = self.provider.client
+        pool = self.list_luns()
+        metadata = {'OsType': self.provider.ostype,
+                    'SpaceReserved': self.provider.space_reserved}
+
+        created = 0
+        for size, count in sorted(self.sizes.items()):
+            for _ in xrange(count - len(pool.get(size, []))):
+                name = "%s%d-%s" % (self.prefix, size, uuid.uuid4().hex)
+                LOG.info("Adding LUN %s to the warm pool", name)
+                client.create_lun(self.provider.pool_name, name,
+                                  size * (1024 ** 2), metadata, None)
+                self.provider._map_lun(self._path(name))
+                created += 1
+        return created
+
+    def maintain(self):
+        """Refill the pool unless another maintainer is already running"""
+        if not self.sizes:
+            LOG.info("Warm pool is disabled")
+            return 0
+
+        with open(LOCK_FILE, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                LOG.info("Warm pool maintainer is already running")
+                return 0
+            created = self.refill()
+            LOG.info("Added %d LUN(s) to the warm pool", created)
+        return 0
+
+# vim: set sta sts=4 shiftwidth=4 sw=4 et ai :
@@ -66,7 +66,21 @@ setup(
             'close = extstorage_dataontap.common:close',
             'pre-migrate = extstorage_dataontap.common:pre_move',
             'pre-failover = extstorage_dataontap.common:pre_move',
-            'post-remove = extstorage_dataontap.common:post_remove']},
+            'post-remove = extstorage_dataontap.common:post_remove',
+            'snapshot-instance = '
+            'extstorage_dataontap.common:snapshot_instance',
+            'dataontap-warm-pool = extstorage_dataontap.tools:warm_pool',
+            'dataontap-reaper = extstorage_dataontap.tools:reaper',
+            'dataontap-top = extstorage_dataontap.tools:top',
+            'dataontap-rebalance = extstorage_dataontap.tools:rebalance',
+            'dataontap-lun-maps = extstorage_dataontap.tools:lun_maps',
+            'dataontap-multipath = extstorage_dataontap.tools:multipath',
+            'dataontap-inventory = extstorage_dataontap.tools:inventory',
+            'dataontap-reconcile = extstorage_dataontap.tools:reconcile',
+            'dataontap-instances = extstorage_dataontap.tools:instances',
+            'dataontap-snapshot-instance = '
+            'extstorage_dataontap.tools:snapshot_instance',
+            'dataontap-clone-split = extstorage_dataontap.tools:clone_split']},
     classifiers=[
         'Environment :: Console',
         'License :: OSI Approved :: Apache Software License',